@@ -1,26 +1,47 @@
 import argparse
 import logging
 from pathlib import Path
+import sys
 
-from buildtool.build.main import run_build
-from buildtool.ingest import run_ingest
+from buildtool.build.options import QualityMode, Shard, SrcSetMode
 
 
 logger = logging.getLogger(__name__)
 
 
 def main() -> None:
+    if sys.argv[1:2] == ['serve']:
+        # Has its own options, see buildtool.serve.
+        from buildtool.serve import main as serve_main
+        serve_main(sys.argv[2:], prog='python -m buildtool serve')
+        return
+
     logging.basicConfig(level=logging.INFO)
 
     arg_parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog='To preview the built site, use the serve command (see serve --help).'
     )
     arg_parser.add_argument('-i', '--ingest-path', type=Path, default=Path('./ingest'), help='Directory to ingest new photos from')
     arg_parser.add_argument('-d', '--resource-path', type=Path, default=Path('./resource'), help='Directory containing source data')
     arg_parser.add_argument('-o', '--output-path', type=Path, default=Path('./site'), help='Directory to build site into')
+    arg_parser.add_argument('--output-archive', type=Path, default=None, help='Build the site into an archive instead of the output directory (.tar, .tar.gz, .tar.bz2, .tar.xz, .tar.zst or .zip)')
+    arg_parser.add_argument('-c', '--cache-path', type=Path, default=Path('./.buildcache'), help='Directory to cache intermediate build results in')
+    arg_parser.add_argument('--no-cache', action='store_true', help='Don\'t read or write the build cache')
+    arg_parser.add_argument('--srcset-mode', type=SrcSetMode, choices=list(SrcSetMode), default=SrcSetMode.FIXED, help='How to choose image srcset breakpoints')
+    arg_parser.add_argument('--quality-mode', type=QualityMode, choices=list(QualityMode), default=QualityMode.FIXED, help='How to choose image srcset JPEG quality')
+    arg_parser.add_argument('--measure-encoder-profiles', action='store_true', help='Also encode images without their encoder profile to report the bytes saved (slow)')
+    shard_group = arg_parser.add_mutually_exclusive_group()
+    shard_group.add_argument('--shard', type=Shard.parse, default=None, metavar='I/N', help='Only build shard I of N of the images, to be merged with --merge-shards')
+    shard_group.add_argument('--merge-shards', type=Path, nargs='+', default=[], metavar='SHARD_PATH', help='Reuse images from shard build directories and build the rest of the site')
+    arg_parser.add_argument('--metrics-path', type=Path, default=None, help='Write build metrics to this file (Prometheus text format if it ends with .prom, otherwise JSON)')
+    arg_parser.add_argument('--progress-interval', type=float, default=5, help='Seconds between build progress logs (0 to disable)')
+    arg_parser.add_argument('--workers', type=int, default=None, help='Number of workers to estimate the build time for with --estimate (default: number of CPUs)')
+    arg_parser.add_argument('--verify', action=argparse.BooleanOptionalAction, default=True, help='Check the built site for broken links and images')
     arg_parser.add_argument('-v', '--verbose', action='store_true', help='Log more')
     build_mode_group = arg_parser.add_mutually_exclusive_group()
     build_mode_group.add_argument('--dry-run', action='store_true', help='Simulate actions without writing anything')
+    build_mode_group.add_argument('--estimate', action='store_true', help='Like --dry-run, but instead of building, predict the build time and output size from previous builds')
     build_mode_group.add_argument('--fast', action='store_true', help='Make the build faster by taking shortcuts (for testing only)')
     actions_group = arg_parser.add_mutually_exclusive_group()
     actions_group.add_argument('--ingest', action=argparse.BooleanOptionalAction, default=None, help='Ingest photos')
@@ -41,11 +62,21 @@ def main() -> None:
         ingest = bool(args.ingest)
         build = bool(args.build)
 
+    # Actions are imported only when used, because importing everything is slow and most of it isn't needed for
+    # ingesting or for builds where nothing changed.
+
     if ingest:
-        run_ingest(args.ingest_path, args.resource_path, dry_run=args.dry_run)
+        from buildtool.ingest import run_ingest
+        run_ingest(args.ingest_path, args.resource_path, dry_run=args.dry_run or args.estimate)
 
     if build:
-        run_build(args.output_path, args.resource_path, fast=args.fast, dry_run=args.dry_run)
+        from buildtool.build.main import run_build
+        run_build(args.output_path, args.resource_path, fast=args.fast, dry_run=args.dry_run or args.estimate,
+            cache_path=None if args.no_cache else args.cache_path, srcset_mode=args.srcset_mode,
+            quality_mode=args.quality_mode, measure_encoder_profiles=args.measure_encoder_profiles,
+            output_archive=args.output_archive, shard=args.shard, merge_shard_paths=args.merge_shards,
+            metrics_path=args.metrics_path, progress_interval=args.progress_interval,
+            estimate=args.estimate, estimate_workers=args.workers, verify=args.verify)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,136 @@
+"""Reads photo info for a large synthetic library, and checks that open file descriptors and peak memory stay flat as
+    the library grows, i.e. they depend on the probe concurrency rather than the number of photos. Exits with an error
+    if a check fails, so it can guard against regressions.
+
+Usage: python -m buildtool.benchmark.probe [-n COUNT]"""
+
+import argparse
+from dataclasses import dataclass
+import io
+import os
+from pathlib import Path
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image, ExifTags
+
+from buildtool.photo_info import PHOTO_PROBE_CONCURRENCY, read_photo_infos
+from buildtool.resource.photo import METADATA_FILE_EXTENSION, PhotoResourceRecord
+
+
+def create_synthetic_jpeg() -> bytes:
+    image = Image.new('RGB', (64, 48), (128, 96, 64))
+    # Some EXIF so it's parsed like a real photo.
+    exif = Image.Exif()
+    exif[ExifTags.Base.Model] = 'Synthetic Camera'
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def create_synthetic_library(root: Path, count: int) -> list[PhotoResourceRecord]:
+    image_data = create_synthetic_jpeg()
+    records: list[PhotoResourceRecord] = []
+    for i in range(count):
+        # Grouped into subdirectories like a real library.
+        image_path = root / f'{i // 1000:03}' / f'img{i:06}.jpg'
+        image_path.parent.mkdir(exist_ok=True)
+        image_path.write_bytes(image_data)
+        metadata_path = image_path.with_name(image_path.name + METADATA_FILE_EXTENSION)
+        metadata_path.write_text('{"date": "2024-01-10", "genre": ["abstract"]}')
+        records.append(PhotoResourceRecord(image_path, metadata_path))
+    return records
+
+
+def count_open_fds() -> int:
+    fd_dir = Path('/proc/self/fd') if Path('/proc/self/fd').is_dir() else Path('/dev/fd')
+    return len(os.listdir(fd_dir))
+
+
+def get_peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class FDSampler:
+    """Samples the open file descriptor count in the background, to catch the peak while probes are in flight."""
+
+    def __init__(self, interval: float = 0.002) -> None:
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, count_open_fds())
+            time.sleep(self.interval)
+
+    def __enter__(self) -> 'FDSampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    photo_count: int
+    seconds: float
+    peak_fds: int
+    peak_rss_mb: float
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-n', '--count', type=int, default=10000, help='Number of synthetic photos')
+    arg_parser.add_argument('--batch-size', type=int, default=1000, help='Photos probed between measurements')
+    arg_parser.add_argument('--concurrency', type=int, default=PHOTO_PROBE_CONCURRENCY, help='Photos probed at once')
+    arg_parser.add_argument('--max-rss-growth-mb', type=float, default=20,
+        help='Fail if peak memory grows more than this after the first batch')
+    args = arg_parser.parse_args()
+
+    failures: list[str] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f'Creating {args.count} synthetic photos')
+        records = create_synthetic_library(Path(tmp_dir), args.count)
+
+        baseline_fds = count_open_fds()
+        # Each worker holds at most one image and one metadata file, plus some slack for the sampler and the pool.
+        max_fds = baseline_fds + 2 * args.concurrency + 4
+        results: list[BatchResult] = []
+        for start in range(0, len(records), args.batch_size):
+            batch = records[start:start + args.batch_size]
+            start_time = time.perf_counter()
+            with FDSampler() as sampler:
+                # Results are discarded so only the cost of probing is measured, not of keeping the photo info.
+                read_photo_infos(batch, args.concurrency)
+            results.append(BatchResult(start + len(batch), time.perf_counter() - start_time, sampler.peak,
+                get_peak_rss_mb()))
+
+    print(f'Open file descriptors before probing: {baseline_fds}')
+    for result in results:
+        print(f'{result.photo_count} photos: {result.seconds * 1000:.0f}ms,'
+            f' peak {result.peak_fds} fds, peak {result.peak_rss_mb:.1f}MB RSS')
+
+    peak_fds = max(r.peak_fds for r in results)
+    if peak_fds > max_fds:
+        failures.append(f'{peak_fds} file descriptors open, expected at most {max_fds}')
+    rss_growth_mb = results[-1].peak_rss_mb - results[0].peak_rss_mb
+    if rss_growth_mb > args.max_rss_growth_mb:
+        failures.append(f'Peak memory grew {rss_growth_mb:.1f}MB after the first batch')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Renders the HTML pages for a large synthetic photo library, to measure template compilation (with and without the
+    bytecode cache) and page rendering time, with and without the page cache. Images aren't built, their srcsets are
+    made up.
+
+Usage: python -m buildtool.benchmark.render [-d RESOURCE_PATH] [-n COUNT]"""
+
+import argparse
+from dataclasses import replace
+import logging
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+from buildtool.build.asset.css import build_all_css_assets
+from buildtool.build.asset.js import build_all_js_assets
+from buildtool.build.asset.search import build_search_index
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildContext, BuildDirectory, BuildState, InputChanges
+from buildtool.build.html import build_all_html, create_jinja2_environment
+from buildtool.build.options import QualityMode, SrcSetMode
+from buildtool.build.output import MemoryOutputBackend
+from buildtool.build.progress import BuildMetrics
+from buildtool.photo_collection import PhotoCollection
+from buildtool.photo_info import PhotoInfo
+from buildtool.resource.html import get_html_resources_path
+from buildtool.types import ImageID, ImageSrcSet, PartialDate, PhotoGenre, PhotoID, Size
+from buildtool.url import get_image_base_url
+
+
+SYNTHETIC_SRCSET_WIDTHS = (500, 1000, 2000, 3000)
+
+
+def create_synthetic_srcset(image_id: ImageID) -> ImageSrcSet:
+    base_url = get_image_base_url(image_id)
+    return ImageSrcSet(
+        tuple(ImageSrcSet.Entry(base_url.with_name(f'{width}w.jpg'), Size((width, width * 2 // 3)), f'{width}w')
+            for width in SYNTHETIC_SRCSET_WIDTHS),
+        1, Size((6000, 4000)))
+
+
+def create_synthetic_photo(index: int) -> PhotoInfo:
+    date = PartialDate(2020 + index % 5, index % 12 + 1, index % 28 + 1)
+    return PhotoInfo(
+        source_path=Path(f'img{index:06}.jpg'),
+        id=PhotoID(f'{date.to_str(separator="")}-img{index:06}.jpg'),
+        file_extension='.jpg',
+        date=date,
+        title=f'Synthetic photo {index}',
+        description='A photo which doesn\'t exist.\nSecond line.',
+        location='Sydney, Australia',
+        camera_model='Canon EOS R5',
+        # Some lenses, so lens name formatting is exercised like a real library.
+        lens_model=('EF100-400mm f/4.5-5.6L IS USM', 'EF50mm f/1.8 STM', 'EF-S18-135mm f/3.5-5.6 IS USM')[index % 3],
+        focal_length=100.0,
+        aperture=5.6,
+        exposure_time=0.004,
+        iso=400,
+        genre=(tuple(PhotoGenre)[index % len(PhotoGenre)],),
+        size_px=Size((6000, 4000)))
+
+
+def create_synthetic_context(resource_path: Path, count: int, cache: BuildCache) -> BuildContext:
+    photos = tuple(sorted((create_synthetic_photo(i) for i in range(count)), key=lambda p: p.id))
+    state = BuildState()
+    for photo in photos:
+        image_id = ImageID(f'photo/{photo.id}')
+        state.photo_id_to_image_id[photo.id] = image_id
+        state.image_srcsets[image_id] = create_synthetic_srcset(image_id)
+    # Used by the basic pages.
+    for image_id in (ImageID('general/homepage_hero.jpg'), ImageID('general/the_photographer.jpg')):
+        state.image_srcsets[image_id] = create_synthetic_srcset(image_id)
+    return BuildContext(
+        build_dir=BuildDirectory(MemoryOutputBackend(), fast=False), resources_path=resource_path,
+        fast=False, dry_run=False,
+        srcset_mode=SrcSetMode.FIXED, quality_mode=QualityMode.FIXED,
+        measure_encoder_profiles=False, cache=cache,
+        changes=InputChanges(frozenset(), frozenset(), frozenset()), prebuilt_images={}, shard=None,
+        photos=PhotoCollection(photos),
+        state=state, metrics=BuildMetrics())
+
+
+def measure_template_compilation(html_resources_path: Path, cache: BuildCache) -> float:
+    """Returns seconds to load every page template."""
+
+    start_time = time.perf_counter()
+    jinja2_env = create_jinja2_environment(html_resources_path, cache)
+    for template_name in jinja2_env.list_templates(filter_func=lambda n: n.startswith('pages/')):
+        jinja2_env.get_template(template_name)
+    return time.perf_counter() - start_time
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-d', '--resource-path', type=Path, default=Path('./resource'), help='Resources to build')
+    arg_parser.add_argument('-n', '--count', type=int, default=10000, help='Number of synthetic photos')
+    arg_parser.add_argument('--max-ms-per-page', type=float, default=None, help='Fail if rendering takes longer')
+    args = arg_parser.parse_args()
+
+    # Per page logs would dominate the timing.
+    logging.disable(logging.INFO)
+
+    html_resources_path = get_html_resources_path(args.resource_path)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = BuildCache(Path(tmp_dir), dry_run=False)
+        no_cache_s = measure_template_compilation(html_resources_path, BuildCache(None, dry_run=False))
+        cold_cache_s = measure_template_compilation(html_resources_path, cache)
+        warm_cache_s = measure_template_compilation(html_resources_path, cache)
+        print(f'Template compilation: {no_cache_s * 1000:.1f}ms without bytecode cache,'
+            f' {cold_cache_s * 1000:.1f}ms cold, {warm_cache_s * 1000:.1f}ms warm')
+
+        context = create_synthetic_context(args.resource_path, args.count, cache)
+        build_all_css_assets(context)
+        build_all_js_assets(context)
+        build_search_index(context)
+        start_time = time.perf_counter()
+        build_all_html(context)
+        render_s = time.perf_counter() - start_time
+        # Nothing changed, so every page comes from the page cache.
+        context = replace(context, build_dir=BuildDirectory(MemoryOutputBackend(), fast=False))
+        start_time = time.perf_counter()
+        build_all_html(context)
+        cached_s = time.perf_counter() - start_time
+
+    page_count = len(context.state.html_pages)
+    ms_per_page = render_s * 1000 / page_count
+    print(f'Rendered {page_count} pages: {render_s:.2f}s, {ms_per_page:.2f}ms per page')
+    print(f'Rebuilt {page_count} pages from the page cache: {cached_s:.2f}s,'
+        f' {cached_s * 1000 / page_count:.2f}ms per page')
+
+    if args.max_ms_per_page is not None and ms_per_page > args.max_ms_per_page:
+        print(f'FAIL {ms_per_page:.2f}ms per page exceeds {args.max_ms_per_page}ms')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Compares ImageMagick resize operators for each srcset spec width, on a sample of the photos. Measures wall and CPU
+    time, output size, and error (DSSIM) against a high quality reference downscale, then prints the Pareto optimal
+    operators, i.e. those which no other operator beats on time, size and error at once. The images are encoded with
+    the spec's quality and encoder profile, so sizes and errors are what the build would produce.
+
+Requires ImageMagick. -thumbnail also strips metadata, which flatters its size for specs which keep metadata.
+
+Usage: python -m buildtool.benchmark.resize [-d RESOURCE_PATH] [-n COUNT] [--json RESULTS_PATH]"""
+
+import argparse
+from dataclasses import asdict, dataclass
+import json
+from pathlib import Path
+import resource
+import tempfile
+import time
+
+from PIL import Image, ImageOps
+
+from buildtool.build.asset.image import IMAGE_SRCSET_SPEC, ImageSrcSetSpec
+from buildtool.image import DEFAULT_RESIZE_OPERATOR, SCALE_RESIZE_OPERATOR, ResizeOperator, get_resize_operator, \
+    reencode_image
+from buildtool.image_metric import compute_dssim, image_to_luma
+from buildtool.resource.photo import get_photo_resources_path
+
+
+RESIZE_OPERATORS = (
+    SCALE_RESIZE_OPERATOR,
+    DEFAULT_RESIZE_OPERATOR,
+    *(ResizeOperator(f'resize-{f.lower()}', ('-filter', f, '-resize'))
+        for f in ('Triangle', 'Catrom', 'Mitchell', 'Lanczos', 'LanczosSharp')),
+    ResizeOperator('thumbnail', ('-thumbnail',)),
+    ResizeOperator('sample', ('-sample',)),
+    # Sampling doesn't filter, so soften the aliasing afterwards.
+    ResizeOperator('sample-blur', ('-sample',), ('-blur', '0x0.5')),
+)
+
+
+@dataclass(frozen=True)
+class ResizeResult:
+    photo: str
+    width: int
+    operator: str
+    wall_ms: float
+    cpu_ms: float
+    """ImageMagick's user and system time."""
+    bytes: int
+    dssim: float
+
+
+@dataclass(frozen=True)
+class OperatorSummary:
+    """Means over the sample photos for one width."""
+
+    operator: str
+    wall_ms: float
+    cpu_ms: float
+    bytes: float
+    dssim: float
+
+    def dominates(self, other: 'OperatorSummary') -> bool:
+        """If at least as good on every measure and better on one."""
+
+        mine = (self.cpu_ms, self.bytes, self.dssim)
+        theirs = (other.cpu_ms, other.bytes, other.dssim)
+        return all(a <= b for a, b in zip(mine, theirs)) and mine != theirs
+
+
+def get_children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def choose_sample_photos(resources_path: Path, count: int) -> list[Path]:
+    """Spread over the library, which is sorted by date, so the sample isn't all from one shoot."""
+
+    photos = sorted(get_photo_resources_path(resources_path).rglob('*.jpg'))
+    if len(photos) <= count:
+        return photos
+    return [photos[i * len(photos) // count] for i in range(count)]
+
+
+class ReferenceImages:
+    """High quality downscales of a photo to compare against, made with Pillow's Lanczos filter from the full
+        resolution pixels."""
+
+    def __init__(self, source: Path) -> None:
+        with Image.open(source) as image:
+            self.source = image.convert('RGB')
+            # Stripped encoder profiles bake the orientation into the pixels.
+            self.upright_source = ImageOps.exif_transpose(image).convert('RGB')
+        self._references: dict[tuple[tuple[int, int], bool], Image.Image] = {}
+
+    def get(self, size: tuple[int, int], upright: bool) -> Image.Image:
+        key = (size, upright)
+        if key not in self._references:
+            source = self.upright_source if upright else self.source
+            self._references[key] = source.resize(size, Image.Resampling.LANCZOS)
+        return self._references[key]
+
+
+def measure_resize(source: Path, references: ReferenceImages, spec: ImageSrcSetSpec, operator: ResizeOperator,
+        output_path: Path) -> ResizeResult:
+    cpu_start = get_children_cpu_seconds()
+    wall_start = time.perf_counter()
+    reencode_image(source, output_path, spec.max_width, None, spec.quality, profile=spec.profile, resize=operator)
+    wall_ms = (time.perf_counter() - wall_start) * 1000
+    cpu_ms = (get_children_cpu_seconds() - cpu_start) * 1000
+
+    with Image.open(output_path) as output:
+        reference = references.get(output.size, spec.profile.strip_metadata)
+        dssim = compute_dssim(image_to_luma(reference), image_to_luma(output))
+    return ResizeResult(source.name, spec.max_width, operator.name, wall_ms, cpu_ms, output_path.stat().st_size,
+        dssim)
+
+
+def summarise(results: list[ResizeResult], width: int) -> list[OperatorSummary]:
+    summaries: list[OperatorSummary] = []
+    for operator in RESIZE_OPERATORS:
+        rs = [r for r in results if r.width == width and r.operator == operator.name]
+        if rs:
+            summaries.append(OperatorSummary(operator.name,
+                sum(r.wall_ms for r in rs) / len(rs), sum(r.cpu_ms for r in rs) / len(rs),
+                sum(r.bytes for r in rs) / len(rs), sum(r.dssim for r in rs) / len(rs)))
+    return summaries
+
+
+def print_pareto_table(spec: ImageSrcSetSpec, summaries: list[OperatorSummary]) -> None:
+    current = get_resize_operator(spec.fast).name
+    print(f'\n{spec.max_width}w (quality {spec.quality}, {spec.profile.name}, current: {current})')
+    print(f'  {"operator":<20} {"wall ms":>9} {"CPU ms":>9} {"KB":>8} {"DSSIM":>9}  pareto')
+    for summary in sorted(summaries, key=lambda s: s.cpu_ms):
+        optimal = not any(other.dominates(summary) for other in summaries)
+        marker = '*' if optimal else ''
+        name = summary.operator + (' (current)' if summary.operator == current else '')
+        print(f'  {name:<20} {summary.wall_ms:>9.0f} {summary.cpu_ms:>9.0f} {summary.bytes / 1000:>8.1f}'
+            f' {summary.dssim:>9.6f}  {marker}')
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-d', '--resource-path', type=Path, default=Path('./resource'), help='Resources to sample')
+    arg_parser.add_argument('-n', '--count', type=int, default=4, help='Number of photos to sample')
+    arg_parser.add_argument('--width', type=int, nargs='+', default=None,
+        help='Only these spec widths (default: all)')
+    arg_parser.add_argument('--json', type=Path, default=None, help='Also write every measurement to this file')
+    args = arg_parser.parse_args()
+
+    specs = [s for s in IMAGE_SRCSET_SPEC if args.width is None or s.max_width in args.width]
+    photos = choose_sample_photos(args.resource_path, args.count)
+    print(f'Sampled {len(photos)} photos, {len(specs)} widths, {len(RESIZE_OPERATORS)} operators')
+
+    results: list[ResizeResult] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = Path(tmp_dir) / 'output.jpg'
+        for photo in photos:
+            print(f'Measuring {photo}')
+            references = ReferenceImages(photo)
+            for spec in specs:
+                for operator in RESIZE_OPERATORS:
+                    results.append(measure_resize(photo, references, spec, operator, output_path))
+
+    for spec in specs:
+        print_pareto_table(spec, summarise(results, spec.max_width))
+
+    if args.json is not None:
+        args.json.write_text(json.dumps([asdict(r) for r in results], indent=1), encoding='utf8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Builds the photo search index for a large synthetic library, and reports its size and the latency of queries made
+    with search.js (run by Node.js, if installed). Titles, descriptions and locations are drawn from a made up
+    vocabulary with Zipf distributed word frequencies, like natural language.
+
+Files are read from disk rather than the network, so cold query latency is parsing and searching only, while the
+    transfer each query needs is reported separately (gzip compressed, as the host serves it).
+
+Usage: python -m buildtool.benchmark.search [-d RESOURCE_PATH] [-n COUNT] [-q QUERIES]"""
+
+import argparse
+from dataclasses import replace
+import gzip
+import json
+from pathlib import Path
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from buildtool.benchmark.render import create_synthetic_photo, create_synthetic_srcset
+from buildtool.build.asset.search import SearchIndex, create_search_index, tokenise
+from buildtool.build.common import BuildState
+from buildtool.photo_info import PhotoInfo
+from buildtool.resource.js import get_js_resources_path
+from buildtool.types import ImageID
+
+
+VOCABULARY_SIZE = 5000
+LOCATION_COUNT = 300
+SYLLABLES = ('ka', 'lo', 'mi', 'ren', 'sa', 'tu', 'vel', 'no', 'ar', 'is', 'po', 'dan', 'el', 'fi', 'gor', 'hu', 'ju',
+    'ber', 'que', 'wy', 'zan', 'or', 'cal', 'est')
+
+# Runs queries with a fresh PhotoSearch (nothing loaded) and again with one which already has the files.
+NODE_SCRIPT = '''
+const fs = require('fs');
+const { fileURLToPath } = require('url');
+const { performance } = require('perf_hooks');
+
+const config = JSON.parse(fs.readFileSync(0, 'utf8'));
+const { PhotoSearch } = require(config.script);
+
+let fetched = [];
+function fetchJSON(url) {
+    const path = fileURLToPath(url);
+    fetched.push(path);
+    return Promise.resolve(JSON.parse(fs.readFileSync(path, 'utf8')));
+}
+
+async function main() {
+    const warmSearch = new PhotoSearch(config.indexUrl, fetchJSON);
+    const results = [];
+    for (const query of config.queries) {
+        fetched = [];
+        let start = performance.now();
+        const found = await new PhotoSearch(config.indexUrl, fetchJSON).search(query);
+        const coldMs = performance.now() - start;
+        const files = fetched;
+        await warmSearch.search(query);
+        start = performance.now();
+        await warmSearch.search(query);
+        const warmMs = performance.now() - start;
+        results.push({ query, coldMs, warmMs, files, total: found.total });
+    }
+    process.stdout.write(JSON.stringify(results));
+}
+
+main();
+'''
+
+
+class Vocabulary:
+    def __init__(self, rng: random.Random, size: int) -> None:
+        self.rng = rng
+        words: set[str] = set()
+        while len(words) < size:
+            words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(1, 4))))
+        self.words = sorted(words, key=lambda w: (len(w), w))
+        # Zipf: the nth most common word is n times less common than the most common.
+        self.weights = [1 / (rank + 1) for rank in range(len(self.words))]
+
+    def sample(self, count: int) -> list[str]:
+        return self.rng.choices(self.words, self.weights, k=count)
+
+    def phrase(self, min_words: int, max_words: int) -> str:
+        return ' '.join(self.sample(self.rng.randint(min_words, max_words))).capitalize()
+
+
+def create_synthetic_photos(count: int, rng: random.Random) -> list[PhotoInfo]:
+    """Newest first."""
+
+    vocabulary = Vocabulary(rng, VOCABULARY_SIZE)
+    locations = [f'{vocabulary.phrase(1, 2)}, {vocabulary.phrase(1, 1)}' for _ in range(LOCATION_COUNT)]
+    photos = [replace(create_synthetic_photo(i),
+            title=vocabulary.phrase(2, 5),
+            description=vocabulary.phrase(5, 30) if rng.random() < 0.7 else None,
+            location=rng.choice(locations) if rng.random() < 0.9 else None,
+            aperture=rng.choice((1.8, 2.8, 4.0, 5.6, 8.0, 11.0)),
+            focal_length=float(rng.choice((16, 24, 35, 50, 85, 100, 200, 400))))
+        for i in range(count)]
+    return sorted(photos, key=lambda p: p.id, reverse=True)
+
+
+def create_synthetic_state(photos: list[PhotoInfo]) -> BuildState:
+    state = BuildState()
+    for photo in photos:
+        image_id = ImageID(f'photo/{photo.id}')
+        state.photo_id_to_image_id[photo.id] = image_id
+        state.image_srcsets[image_id] = create_synthetic_srcset(image_id)
+    return state
+
+
+def create_queries(photos: list[PhotoInfo], count: int, rng: random.Random) -> list[str]:
+    """Words from the titles and locations of random photos, so most queries have results: single words, pairs, and
+        partly typed words."""
+
+    queries: list[str] = []
+    while len(queries) < count:
+        photo = rng.choice(photos)
+        words = tokenise(f'{photo.title} {photo.location or ""}')
+        kind = len(queries) % 3
+        if kind == 0:
+            queries.append(f'{rng.choice(words)} ')
+        elif kind == 1 and len(words) >= 2:
+            queries.append(' '.join(rng.sample(words, 2)) + ' ')
+        elif kind == 2:
+            word = rng.choice(words)
+            queries.append(word[:max(2, len(word) // 2)])
+    return queries
+
+
+def print_index_size(index: SearchIndex, compressed: dict[str, int]) -> None:
+    def sizes(names: list[str]) -> str:
+        raw = sum(len(index.files[u].encode('utf8')) for u in index.files if u.name in names)
+        return f'{raw / 1000:.1f}KB ({sum(compressed[n] for n in names) / 1000:.1f}KB gzip)'
+
+    shards = [u.name for u in index.files if u.name.startswith('terms-')]
+    documents = [u.name for u in index.files if u.name.startswith('documents-')]
+    largest_shard = max(shards, key=lambda n: compressed[n])
+    print(f'Index: {index.term_count} terms, {len(index.files)} files, {sizes(list(compressed))} in total')
+    print(f'  Manifest: {sizes([index.manifest_url.name])}')
+    print(f'  {len(shards)} term shards: {sizes(shards)}, largest {sizes([largest_shard])},'
+        f' median {statistics.median(compressed[n] for n in shards) / 1000:.1f}KB gzip')
+    print(f'  {len(documents)} document chunks: {sizes(documents)}')
+
+
+def percentile(values: list[float], p: int) -> float:
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+def measure_queries(node: str, resource_path: Path, index: SearchIndex, compressed: dict[str, int],
+        queries: list[str]) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        for url, content in index.files.items():
+            path = root / str(url).lstrip('/')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content, encoding='utf8')
+        config = {
+            'script': str((get_js_resources_path(resource_path) / 'search.js').resolve()),
+            'indexUrl': (root / str(index.manifest_url).lstrip('/')).as_uri(),
+            'queries': queries
+        }
+        output = subprocess.run([node, '-e', NODE_SCRIPT], input=json.dumps(config), check=True,
+            stdout=subprocess.PIPE, encoding='utf8').stdout
+    results = json.loads(output)
+
+    cold_ms = [r['coldMs'] for r in results]
+    warm_ms = [r['warmMs'] for r in results]
+    fetched_kb = [sum(compressed[Path(f).name] for f in r['files']) / 1000 for r in results]
+    print(f'{len(results)} queries, {statistics.mean(r["total"] for r in results):.0f} results on average:')
+    print(f'  Cold: p50 {percentile(cold_ms, 50):.2f}ms, p95 {percentile(cold_ms, 95):.2f}ms')
+    print(f'  Warm: p50 {percentile(warm_ms, 50):.2f}ms, p95 {percentile(warm_ms, 95):.2f}ms')
+    print(f'  Fetched when cold: p50 {percentile(fetched_kb, 50):.1f}KB, p95 {percentile(fetched_kb, 95):.1f}KB gzip,'
+        f' {statistics.mean(len(r["files"]) for r in results):.1f} files on average')
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-d', '--resource-path', type=Path, default=Path('./resource'),
+        help='Resources containing search.js')
+    arg_parser.add_argument('-n', '--count', type=int, default=10000, help='Number of synthetic photos')
+    arg_parser.add_argument('-q', '--queries', type=int, default=300, help='Number of queries to time')
+    arg_parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic library')
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    photos = create_synthetic_photos(args.count, rng)
+    state = create_synthetic_state(photos)
+    start_time = time.perf_counter()
+    index = create_search_index(photos, state)
+    print(f'Built the index of {len(photos)} photos in {time.perf_counter() - start_time:.2f}s')
+    compressed = {u.name: len(gzip.compress(c.encode('utf8'), 9)) for u, c in index.files.items()}
+    print_index_size(index, compressed)
+
+    node = shutil.which('node')
+    if node is None:
+        print('Node.js not found, not measuring query latency')
+        return
+    measure_queries(node, args.resource_path, index, compressed, create_queries(photos, args.queries, rng))
+
+
+if __name__ == '__main__':
+    main()
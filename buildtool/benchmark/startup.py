@@ -0,0 +1,116 @@
+"""Measures the import time of the command line for each action, and checks that slow dependencies are only imported
+    by the actions that need them. Exits with an error if a check fails, so it can guard against regressions.
+
+Usage: python -m buildtool.benchmark.startup [-d RESOURCE_PATH]"""
+
+import argparse
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+
+
+# Slow to import, and only needed when actually building something.
+HEAVY_MODULES = frozenset({'PIL', 'numpy', 'jinja2', 'minify_html', 'rcssmin', 'rjsmin'})
+
+
+@dataclass(frozen=True)
+class StartupScenario:
+    name: str
+    args: tuple[str, ...]
+    forbidden_modules: frozenset[str]
+    """Top level packages which must not be imported."""
+    setup_args: tuple[str, ...] | None = None
+    """If not None, the command is first run with these arguments (not measured)."""
+
+
+@dataclass(frozen=True)
+class ImportTimeReport:
+    total_us: int
+    modules: frozenset[str]
+    top_level: tuple[tuple[str, int], ...]
+    """(module, cumulative microseconds) of modules imported directly by the command, slowest first."""
+
+
+def parse_import_time(output: str) -> ImportTimeReport:
+    """Parses the output of python -X importtime."""
+
+    modules: set[str] = set()
+    top_level: list[tuple[str, int]] = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+        # Nested imports are indented.
+        if not name.startswith('  '):
+            top_level.append((name.strip(), int(cumulative_us)))
+        modules.add(name.strip())
+    return ImportTimeReport(
+        total_us=sum(us for _, us in top_level),
+        modules=frozenset(modules),
+        top_level=tuple(sorted(top_level, key=lambda m: m[1], reverse=True)))
+
+
+def run_buildtool(args: Sequence[str], import_time: bool = False) -> str:
+    """Returns stderr."""
+
+    command = [sys.executable, *(['-X', 'importtime'] if import_time else []), '-m', 'buildtool', *args]
+    return subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        encoding='utf8').stderr
+
+
+def measure_scenario(scenario: StartupScenario, repeats: int) -> ImportTimeReport:
+    if scenario.setup_args is not None:
+        run_buildtool(scenario.setup_args)
+    reports = [parse_import_time(run_buildtool(scenario.args, import_time=True)) for _ in range(repeats)]
+    # The fastest run has the least noise.
+    return min(reports, key=lambda r: r.total_us)
+
+
+def create_scenarios(resource_path: Path, tmp_path: Path) -> list[StartupScenario]:
+    ingest_path = tmp_path / 'ingest'
+    ingest_path.mkdir()
+    build_args = ('--build', '--fast', '-d', str(resource_path), '-o', str(tmp_path / 'site'),
+        '-c', str(tmp_path / 'cache'))
+    return [
+        StartupScenario('help', ('--help',), HEAVY_MODULES | {'pydantic'}),
+        StartupScenario('serve help', ('serve', '--help'), HEAVY_MODULES),
+        StartupScenario('ingest (empty)', ('--ingest', '-i', str(ingest_path), '-d', str(tmp_path / 'resource')),
+            HEAVY_MODULES),
+        # What a watch loop does most of the time.
+        StartupScenario('build (no changes)', build_args, HEAVY_MODULES, setup_args=build_args),
+    ]
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-d', '--resource-path', type=Path, default=Path('./resource'), help='Resources to build')
+    arg_parser.add_argument('-r', '--repeats', type=int, default=3, help='Times to run each scenario')
+    arg_parser.add_argument('--max-ms', type=float, default=None, help='Fail if any scenario imports take longer')
+    arg_parser.add_argument('--top', type=int, default=5, help='Number of slowest imports to show')
+    args = arg_parser.parse_args()
+
+    failures: list[str] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scenario in create_scenarios(args.resource_path.resolve(), Path(tmp_dir)):
+            report = measure_scenario(scenario, args.repeats)
+            total_ms = report.total_us / 1000
+            print(f'{scenario.name}: {total_ms:.1f}ms')
+            for module, us in report.top_level[:args.top]:
+                print(f'    {module}: {us / 1000:.1f}ms')
+            imported_forbidden = sorted(m for m in scenario.forbidden_modules if m in report.modules)
+            if imported_forbidden:
+                failures.append(f'{scenario.name}: imported {", ".join(imported_forbidden)}')
+            if args.max_ms is not None and total_ms > args.max_ms:
+                failures.append(f'{scenario.name}: {total_ms:.1f}ms exceeds {args.max_ms}ms')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
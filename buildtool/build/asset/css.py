@@ -2,7 +2,7 @@ import logging
 
 from buildtool.build.common import BuildContext
 from buildtool.resource.css import get_css_resources
-from buildtool.url import ASSETS_CSS_URL
+from buildtool.url import ASSETS_CSS_URL, get_fingerprinted_url
 
 from rcssmin import cssmin
 
@@ -13,7 +13,12 @@ logger = logging.getLogger(__name__)
 def build_all_css_assets(context: BuildContext) -> None:
     logger.info('Building CSS assets')
     for full_path, relative_path in get_css_resources(context.resources_path):
-        url = ASSETS_CSS_URL / relative_path
         content = full_path.read_text(encoding='utf-8')
         minified = cssmin(content)
+        # Fingerprinted so it can be cached indefinitely. Pages look up the real URL from the logical one.
+        logical_url = ASSETS_CSS_URL / relative_path
+        url = get_fingerprinted_url(logical_url, minified)
+        context.state.asset_urls[logical_url] = url
         context.build_dir.build_content(minified, url)
+        # Saved for inlining into pages later.
+        context.state.css_assets[url] = minified
@@ -0,0 +1,292 @@
+"""Site graphics (see GRAPHIC_EXTENSIONS), which are optimised losslessly rather than reencoded like photos, unless a
+    lossy JPEG would be much smaller."""
+
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+import io
+import logging
+from pathlib import Path
+import re
+import struct
+import tempfile
+from xml.etree import ElementTree
+
+import numpy as np
+import numpy.typing as npt
+from PIL.Image import Image, fromarray
+import pydantic
+
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildDirectory, BuildState
+from buildtool.image import STRIPPED_ENCODER_PROFILE, open_image_file, read_image_size, reencode_image
+from buildtool.types import ImageID, ImageSrcSet, Size, URLPath
+from buildtool.url import get_image_srcset_url
+
+
+logger = logging.getLogger(__name__)
+
+
+LOSSY_MAX_SIZE_RATIO = 0.8
+"""Lossless output is exact, so only give it up for a clear saving."""
+
+GRAPHIC_OPTIMISER_VERSION = 3
+"""Changing the optimisation must invalidate cached results."""
+
+
+class GraphicRecord(pydantic.BaseModel, frozen=True):
+    """Cached result of optimising one graphic. The output file (optimised, or the lossy JPEG) is cached alongside."""
+
+    lossy: bool
+    lossless_bytes: int
+    lossy_bytes: int | None
+    """None if lossy wasn't possible, e.g. due to transparency."""
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class GraphicOptimiser:
+    CACHE_NAMESPACE = 'graphic'
+
+    def __init__(self, cache: BuildCache, lossy_quality: int, *, fast: bool) -> None:
+        self.cache = cache
+        self.lossy_quality = lossy_quality
+        self.fast = fast
+        # Recompressing with zopfli gives different (smaller) output.
+        zopfli = get_zopfli_png_optimiser() is not None
+        self.code_fingerprint = f'{GRAPHIC_OPTIMISER_VERSION}:zopfli={zopfli}:{LOSSY_MAX_SIZE_RATIO}:{lossy_quality}'
+
+    def build(self, build_dir: BuildDirectory, image_path: Path, image_id: ImageID, base_url: URLPath,
+            state: BuildState) -> ImageSrcSet.Entry | None:
+        """If a lossy JPEG is much smaller, it's built instead as the full size srcset entry, which is returned for
+            the caller to add the smaller entries to."""
+
+        logger.debug(f'Building graphic asset: "{image_path}"')
+        if image_id in state.image_srcsets:
+            raise RuntimeError(f'Duplicate image srcset: {image_id}')
+        if image_path.suffix.lower() == '.svg':
+            image_size = read_svg_size(image_path.read_text(encoding='utf8'))
+        else:
+            image_size = read_image_size(image_path)
+        srcset_descriptor = f'{image_size[0]}w'
+        url = get_image_srcset_url(base_url, srcset_descriptor)
+        lossy_url = get_image_srcset_url(base_url.with_suffix('.jpg'), srcset_descriptor)
+
+        if self.fast:
+            # Optimising takes a while, and the original is equivalent.
+            build_dir.build_file(image_path, url)
+        elif self.build_optimised(build_dir, image_path, url, lossy_url, image_size):
+            return ImageSrcSet.Entry(lossy_url, image_size, srcset_descriptor)
+
+        state.image_sources[image_id] = image_path
+        state.image_srcsets[image_id] = ImageSrcSet((ImageSrcSet.Entry(url, image_size, srcset_descriptor),), 0,
+            image_size)
+        return None
+
+    def build_optimised(self, build_dir: BuildDirectory, image_path: Path, url: URLPath, lossy_url: URLPath,
+            image_size: Size) -> bool:
+        """Returns whether the lossy JPEG was built (to lossy_url) rather than the lossless file."""
+
+        suffix = image_path.suffix.lower()
+        cache_key = f'{self.cache.hash_file(image_path)}:{self.code_fingerprint}'
+        record = self.cache.load(self.CACHE_NAMESPACE, cache_key, GraphicRecord)
+        if record is not None:
+            cached_path = self.cache.load_file(self.CACHE_NAMESPACE, cache_key, '.jpg' if record.lossy else suffix)
+            if cached_path is not None:
+                build_dir.build_file(cached_path, lossy_url if record.lossy else url)
+                return record.lossy
+
+        if suffix == '.svg':
+            data = minify_svg(image_path.read_text(encoding='utf8')).encode('utf8')
+            lossy_data = None
+        else:
+            data = optimise_png(image_path)
+            lossy_data = self.encode_lossy(image_path, image_size)
+        lossy_bytes = len(lossy_data) if lossy_data is not None else None
+        lossy = lossy_bytes is not None and lossy_bytes < len(data) * LOSSY_MAX_SIZE_RATIO
+        record = GraphicRecord(lossy=lossy, lossless_bytes=len(data), lossy_bytes=lossy_bytes)
+        logger.debug(f'Optimised graphic "{image_path}": {record}')
+        if lossy:
+            assert lossy_data is not None
+            # Used as the full size srcset entry, rather than being encoded again with the smaller ones.
+            data, suffix, url = lossy_data, '.jpg', lossy_url
+        self.cache.save(self.CACHE_NAMESPACE, cache_key, record)
+        self.cache.save_file(self.CACHE_NAMESPACE, cache_key, data, suffix)
+        dest_path = build_dir.prepare_file(url)
+        dest_path.write_bytes(data)
+        build_dir.record_file(url)
+        return lossy
+
+    def encode_lossy(self, image_path: Path, image_size: Size) -> bytes | None:
+        """As a JPEG at full resolution, or None if it has transparency, which JPEG can't represent."""
+
+        with open_image_file(image_path) as image:
+            if image.convert('RGBA').getextrema()[3][0] < 255:
+                return None
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lossy_path = Path(tmp_dir) / 'lossy.jpg'
+            reencode_image(image_path, lossy_path, image_size[0], None, self.lossy_quality,
+                profile=STRIPPED_ENCODER_PROFILE)
+            return lossy_path.read_bytes()
+
+
+def get_zopfli_png_optimiser() -> Callable[[bytes], bytes] | None:
+    try:
+        import zopfli.png
+    except ImportError:
+        return None
+    return zopfli.png.optimize
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+@dataclass(frozen=True)
+class PNGHeader:
+    size: Size
+    bit_depth: int
+    """Bits per channel (or per palette index)."""
+    colour_type: int
+
+
+def read_png_header(data: bytes) -> PNGHeader:
+    """From the IHDR chunk, which must be the first."""
+
+    if data[:8] != PNG_SIGNATURE or data[12:16] != b'IHDR':
+        raise ValueError('Not a PNG file')
+    width, height, bit_depth, colour_type = struct.unpack('>IIBB', data[16:26])
+    return PNGHeader(Size((width, height)), bit_depth, colour_type)
+
+
+RGBAArray = npt.NDArray[np.uint8]
+
+
+def decode_png_rgba(data: bytes) -> RGBAArray:
+    """Exact for PNGs of up to 8 bits per channel. Pillow decodes deeper PNGs (e.g. 16 bit RGB) to 8 bits, so comparing
+        those would hide lost precision, and raises ValueError instead."""
+
+    if read_png_header(data).bit_depth > 8:
+        raise ValueError('PNG has more than 8 bits per channel, which can\'t be decoded exactly')
+    with open_image_file(io.BytesIO(data)) as image:
+        return np.asarray(image.convert('RGBA'))
+
+
+def get_reduced_images(rgba: RGBAArray) -> Iterator[tuple[Image, dict[str, object]]]:
+    """Pixel-identical representations with fewer channels or a palette, with their PNG save options."""
+
+    opaque = bool((rgba[..., 3] == 255).all())
+    grey = bool((rgba[..., 0] == rgba[..., 1]).all() and (rgba[..., 1] == rgba[..., 2]).all())
+    if grey:
+        grey_channels = rgba[..., 0] if opaque else rgba[..., [0, 3]]
+        yield fromarray(np.ascontiguousarray(grey_channels), 'L' if opaque else 'LA'), {}
+    yield fromarray(np.ascontiguousarray(rgba[..., :3] if opaque else rgba), 'RGB' if opaque else 'RGBA'), {}
+
+    packed = rgba.reshape(-1, 4).view(np.uint32).ravel()
+    colours, indices = np.unique(packed, return_inverse=True)
+    if len(colours) <= 256:
+        palette = colours.view(np.uint8).reshape(-1, 4)
+        # Translucent entries first, so the transparency chunk can stop at the last of them.
+        order = np.argsort(palette[:, 3] == 255, kind='stable')
+        palette = palette[order]
+        remap = np.empty_like(order)
+        remap[order] = np.arange(len(order))
+        image = fromarray(remap[indices].astype(np.uint8).reshape(rgba.shape[:2]), 'P')
+        # The palette length also sets the bit depth, e.g. 4 bits for up to 16 colours.
+        image.putpalette(palette[:, :3].tobytes())
+        options: dict[str, object] = {}
+        if not opaque:
+            options['transparency'] = palette[:int((palette[:, 3] < 255).sum()), 3].tobytes()
+        yield image, options
+
+
+def optimise_png(source: Path) -> bytes:
+    """Smallest pixel-identical encoding found. Metadata other than the colour profile is dropped.
+        PNGs with more than 8 bits per channel are returned unchanged, because Pillow can only save them at 8 bits."""
+
+    original = source.read_bytes()
+    bit_depth = read_png_header(original).bit_depth
+    if bit_depth > 8:
+        logger.debug(f'Not optimising {bit_depth} bit PNG "{source}"')
+        return original
+    with open_image_file(io.BytesIO(original)) as image:
+        icc_profile = image.info.get('icc_profile')
+        reducible = image.mode in {'1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA'}
+        candidates = [(image.copy(), {})]
+    rgba = decode_png_rgba(original)
+    if reducible:
+        candidates += get_reduced_images(rgba)
+
+    best = original
+    for candidate, options in candidates:
+        buffer = io.BytesIO()
+        candidate.save(buffer, 'PNG', optimize=True, icc_profile=icc_profile, **options)
+        data = buffer.getvalue()
+        if len(data) < len(best) and np.array_equal(decode_png_rgba(data), rgba):
+            best = data
+    zopfli_optimise = get_zopfli_png_optimiser()
+    if zopfli_optimise is not None:
+        data = zopfli_optimise(best)
+        if len(data) < len(best) and np.array_equal(decode_png_rgba(data), rgba):
+            best = data
+    logger.debug(f'Optimised PNG "{source}": {len(original)} -> {len(best)} bytes')
+    return best
+
+
+XML_DECLARATION_PATTERN = re.compile(r'^\s*<\?xml[^>]*\?>')
+XML_COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+SVG_METADATA_PATTERN = re.compile(r'<metadata\b[^>]*?(?:/>|>.*?</metadata>)', re.DOTALL)
+BETWEEN_TAGS_WHITESPACE_PATTERN = re.compile(r'>\s+<')
+BETWEEN_ATTRIBUTES_WHITESPACE_PATTERN = re.compile(r'(["\']|<[\w:.-]+)\s+(?=[\w:.-]+\s*=)')
+TAG_END_WHITESPACE_PATTERN = re.compile(r'(["\'])\s+(/?>)')
+# Whitespace within these is content.
+SVG_TEXT_PATTERN = re.compile(r'<(?:text|tspan|textPath|style|script)\b|xml:space')
+
+
+def minify_svg(content: str) -> str:
+    """Removes comments, editor metadata and formatting whitespace. Returns the content unchanged if the result isn't
+        equivalent XML (e.g. the patterns matched inside an attribute value)."""
+
+    stripped = SVG_METADATA_PATTERN.sub('', XML_COMMENT_PATTERN.sub('', content))
+    minified = XML_DECLARATION_PATTERN.sub('', stripped)
+    if not SVG_TEXT_PATTERN.search(minified):
+        minified = BETWEEN_TAGS_WHITESPACE_PATTERN.sub('><', minified)
+    minified = BETWEEN_ATTRIBUTES_WHITESPACE_PATTERN.sub(r'\1 ', minified)
+    minified = TAG_END_WHITESPACE_PATTERN.sub(r'\1\2', minified).strip()
+    try:
+        equivalent = ElementTree.canonicalize(stripped, strip_text=True) \
+            == ElementTree.canonicalize(minified, strip_text=True)
+    except ElementTree.ParseError:
+        equivalent = False
+    if not equivalent:
+        logger.warning('SVG minification changed the content, leaving it unminified')
+        return content
+    return minified
+
+
+SVG_LENGTH_PATTERN = re.compile(r'^\s*(\d+(?:\.\d*)?|\.\d+)\s*(?:px)?\s*$')
+
+
+def parse_svg_length(value: str | None) -> float | None:
+    """None if absent or relative (e.g. 100%)."""
+
+    if value is None:
+        return None
+    match = SVG_LENGTH_PATTERN.match(value)
+    return float(match[1]) if match else None
+
+
+def read_svg_size(content: str) -> Size:
+    root = ElementTree.fromstring(content)
+    width = parse_svg_length(root.get('width'))
+    height = parse_svg_length(root.get('height'))
+    view_box = root.get('viewBox')
+    if view_box is not None and (width is None or height is None):
+        _, _, view_width, view_height = (float(v) for v in view_box.replace(',', ' ').split())
+        if width is None and height is None:
+            width, height = view_width, view_height
+        elif width is None:
+            width = height * view_width / view_height
+        else:
+            height = width * view_height / view_width
+    if width is None or height is None:
+        raise ValueError('SVG has no absolute size or viewBox')
+    return Size((round(width), round(height)))
@@ -1,14 +1,29 @@
-from dataclasses import dataclass
+from bisect import bisect_left
+from collections.abc import Iterable, Sequence
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
 from functools import partial
 import logging
 from multiprocessing.pool import ThreadPool
-from operator import call
 from pathlib import Path, PurePosixPath
-from typing import Callable
+import tempfile
+import time
+from typing import Any, Callable
 
-from buildtool.build.common import BuildContext, BuildDirectory, BuildState
-from buildtool.image import open_image_file, reencode_image
-from buildtool.resource.image import get_image_resources
+from PIL.Image import Image, Resampling
+import pydantic
+
+from buildtool.build.asset.graphic import GraphicOptimiser
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildContext, BuildDirectory, BuildState, ImageBuildRecord, QualityMode, \
+    ReencodeTrace, SrcSetMode
+from buildtool.build.pixel_store import DecodedPixels, DecodedPixelStore, convert_to_upright_srgb
+from buildtool.image import FULL_METADATA_ENCODER_PROFILE, STRIPPED_ENCODER_PROFILE, \
+    STRIPPED_SUBSAMPLED_ENCODER_PROFILE, JPEGEncoderProfile, RawImageFile, get_resize_operator, open_image_file, \
+    read_image_size, reencode_image
+from buildtool.image_metric import FloatArray, compute_dssim, image_to_luma
+from buildtool.photo_info import PhotoInfo
+from buildtool.resource.image import get_image_resources, is_graphic_file
 from buildtool.types import ImageID, ImageSrcSet, PhotoID, Size, URLPath
 from buildtool.url import PHOTO_IMAGE_DIR, get_image_base_url, get_image_srcset_url
 
@@ -19,27 +34,138 @@ logger = logging.getLogger(__name__)
 def build_all_image_assets(context: BuildContext) -> None:
     logger.info('Building image assets')
 
-    build_operations: list[Callable[[], None]] = []
+    if context.srcset_mode == SrcSetMode.OPTIMISED and not context.fast:
+        ladder_optimiser = SrcSetLadderOptimiser(context.cache, DEFAULT_SRCSET_OPTIMISER_CONFIG)
+    else:
+        ladder_optimiser = None
+
+    if context.quality_mode == QualityMode.PERCEPTUAL and not context.fast:
+        quality_targeter = PerceptualQualityTargeter(context.cache, DEFAULT_PERCEPTUAL_QUALITY_CONFIG)
+    else:
+        quality_targeter = None
+
+    # Lossy fallback uses the quality of the largest srcset entry, which is closest to the original.
+    graphic_optimiser = GraphicOptimiser(context.cache, max(s.quality for s in IMAGE_SRCSET_SPEC), fast=context.fast)
+
+    expected_bytes: Callable[[int, Size], float | None] | None = None
+    if context.dry_run:
+        # Imported here because the estimator depends on this module.
+        from buildtool.build.estimate import load_cost_model
+
+        cost_model = load_cost_model(context.cache)
+        if cost_model is not None:
+            expected_bytes = cost_model.get_reencode_bytes
+
+    # Decoded pixels are only reused within this build.
+    with tempfile.TemporaryDirectory(prefix='buildtool-pixels-') as pixel_store_path:
+        # In fast mode and dry runs, nothing is reencoded.
+        pixel_store = None if context.fast or context.dry_run \
+            else DecodedPixelStore(Path(pixel_store_path), WORKING_COPY_WIDTH)
+        # (image ID, operation)
+        build_operations: list[tuple[ImageID, Callable[[], None]]] = []
+
+        for full_path, relative_path in get_image_resources(context.resources_path):
+            image_id = get_image_id(relative_path)
+            if context.shard is not None and not context.shard.contains(image_id):
+                continue
+            if try_reuse_image_assets(context, image_id, full_path):
+                continue
+            # Note we don't build the original image as that won't be needed with srcsets.
+            # One of the srcset resized images will be picked as the default.
+            if is_graphic_file(full_path):
+                build_function = partial(build_graphic_assets, graphic_optimiser)
+            else:
+                build_function = build_image_srcset_assets
+            build_operations.append((image_id, partial(build_function,
+                context.build_dir, full_path, image_id, get_image_base_url(image_id), context.state,
+                ladder_optimiser=ladder_optimiser, quality_targeter=quality_targeter, pixel_store=pixel_store,
+                measure_encoder_profiles=context.measure_encoder_profiles, fast=context.fast,
+                dry_run=context.dry_run, expected_bytes=expected_bytes)))
+
+        for photo in context.photos:
+            # Partitioned by photo ID rather than image ID so a photo stays in the same shard if its image ID scheme
+            # changes.
+            if context.shard is not None and not context.shard.contains(photo.id):
+                continue
+            image_id = get_photo_image_id(photo.id)
+            context.state.photo_id_to_image_id[photo.id] = image_id
+            if try_reuse_image_assets(context, image_id, photo.source_path):
+                continue
+            # We do build the original here because it will be available for download on the site.
+            build_operations.append((image_id, partial(build_image_srcset_assets,
+                context.build_dir, photo.source_path,
+                image_id,
+                get_image_base_url(image_id), context.state,
+                build_original=True, image_size=photo.size_px,
+                ladder_optimiser=ladder_optimiser, quality_targeter=quality_targeter, pixel_store=pixel_store,
+                measure_encoder_profiles=context.measure_encoder_profiles, fast=context.fast,
+                dry_run=context.dry_run, expected_bytes=expected_bytes)))
+
+        logger.info(f'Reusing {len(context.state.image_srcsets)} prebuilt images,'
+            f' building {len(build_operations)} images')
+        context.metrics.images_reused += len(context.state.image_srcsets)
+        context.metrics.images_built += len(build_operations)
 
-    for full_path, relative_path in get_image_resources(context.resources_path):
-        image_id = get_image_id(relative_path)
-        # Note we don't build the original image as that won't be needed with srcsets.
-        # One of the srcset resized images will be picked as the default.
-        build_operations.append(partial(build_image_srcset_assets,
-            context.build_dir, full_path, image_id, get_image_base_url(image_id), context.state, fast=context.fast))
+        with context.metrics.phase('Images', len(build_operations)) as progress, ThreadPool() as pool:
+            pool.map(lambda operation: progress.run(*operation), build_operations)
 
-    for photo in context.photos:
-        image_id = get_photo_image_id(photo.id)
-        context.state.photo_id_to_image_id[photo.id] = image_id
-        # We do build the original here because it will be available for download on the site.
-        build_operations.append(partial(build_image_srcset_assets,
-            context.build_dir, photo.source_path,
-            image_id,
-            get_image_base_url(image_id), context.state,
-            build_original=True, image_size=photo.size_px, fast=context.fast))
+        if pixel_store is not None:
+            logger.debug(f'Decoded {pixel_store.decodes} images')
+        if context.build_dir.expected:
+            sizes = 'estimated from previous builds' if expected_bytes is not None \
+                else 'unknown without previous builds'
+            logger.info(f'Dry run: skipped reencoding {len(context.build_dir.expected)} srcset images,'
+                f' their sizes are {sizes}')
 
-    with ThreadPool() as pool:
-        pool.map(call, build_operations)
+
+def get_image_sources(resources_path: Path, photos: Iterable[PhotoInfo]) -> dict[ImageID, Path]:
+    """Source image file of every image that will be built."""
+
+    sources = {get_image_id(relative_path): full_path for full_path, relative_path in get_image_resources(resources_path)}
+    sources.update({get_photo_image_id(photo.id): photo.source_path for photo in photos})
+    return sources
+
+
+def try_reuse_image_assets(context: BuildContext, image_id: ImageID, image_path: Path) -> bool:
+    """If the image was already built (see BuildContext.prebuilt_images), adds its assets to this build."""
+
+    record = context.prebuilt_images.get(image_id)
+    if record is None or record.source_path != image_path:
+        return False
+    logger.debug(f'Reusing image srcset assets: "{image_path}"')
+    for url, output in record.outputs.items():
+        context.build_dir.reuse_file(url, output)
+    state = context.state
+    state.image_sources[image_id] = image_path
+    state.image_srcsets[image_id] = record.srcset
+    state.encoder_profiles.update(record.encoder_profiles)
+    state.encoder_profile_baseline_bytes.update(record.encoder_profile_baseline_bytes)
+    if record.fixed_ladder_bytes is not None:
+        state.fixed_ladder_bytes[image_id] = record.fixed_ladder_bytes
+    if record.perceptual_qualities is not None:
+        state.perceptual_qualities[image_id] = record.perceptual_qualities
+    return True
+
+
+def create_image_build_records(context: BuildContext) -> dict[ImageID, ImageBuildRecord]:
+    """Collects what was built for each image, for reuse by the next build."""
+
+    state = context.state
+    manifest = context.build_dir.manifest
+    records: dict[ImageID, ImageBuildRecord] = {}
+    for image_id, srcset in state.image_srcsets.items():
+        urls = [entry.url for entry in srcset] + [get_image_base_url(image_id)]
+        records[image_id] = ImageBuildRecord(
+            source_path=state.image_sources[image_id],
+            srcset=srcset,
+            # The original image is only built for photos.
+            outputs={url: manifest[url] for url in urls if url in manifest},
+            encoder_profiles={url: state.encoder_profiles[url] for url in urls if url in state.encoder_profiles},
+            encoder_profile_baseline_bytes={url: state.encoder_profile_baseline_bytes[url]
+                for url in urls if url in state.encoder_profile_baseline_bytes},
+            fixed_ladder_bytes=state.fixed_ladder_bytes.get(image_id),
+            perceptual_qualities=state.perceptual_qualities.get(image_id))
+    return records
 
 
 def get_image_id(relative_path: Path) -> ImageID:
@@ -59,29 +185,332 @@ class ImageSrcSetSpec:
     quality: int
     fast: bool
     priority: int   # Lower is higher priority.
+    profile: JPEGEncoderProfile
 
 
 IMAGE_SRCSET_SPEC = (
-    ImageSrcSetSpec(2000, 85, False, 3),
-    ImageSrcSetSpec(1100, 80, False, 0),
-    ImageSrcSetSpec(800, 75, False, 1),
-    ImageSrcSetSpec(650, 70, True, 2),
-    ImageSrcSetSpec(500, 65, True, 4),
-    ImageSrcSetSpec(300, 60, True, 5),
-    # ImageSrcSetSpec(200, 60, True, 6),
+    # Largest is the closest to the original, so keep the metadata.
+    ImageSrcSetSpec(2000, 85, False, 3, FULL_METADATA_ENCODER_PROFILE),
+    ImageSrcSetSpec(1100, 80, False, 0, STRIPPED_ENCODER_PROFILE),
+    ImageSrcSetSpec(800, 75, False, 1, STRIPPED_ENCODER_PROFILE),
+    ImageSrcSetSpec(650, 70, True, 2, STRIPPED_ENCODER_PROFILE),
+    ImageSrcSetSpec(500, 65, True, 4, STRIPPED_SUBSAMPLED_ENCODER_PROFILE),
+    ImageSrcSetSpec(300, 60, True, 5, STRIPPED_SUBSAMPLED_ENCODER_PROFILE),
+    # ImageSrcSetSpec(200, 60, True, 6, STRIPPED_SUBSAMPLED_ENCODER_PROFILE),
+)
+
+
+@dataclass(frozen=True)
+class SrcSetOptimiserConfig:
+    target_bytes_step: int
+    """Desired difference in file size between consecutive srcset entries."""
+    min_width: int
+    max_width: int
+    max_count: int
+    probe_count: int
+    """Number of evenly spaced widths to sample the size curve at, in addition to the fixed spec widths."""
+
+
+DEFAULT_SRCSET_OPTIMISER_CONFIG = SrcSetOptimiserConfig(
+    target_bytes_step=40_000,
+    min_width=300,
+    max_width=2000,
+    max_count=7,
+    probe_count=6
 )
 
 
+WORKING_COPY_WIDTH = max(max(s.max_width for s in IMAGE_SRCSET_SPEC), DEFAULT_SRCSET_OPTIMISER_CONFIG.max_width)
+"""Width of the decoded pixels which srcset entries are derived from (see DecodedPixelStore)."""
+
+
+class SrcSetLadderRecord(pydantic.BaseModel, frozen=True):
+    """Cached result of optimising the srcset breakpoints of one image."""
+
+    widths: tuple[int, ...]
+    """Chosen breakpoints, largest first."""
+    qualities: tuple[int, ...]
+    fixed_ladder_bytes: int
+    """Total size of the entries IMAGE_SRCSET_SPEC would have produced, for comparison."""
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class SrcSetLadderOptimiser:
+    """Picks srcset breakpoints per image so that consecutive entries differ by roughly a fixed number of bytes.
+        Busy images get more breakpoints, flat images get fewer."""
+
+    CACHE_NAMESPACE = 'srcset-ladder'
+    # Changing how sizes are measured must invalidate cached results.
+    VERSION = 2
+
+    def __init__(self, cache: BuildCache, config: SrcSetOptimiserConfig) -> None:
+        self.cache = cache
+        self.config = config
+
+    def get_specs(self, image_path: Path, image_id: ImageID, image_size: Size, pixels: DecodedPixels | None,
+            state: BuildState) -> tuple[ImageSrcSetSpec, ...]:
+        """pixels is None in dry runs, which only use cached results."""
+
+        cache_key = f'{self.VERSION}:{self.cache.hash_file(image_path)}:{image_size}:{self.config}:{IMAGE_SRCSET_SPEC}'
+        record = self.cache.load(self.CACHE_NAMESPACE, cache_key, SrcSetLadderRecord)
+        if record is None:
+            if self.cache.dry_run:
+                # Probing is slow, and in a dry run the result can't be saved to the cache.
+                logger.debug(f'No cached srcset ladder, using fixed spec: "{image_path}"')
+                return IMAGE_SRCSET_SPEC
+            assert pixels is not None
+            record = self.compute_ladder(image_path, image_size, pixels)
+            self.cache.save(self.CACHE_NAMESPACE, cache_key, record)
+        logger.debug(f'Srcset ladder for "{image_path}": {record}')
+        state.fixed_ladder_bytes[image_id] = record.fixed_ladder_bytes
+
+        default_width = min(IMAGE_SRCSET_SPEC, key=lambda s: s.priority).max_width
+        default_idx = min(range(len(record.widths)), key=lambda i: abs(record.widths[i] - default_width))
+        specs: list[ImageSrcSetSpec] = []
+        for i, (width, quality) in enumerate(zip(record.widths, record.qualities)):
+            # The entry closest to the fixed spec's default gets top priority, the rest are in order of size.
+            priority = 0 if i == default_idx else i + 1
+            specs.append(replace(create_optimised_spec(width, priority, largest=i == 0), quality=quality))
+        return tuple(specs)
+
+    def compute_ladder(self, image_path: Path, image_size: Size, pixels: DecodedPixels) -> SrcSetLadderRecord:
+        logger.debug(f'Optimising srcset breakpoints: "{image_path}"')
+        max_width = min(self.config.max_width, image_size[0])
+        min_width = min(self.config.min_width, max_width)
+        fixed_widths = [s.max_width for s in IMAGE_SRCSET_SPEC if s.max_width <= image_size[0]]
+        probe_width_set = set(fixed_widths)
+        if self.config.probe_count > 1:
+            step = (max_width - min_width) / (self.config.probe_count - 1)
+            probe_width_set.update(round(min_width + i * step) for i in range(self.config.probe_count))
+        else:
+            probe_width_set.add(max_width)
+        probe_widths = sorted(w for w in probe_width_set if w <= image_size[0])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Specs (ignoring priority) -> bytes. The fixed ladder and the probes may share some.
+            measured: dict[ImageSrcSetSpec, int] = {}
+
+            def measure_bytes(spec: ImageSrcSetSpec) -> int:
+                """Encodes like the srcset entry would be built, so the fixed and optimised ladders are comparable."""
+
+                key = replace(spec, priority=0)
+                if key not in measured:
+                    probe_path = Path(tmp_dir) / f'{len(measured)}.jpg'
+                    # Only the largest entry keeps metadata, and it's reencoded from the original.
+                    source = pixels.raw if spec.profile.strip_metadata else image_path
+                    reencode_image(source, probe_path, spec.max_width, None, spec.quality, spec.fast, spec.profile)
+                    measured[key] = probe_path.stat().st_size
+                return measured[key]
+
+            probe_bytes = [measure_bytes(create_optimised_spec(w, 0, largest=w == max_width)) for w in probe_widths]
+            fixed_ladder_bytes = sum(measure_bytes(s) for s in IMAGE_SRCSET_SPEC if s.max_width <= image_size[0])
+        logger.debug(f'Srcset size probes for "{image_path}": {list(zip(probe_widths, probe_bytes))}')
+
+        def estimate_bytes(width: int) -> float:
+            # Piecewise linear interpolation between the probes.
+            idx = bisect_left(probe_widths, width)
+            if idx < len(probe_widths) and probe_widths[idx] == width:
+                return probe_bytes[idx]
+            if idx == 0:
+                return probe_bytes[0]
+            if idx == len(probe_widths):
+                return probe_bytes[-1]
+            w0, w1 = probe_widths[idx - 1], probe_widths[idx]
+            b0, b1 = probe_bytes[idx - 1], probe_bytes[idx]
+            return b0 + (b1 - b0) * (width - w0) / (w1 - w0)
+
+        # Widen the step if needed so the ladder fits within max_count.
+        max_bytes = estimate_bytes(max_width)
+        total_range = max_bytes - estimate_bytes(min_width)
+        bytes_step = max(self.config.target_bytes_step, total_range / max(self.config.max_count - 1, 1))
+        # Walk down from the largest width, adding a breakpoint each time the size drops by another step.
+        widths = [max_width]
+        width_step = 10
+        width = max_width - max_width % width_step
+        while width > min_width and len(widths) < self.config.max_count:
+            if estimate_bytes(width) <= max_bytes - len(widths) * bytes_step:
+                widths.append(width)
+            width -= width_step
+        # Always finish at the smallest width so small screens are served, unless the last entry is nearly as small.
+        if widths[-1] != min_width:
+            if len(widths) < self.config.max_count and estimate_bytes(widths[-1]) - estimate_bytes(min_width) >= bytes_step / 2:
+                widths.append(min_width)
+            else:
+                widths[-1] = min_width
+
+        return SrcSetLadderRecord(
+            widths=tuple(widths),
+            qualities=tuple(interpolate_quality(w) for w in widths),
+            fixed_ladder_bytes=fixed_ladder_bytes)
+
+
+@dataclass(frozen=True)
+class PerceptualQualityConfig:
+    target_dssim: float
+    """Maximum acceptable structural dissimilarity from the reference resize (0 is identical)."""
+    min_quality: int
+    max_quality: int
+
+
+DEFAULT_PERCEPTUAL_QUALITY_CONFIG = PerceptualQualityConfig(
+    target_dssim=0.015,
+    min_quality=50,
+    max_quality=90
+)
+
+
+class PerceptualQualityRecord(pydantic.BaseModel, frozen=True):
+    """Cached result of the quality search for one srcset entry."""
+
+    quality: int
+    dssim: float
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class PerceptualQualityTargeter:
+    """Chooses the JPEG quality of each srcset entry as the lowest that stays within a perceptual error target,
+        instead of using the fixed quality from the spec."""
+
+    CACHE_NAMESPACE = 'perceptual-quality'
+    # Changing how quality is measured must invalidate cached results.
+    VERSION = 2
+
+    def __init__(self, cache: BuildCache, config: PerceptualQualityConfig) -> None:
+        self.cache = cache
+        self.config = config
+
+    def apply(self, image_path: Path, image_id: ImageID, image_size: Size, specs: Sequence[ImageSrcSetSpec],
+            pixels: DecodedPixels | None, state: BuildState) -> tuple[ImageSrcSetSpec, ...]:
+        """pixels is None in dry runs, which only use cached results."""
+
+        source_hash = self.cache.hash_file(image_path)
+        source_image: Image | None = None
+        result: list[ImageSrcSetSpec] = []
+        chosen: dict[int, int] = {}
+        for spec in specs:
+            if spec.max_width > image_size[0]:
+                # Won't be built anyway.
+                result.append(spec)
+                continue
+            cache_key = f'{self.VERSION}:{source_hash}:{spec.max_width}:{spec.fast}:{spec.profile}:{self.config}'
+            record = self.cache.load(self.CACHE_NAMESPACE, cache_key, PerceptualQualityRecord)
+            if record is None:
+                if self.cache.dry_run:
+                    # Searching is slow, and in a dry run the result can't be saved to the cache.
+                    result.append(spec)
+                    continue
+                assert pixels is not None
+                if source_image is None:
+                    # Only convert the pixels if something isn't cached, and only once for all entries.
+                    source_image = pixels.to_srgb_image()
+                record = self.search_quality(image_path, pixels, source_image, spec)
+                self.cache.save(self.CACHE_NAMESPACE, cache_key, record)
+            logger.debug(f'Perceptual quality for "{image_path}" max_width={spec.max_width}: {record}')
+            chosen[spec.max_width] = record.quality
+            result.append(replace(spec, quality=record.quality))
+        if source_image is not None:
+            source_image.close()
+        state.perceptual_qualities[image_id] = chosen
+        return tuple(result)
+
+    def search_quality(self, image_path: Path, pixels: DecodedPixels, source_image: Image, spec: ImageSrcSetSpec) \
+            -> PerceptualQualityRecord:
+        """Each candidate quality is encoded like the srcset entry is built (same source, resize operator and encoder
+            profile), and compared with a high quality resize of the source."""
+
+        reference_luma: FloatArray | None = None
+        dssim_cache: dict[int, float] = {}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            def measure(quality: int) -> float:
+                nonlocal reference_luma
+                if quality not in dssim_cache:
+                    encoded_path = Path(tmp_dir) / f'{quality}.jpg'
+                    # Only the largest entry keeps metadata, and it's reencoded from the original.
+                    source = pixels.raw if spec.profile.strip_metadata else image_path
+                    reencode_image(source, encoded_path, spec.max_width, None, quality, spec.fast, spec.profile)
+                    # Entries which keep metadata aren't upright or sRGB until displayed.
+                    with open_image_file(encoded_path) as encoded_file, \
+                            convert_to_upright_srgb(encoded_file) as encoded:
+                        if reference_luma is None:
+                            # Sized like the output, whose height may be rounded differently.
+                            with source_image.resize(encoded.size, Resampling.LANCZOS) as reference_image:
+                                reference_luma = image_to_luma(reference_image)
+                        dssim_cache[quality] = compute_dssim(reference_luma, image_to_luma(encoded))
+                return dssim_cache[quality]
+
+            # Binary search for the lowest quality meeting the target, assuming error decreases with quality.
+            low = self.config.min_quality
+            high = self.config.max_quality
+            if measure(high) > self.config.target_dssim:
+                # Can't meet the target within range, best we can do.
+                return PerceptualQualityRecord(quality=high, dssim=measure(high))
+            while low < high:
+                mid = (low + high) // 2
+                if measure(mid) <= self.config.target_dssim:
+                    high = mid
+                else:
+                    low = mid + 1
+            return PerceptualQualityRecord(quality=low, dssim=measure(low))
+
+
+def get_nearest_fixed_spec(width: int) -> ImageSrcSetSpec:
+    """Finds the smallest fixed spec at least as wide as the given width."""
+
+    specs = sorted(IMAGE_SRCSET_SPEC, key=lambda s: s.max_width)
+    for spec in specs:
+        if spec.max_width >= width:
+            return spec
+    return specs[-1]
+
+
+def create_optimised_spec(width: int, priority: int, *, largest: bool) -> ImageSrcSetSpec:
+    """Spec of an entry of an optimised ladder, with the settings of the nearest fixed spec."""
+
+    nearest_spec = get_nearest_fixed_spec(width)
+    # The largest entry is the one that keeps the metadata. Others near it would otherwise keep it too.
+    if largest:
+        profile = FULL_METADATA_ENCODER_PROFILE
+    elif not nearest_spec.profile.strip_metadata:
+        profile = STRIPPED_ENCODER_PROFILE
+    else:
+        profile = nearest_spec.profile
+    return ImageSrcSetSpec(width, interpolate_quality(width), nearest_spec.fast, priority, profile)
+
+
+def interpolate_quality(width: int) -> int:
+    """Computes the quality for an arbitrary width by interpolating the fixed spec."""
+
+    specs = sorted(IMAGE_SRCSET_SPEC, key=lambda s: s.max_width)
+    if width <= specs[0].max_width:
+        return specs[0].quality
+    for lower, upper in zip(specs, specs[1:]):
+        if width <= upper.max_width:
+            t = (width - lower.max_width) / (upper.max_width - lower.max_width)
+            return round(lower.quality + t * (upper.quality - lower.quality))
+    return specs[-1].quality
+
+
 def build_image_srcset_assets(build_dir: BuildDirectory, image_path: Path, image_id: ImageID, base_url: URLPath,
-        state: BuildState, build_original: bool = False, image_size: Size | None = None, *, fast: bool = False) -> None:
-    logger.info(f'Building image srcset assets: "{image_path}"')
+        state: BuildState, build_original: bool = False, image_size: Size | None = None, *,
+        ladder_optimiser: SrcSetLadderOptimiser | None = None,
+        quality_targeter: PerceptualQualityTargeter | None = None, measure_encoder_profiles: bool = False,
+        pixel_store: DecodedPixelStore | None = None, fast: bool = False, dry_run: bool = False,
+        expected_bytes: Callable[[int, Size], float | None] | None = None,
+        full_size_entry: ImageSrcSet.Entry | None = None) -> None:
+    """In a dry run, the srcset entries are only recorded as expected outputs, because reencoding takes most of the
+        build time. Their sizes are from expected_bytes(quality, size), if given.
+        full_size_entry is an already built entry at the image's size, which is added after the others."""
+
+    logger.debug(f'Building image srcset assets: "{image_path}"')
     
     if build_original:
         build_dir.build_file(image_path, base_url)
     
     if image_size is None:
-        image = open_image_file(image_path)
-        image_size = Size((image.width, image.height))
+        image_size = read_image_size(image_path)
 
     if fast:
         # Reencoding the images takes a while due because they are quite large.
@@ -91,43 +520,77 @@ def build_image_srcset_assets(build_dir: BuildDirectory, image_path: Path, image
         build_dir.build_file(image_path, url)
         srcset_entries = [(0, ImageSrcSet.Entry(url, image_size, srcset_descriptor))]
     else:
-        # Strategy to improve performance is to initially reencode the image to the largest srcset size, then use that
-        # as the base image for subsequent reencodings.
-        # Also, for the smallest size, use the next smallest image for reencoding, because it's probably small enough
-        # that quality barely matters.
-        # This improves performance significantly because the original image may be very large.
+        # Decoding the original image takes a while because it may be very large, so decode it once into a smaller
+        # working copy and derive the srcset entries from that, rather than decoding the original for every entry.
+        # The working copy is also upright and sRGB, so is only used for entries which strip metadata.
 
         # TODO: use multiple operations with on image magick call?
 
-        # List of (priority, entry) tuples.
-        srcset_entries: list[tuple[int, ImageSrcSet.Entry]] = []
-        reencoding_base_image: Path | None = None
-        prev_dest_path: Path | None = None
-        for spec_idx, spec in enumerate(sorted(IMAGE_SRCSET_SPEC, key=lambda s: s.max_width, reverse=True)):
-            # Only need to do anything if the new size is smaller than the original image.
-            # Upsampling is pointless, only wastes space.
-            if spec.max_width <= image_size[0]:
-                new_size = calculate_new_image_size(image_size, spec.max_width)
-                srcset_descriptor = f'{new_size[0]}w'
-                url = get_image_srcset_url(base_url, srcset_descriptor)
-                logger.info(f'Build image srcset asset URL: {url}')
-                dest_path = build_dir.prepare_file(url.fs_path)
-                logger.debug(f'Image srcset size: max_width={spec.max_width} size={new_size} quality={spec.quality}')
-                if reencoding_base_image is None:
-                    # For largest size: reencode from the original image.
-                    reencoding_src_path = image_path
-                    reencoding_base_image = dest_path
-                elif spec_idx == len(IMAGE_SRCSET_SPEC) - 1 and prev_dest_path is not None:
-                    # For smallest size: reencode from the 2nd smallest image.
-                    reencoding_src_path = prev_dest_path
-                else:
-                    # For all other sizes: reencode from the largest reencoded image.
-                    reencoding_src_path = reencoding_base_image
-                logger.debug(f'Reencoding image: "{reencoding_src_path}" -> "{dest_path}"')
-                if not build_dir.dry_run:
-                    reencode_image(reencoding_src_path, dest_path, spec.max_width, None, spec.quality, spec.fast)
-                srcset_entries.append((spec.priority, ImageSrcSet.Entry(url, new_size, srcset_descriptor)))
-                prev_dest_path = dest_path
+        if pixel_store is None and not dry_run:
+            raise ValueError('pixel_store is required unless fast or dry_run')
+        with pixel_store.open(image_path) if pixel_store is not None else nullcontext() as pixels:
+            specs: Sequence[ImageSrcSetSpec]
+            if ladder_optimiser is not None:
+                specs = ladder_optimiser.get_specs(image_path, image_id, image_size, pixels, state)
+            else:
+                specs = IMAGE_SRCSET_SPEC
+            if quality_targeter is not None:
+                specs = quality_targeter.apply(image_path, image_id, image_size, specs, pixels, state)
+
+            # List of (priority, entry) tuples.
+            srcset_entries: list[tuple[int, ImageSrcSet.Entry]] = []
+            if full_size_entry is not None:
+                srcset_entries.append((len(specs), full_size_entry))
+            # Largest reencoding which kept the metadata.
+            metadata_image: Path | None = None
+            metadata_image_size = image_size
+            for spec in sorted(specs, key=lambda s: s.max_width, reverse=True):
+                # Only need to do anything if the new size is smaller than the original image.
+                # Upsampling is pointless, only wastes space.
+                if spec.max_width < image_size[0] or (spec.max_width == image_size[0] and full_size_entry is None):
+                    new_size = calculate_new_image_size(image_size, spec.max_width)
+                    srcset_descriptor = f'{new_size[0]}w'
+                    url = get_image_srcset_url(base_url, srcset_descriptor)
+                    logger.debug(f'Build image srcset asset URL: {url}')
+                    state.encoder_profiles[url] = spec.profile.name
+                    if dry_run or pixels is None:
+                        size_estimate = expected_bytes(spec.quality, new_size) if expected_bytes is not None else None
+                        build_dir.record_expected_file(url, round(size_estimate or 0))
+                        srcset_entries.append((spec.priority, ImageSrcSet.Entry(url, new_size, srcset_descriptor)))
+                        continue
+                    dest_path = build_dir.prepare_file(url)
+                    logger.debug(f'Image srcset size: max_width={spec.max_width} size={new_size} quality={spec.quality}'
+                        f' profile={spec.profile.name}')
+                    reencoding_src: Path | RawImageFile
+                    if spec.profile.strip_metadata:
+                        reencoding_src = pixels.raw
+                        reencoding_src_size = pixels.size
+                    elif metadata_image is not None:
+                        # Metadata can't come from the working copy, but the largest reencoding has it too.
+                        reencoding_src = metadata_image
+                        reencoding_src_size = metadata_image_size
+                    else:
+                        reencoding_src = image_path
+                        reencoding_src_size = image_size
+                    logger.debug(f'Reencoding image: "{reencoding_src}" -> "{dest_path}"')
+                    start_time = time.perf_counter()
+                    reencode_image(
+                        reencoding_src, dest_path, spec.max_width, None, spec.quality, spec.fast, spec.profile)
+                    seconds = time.perf_counter() - start_time
+                    build_dir.record_file(url)
+                    # The height may be rounded differently, especially when resizing the working copy.
+                    new_size = read_image_size(dest_path)
+                    state.reencode_traces.append(ReencodeTrace(get_resize_operator(spec.fast).name,
+                        reencoding_src_size[0] * reencoding_src_size[1], new_size[0] * new_size[1], spec.quality,
+                        seconds, build_dir.manifest[url].size))
+                    if measure_encoder_profiles:
+                        # The baseline passes metadata through, so it needs a source which has it.
+                        state.encoder_profile_baseline_bytes[url] = measure_baseline_encoding(
+                            metadata_image or image_path, spec)
+                    if not spec.profile.strip_metadata and metadata_image is None:
+                        metadata_image = dest_path
+                        metadata_image_size = new_size
+                    srcset_entries.append((spec.priority, ImageSrcSet.Entry(url, new_size, srcset_descriptor)))
 
     if not srcset_entries:
         raise RuntimeError('Empty image srcset')
@@ -137,10 +600,29 @@ def build_image_srcset_assets(build_dir: BuildDirectory, image_path: Path, image
     if image_id in state.image_srcsets:
         # Probably a bug if we're overwriting.
         raise RuntimeError(f'Duplicate image srcset: {image_id}')
+    state.image_sources[image_id] = image_path
     sorted_entries = sorted(srcset_entries, key=lambda e: e[0])
     state.image_srcsets[image_id] = ImageSrcSet(tuple(entry for _, entry in sorted_entries), 0, image_size)
 
 
+def build_graphic_assets(graphic_optimiser: GraphicOptimiser, build_dir: BuildDirectory, image_path: Path,
+        image_id: ImageID, base_url: URLPath, state: BuildState, **srcset_options: Any) -> None:
+    full_size_entry = graphic_optimiser.build(build_dir, image_path, image_id, base_url, state)
+    if full_size_entry is not None:
+        # A lossy JPEG is much smaller, so treat it like a photo.
+        build_image_srcset_assets(build_dir, image_path, image_id, base_url.with_suffix('.jpg'), state,
+            full_size_entry=full_size_entry, **srcset_options)
+
+
+def measure_baseline_encoding(source_path: Path, spec: ImageSrcSetSpec) -> int:
+    """Size of the image if encoded without an encoder profile, for comparison."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        baseline_path = Path(tmp_dir) / 'baseline.jpg'
+        reencode_image(source_path, baseline_path, spec.max_width, None, spec.quality, spec.fast)
+        return baseline_path.stat().st_size
+
+
 def calculate_new_image_size(image_size: Size, max_width: int) -> Size:
     width, height = image_size
     assert max_width <= width
@@ -2,7 +2,7 @@ import logging
 
 from buildtool.build.common import BuildContext
 from buildtool.resource.js import get_js_resources
-from buildtool.url import ASSETS_JS_URL
+from buildtool.url import ASSETS_JS_URL, get_fingerprinted_url
 
 from rjsmin import jsmin
 
@@ -13,7 +13,10 @@ logger = logging.getLogger(__name__)
 def build_all_js_assets(context: BuildContext) -> None:
     logger.info('Building JS assets')
     for full_path, relative_path in get_js_resources(context.resources_path):
-        url = ASSETS_JS_URL / relative_path
         content = full_path.read_text(encoding='utf-8')
         minified = jsmin(content)
+        # Fingerprinted so it can be cached indefinitely. Pages look up the real URL from the logical one.
+        logical_url = ASSETS_JS_URL / relative_path
+        url = get_fingerprinted_url(logical_url, minified)
+        context.state.asset_urls[logical_url] = url
         context.build_dir.build_content(minified, url)
@@ -0,0 +1,159 @@
+"""Prebuilt index for searching photos in the browser, without a server (see resource/js/search.js).
+
+The index is split into files so a query only fetches what it needs:
+- a manifest, listing the other files;
+- term shards, holding the postings of all terms starting with the same characters (see SEARCH_SHARD_PREFIX_LENGTH);
+- document chunks, holding what the results list shows for a range of photos.
+
+All are fingerprinted, so they can be cached forever, and only the pages referencing the manifest change when the
+index does."""
+
+from collections import defaultdict
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+import json
+import logging
+import re
+import unicodedata
+
+from buildtool.build.common import BuildContext, BuildState
+from buildtool.build.html import F_NUMBER_SYMBOL, create_photo_settings_list
+from buildtool.photo_info import PhotoInfo
+from buildtool.types import URLPath
+from buildtool.url import ASSETS_SEARCH_URL, get_fingerprinted_url, get_photo_page_url
+
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_INDEX_VERSION = 1
+"""Must match search.js."""
+
+SEARCH_FIELD_WEIGHTS = {
+    'title': 4,
+    'location': 3,
+    'genre': 2,
+    'description': 1,
+    'settings': 1,
+    'year': 1
+}
+
+SEARCH_SHARD_PREFIX_LENGTH = 2
+"""Terms are sharded by this many leading characters. Prefix queries shorter than this only match whole terms."""
+
+SEARCH_DOCUMENTS_PER_CHUNK = 32
+"""Results fetch whole chunks, so small chunks waste less (at 10k photos, 32 halves what a query fetches compared
+    to 128), at the cost of a longer manifest."""
+
+# Must match search.js. Decimals are kept together so e.g. apertures can be found.
+SEARCH_TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)*')
+
+
+def tokenise(text: str) -> list[str]:
+    """Lowercase ASCII words, with accents removed. Other scripts are dropped."""
+
+    text = unicodedata.normalize('NFKD', text.replace(F_NUMBER_SYMBOL, 'f'))
+    return SEARCH_TOKEN_PATTERN.findall(text.encode('ascii', 'ignore').decode('ascii').lower())
+
+
+def get_search_fields(photo: PhotoInfo) -> dict[str, str]:
+    return {
+        'title': photo.title or '',
+        'location': photo.location or '',
+        'genre': ' '.join(photo.genre),
+        'description': photo.description or '',
+        'settings': ' '.join(create_photo_settings_list(photo)),
+        'year': str(photo.date.year or '')
+    }
+
+
+def get_shard_key(term: str) -> str:
+    return term[:SEARCH_SHARD_PREFIX_LENGTH]
+
+
+def encode_postings(postings: Mapping[int, int]) -> list[int]:
+    """Flat list of (document ID delta, score) pairs, in document order. Deltas are smaller than IDs in JSON."""
+
+    encoded: list[int] = []
+    previous_id = 0
+    for document_id in sorted(postings):
+        encoded += [document_id - previous_id, postings[document_id]]
+        previous_id = document_id
+    return encoded
+
+
+def create_search_document(photo: PhotoInfo, state: BuildState) -> list[str]:
+    """What a search result shows: [title, page URL, thumbnail URL, date, location]."""
+
+    srcset = state.image_srcsets[state.photo_id_to_image_id[photo.id]]
+    thumbnail = min(srcset, key=lambda e: e.size_px[0])
+    return [photo.title or photo.id.split('.')[0], str(get_photo_page_url(photo.id)), str(thumbnail.url),
+        photo.date.to_str('-'), photo.location or '']
+
+
+def dump_json(value: object) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+@dataclass(frozen=True)
+class SearchIndex:
+    manifest_url: URLPath
+    files: dict[URLPath, str]
+    """Including the manifest."""
+    term_count: int
+
+
+def create_search_index(photos: Iterable[PhotoInfo], state: BuildState) -> SearchIndex:
+    """Document IDs are in the given order, which is also how results with equal scores are ordered."""
+
+    # Term -> document ID -> score.
+    term_postings: defaultdict[str, dict[int, int]] = defaultdict(dict)
+    documents: list[list[str]] = []
+    for document_id, photo in enumerate(photos):
+        documents.append(create_search_document(photo, state))
+        for field, text in get_search_fields(photo).items():
+            for token in tokenise(text):
+                postings = term_postings[token]
+                postings[document_id] = postings.get(document_id, 0) + SEARCH_FIELD_WEIGHTS[field]
+
+    shards: defaultdict[str, dict[str, list[int]]] = defaultdict(dict)
+    for term in sorted(term_postings):
+        shards[get_shard_key(term)][term] = encode_postings(term_postings[term])
+
+    files: dict[URLPath, str] = {}
+
+    def add_file(name: str, content: str) -> str:
+        url = get_fingerprinted_url(ASSETS_SEARCH_URL / name, content)
+        files[url] = content
+        # Relative to the manifest.
+        return url.name
+
+    shard_names = {key: add_file(f'terms-{key.replace(".", "_")}.json', dump_json(terms))
+        for key, terms in sorted(shards.items())}
+    document_names = [add_file(f'documents-{i // SEARCH_DOCUMENTS_PER_CHUNK}.json',
+            dump_json(documents[i:i + SEARCH_DOCUMENTS_PER_CHUNK]))
+        for i in range(0, len(documents), SEARCH_DOCUMENTS_PER_CHUNK)]
+    manifest = {
+        'version': SEARCH_INDEX_VERSION,
+        'shard_prefix_length': SEARCH_SHARD_PREFIX_LENGTH,
+        'documents_per_chunk': SEARCH_DOCUMENTS_PER_CHUNK,
+        'document_count': len(documents),
+        'shards': shard_names,
+        'documents': document_names
+    }
+    manifest_content = dump_json(manifest)
+    manifest_url = get_fingerprinted_url(ASSETS_SEARCH_URL / 'index.json', manifest_content)
+    files[manifest_url] = manifest_content
+    return SearchIndex(manifest_url, files, len(term_postings))
+
+
+def build_search_index(context: BuildContext) -> None:
+    """Must be built after the images, because results show thumbnails."""
+
+    logger.info('Building search index')
+    index = create_search_index(context.photos.newest_first(), context.state)
+    for url, content in index.files.items():
+        context.build_dir.build_content(content, url)
+    context.state.search_index_url = index.manifest_url
+    logger.debug(f'Search index: {index.term_count} terms in {len(index.files)} files,'
+        f' {sum(len(c) for c in index.files.values())} bytes')
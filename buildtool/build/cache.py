@@ -0,0 +1,114 @@
+from collections import Counter
+import hashlib
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import TypeVar
+
+import pydantic
+
+from buildtool.utility import hash_file
+
+
+logger = logging.getLogger(__name__)
+
+
+ModelT = TypeVar('ModelT', bound=pydantic.BaseModel)
+
+
+class BuildCache:
+    """Persistent store for results which are expensive to compute and are reusable between builds.
+        Entries are keyed by content hashes, so stale entries are never reused, only orphaned."""
+
+    def __init__(self, root: Path | None, *, dry_run: bool) -> None:
+        # If root is None, caching is disabled.
+        self.root = root
+        self.dry_run = dry_run
+        self._file_hashes: dict[Path, str] = {}
+        self._file_hashes_lock = Lock()
+        # By namespace.
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self._counters_lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None
+
+    def hash_file(self, path: Path) -> str:
+        """Computes the content hash of a file. Memoised for the lifetime of the cache object (i.e. one build)."""
+
+        path = path.resolve()
+        with self._file_hashes_lock:
+            if path in self._file_hashes:
+                return self._file_hashes[path]
+        file_hash = hash_file(path)
+        with self._file_hashes_lock:
+            self._file_hashes[path] = file_hash
+        return file_hash
+
+    def get_namespace_path(self, namespace: str) -> Path | None:
+        """Directory for entries which aren't stored with save(), e.g. a library's own cache. None if disabled."""
+
+        if self.root is None:
+            return None
+        assert namespace.replace('-', '').isalnum()
+        return self.root / namespace
+
+    def get_entry_path(self, namespace: str, key: str, suffix: str = '.json') -> Path | None:
+        namespace_path = self.get_namespace_path(namespace)
+        if namespace_path is None:
+            return None
+        # Keys may be arbitrarily long, so hash them to get a filesystem safe name.
+        name = hashlib.sha256(key.encode('utf8')).hexdigest()
+        return namespace_path / name[:2] / f'{name}{suffix}'
+
+    def load(self, namespace: str, key: str, model: type[ModelT]) -> ModelT | None:
+        path = self.get_entry_path(namespace, key)
+        if path is None or not path.is_file():
+            logger.debug(f'Cache miss: {namespace} {key}')
+            self._count(namespace, hit=False)
+            return None
+        try:
+            value = model.model_validate_json(path.read_text(encoding='utf8'))
+        except pydantic.ValidationError:
+            # Probably the model changed, treat as a miss and overwrite it later.
+            logger.warning(f'Invalid cache entry, ignoring: "{path}"')
+            self._count(namespace, hit=False)
+            return None
+        logger.debug(f'Cache hit: {namespace} {key}')
+        self._count(namespace, hit=True)
+        return value
+
+    def save(self, namespace: str, key: str, value: pydantic.BaseModel) -> None:
+        self.save_file(namespace, key, value.model_dump_json().encode('utf8'))
+
+    def load_file(self, namespace: str, key: str, suffix: str) -> Path | None:
+        """For entries which are used as files rather than parsed, e.g. to copy to the output."""
+
+        path = self.get_entry_path(namespace, key, suffix)
+        if path is None or not path.is_file():
+            logger.debug(f'Cache miss: {namespace} {key}')
+            self._count(namespace, hit=False)
+            return None
+        logger.debug(f'Cache hit: {namespace} {key}')
+        self._count(namespace, hit=True)
+        return path
+
+    def _count(self, namespace: str, hit: bool) -> None:
+        if self.root is None:
+            return
+        with self._counters_lock:
+            (self.hits if hit else self.misses)[namespace] += 1
+
+    def save_file(self, namespace: str, key: str, data: bytes, suffix: str = '.json') -> None:
+        path = self.get_entry_path(namespace, key, suffix)
+        if path is None:
+            return
+        logger.debug(f'Saving cache entry: {namespace} {key} -> "{path}"')
+        if not self.dry_run:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename so concurrent builds never see a partial entry.
+            tmp_path = path.with_suffix(path.suffix + '.tmp')
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
@@ -1,83 +1,216 @@
+from collections.abc import Collection, Mapping
 from dataclasses import dataclass, field
+import hashlib
+import json
 import logging
 from pathlib import Path
-import shutil
+from threading import Lock
 
+import pydantic
+
+from buildtool.build.cache import BuildCache
+from buildtool.build.options import QualityMode, Shard, SrcSetMode
+from buildtool.build.output import OutputBackend
+from buildtool.build.progress import BuildMetrics
 from buildtool.photo_collection import PhotoCollection
 from buildtool.types import ImageID, ImageSrcSet, PhotoID, URLPath
+from buildtool.utility import hash_file
 
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class OutputRecord:
+    size: int
+    sha256: str
+
+
 class BuildDirectory:
-    def __init__(self, root: Path, *, fast: bool, dry_run: bool) -> None:
-        self.root = root
+    def __init__(self, backend: OutputBackend, *, fast: bool) -> None:
+        self.backend = backend
         self.fast = fast
-        self.dry_run = dry_run
-
-    def clean(self) -> None:
-        logger.info(f'Deleting build directory: "{self.root}"')
-        if not self.dry_run:
-            if self.root.exists():
-                shutil.rmtree(self.root, ignore_errors=False)
-
-    def prepare_directory(self, dir_path: str | Path) -> Path:
-        """Given a relative directory path, ensures that directory exists in the build directory.
-            Returns the absolute path of the directory."""
-
-        dir_path = Path(dir_path)
-        if dir_path.is_absolute():
-            raise ValueError('dir_path cannot be an absolute path')
-        path = self.root / dir_path
-        logger.debug(f'Creating build directory: "{path}"')
-        if not self.dry_run:
-            path.mkdir(parents=True, exist_ok=True)
-        return path
-
-    def prepare_file(self, file_path: str | Path) -> Path:
-        """Given a relative file path, ensures the parent directory exists in the build directory.
-            Returns the absolute path of the file."""
-
-        file_path = Path(file_path)
-        abs_dir_path = self.prepare_directory(file_path.parent)
-        abs_file_path = abs_dir_path / file_path.name
-        if not self.dry_run and abs_file_path.exists():
-            raise RuntimeError('Attempting to build file that already exists, probably a mistake!')
-        return abs_file_path
+        # Every file built, for later build steps and for the host.
+        self.manifest: dict[URLPath, OutputRecord] = {}
+        # Files in the manifest which a dry run didn't build (see record_expected_file()).
+        self.expected: set[URLPath] = set()
+        # Excludes reused files.
+        self.files_written = 0
+        self.bytes_written = 0
+        self._counters_lock = Lock()
+
+    def clean(self, keep: Collection[URLPath] = ()) -> None:
+        """Deletes all existing output, except for files being reused from a previous build."""
+
+        if keep:
+            logger.info(f'Deleting build output, except for {len(keep)} reused files')
+        else:
+            logger.info(f'Deleting build output')
+        self.backend.clean(keep)
+
+    def prepare_file(self, url: URLPath) -> Path:
+        """Returns a path to write a file to directly. record_file() must be called after it's written."""
+
+        return self.backend.prepare_file(url)
 
     def build_file(self, source_path: Path, url: URLPath) -> None:
         """Build a file that's a simple copy."""
 
-        logger.info(f'Building URL: {url}')
-        dest_path = self.prepare_file(url.fs_path)
-        if self.fast:
-            if not source_path.is_absolute():
-                source_path = source_path.resolve()
-            logger.debug(f'Symlinking file: "{source_path}" -> "{dest_path}"')
-            if not self.dry_run:
-                dest_path.symlink_to(source_path)
-        else:
-            logger.debug(f'Copying file: "{source_path}" -> "{dest_path}"')
-            if not self.dry_run:
-                shutil.copy(source_path, dest_path)
+        logger.debug(f'Building URL: {url}')
+        self.backend.copy_file(source_path, url, link=self.fast)
+        self._add_file(url, OutputRecord(source_path.stat().st_size, hash_file(source_path)))
 
     def build_content(self, content: str, url: URLPath) -> None:
         """Build a file with the given content."""
 
-        logger.info(f'Building URL: {url}')
-        dest_path = self.prepare_file(url.fs_path)
-        if not self.dry_run:
-            dest_path.write_text(content, encoding='utf8')
+        logger.debug(f'Building URL: {url}')
+        data = content.encode('utf8')
+        self.backend.write_bytes(url, data)
+        self._add_file(url, OutputRecord(len(data), hashlib.sha256(data).hexdigest()))
+
+    def reuse_file(self, url: URLPath, record: OutputRecord) -> None:
+        """Adds a file to the manifest which was kept from a previous build."""
+
+        logger.debug(f'Reusing URL: {url}')
+        self.manifest[url] = record
+
+    def import_file(self, source_path: Path, url: URLPath, record: OutputRecord) -> None:
+        """Adds a file which was built elsewhere (e.g. by a shard), whose manifest record is already known."""
+
+        logger.debug(f'Importing URL: {url}')
+        self.backend.copy_file(source_path, url, link=self.fast)
+        self._add_file(url, record)
+
+    def record_file(self, url: URLPath) -> None:
+        """Adds a file to the build which was written directly to the path from prepare_file()."""
+
+        path = self.backend.commit_file(url)
+        self._add_file(url, OutputRecord(path.stat().st_size, hash_file(path)))
+
+    def record_expected_file(self, url: URLPath, size: int) -> None:
+        """Adds a file to the manifest which a dry run would build, without building it. The size is an estimate, and
+            the content can't be read back."""
+
+        logger.debug(f'Expecting URL: {url}')
+        self.expected.add(url)
+        self.manifest[url] = OutputRecord(size, '')
+
+    def _add_file(self, url: URLPath, record: OutputRecord) -> None:
+        self.manifest[url] = record
+        with self._counters_lock:
+            self.files_written += 1
+            self.bytes_written += record.size
+
+    def get_file_size(self, url: URLPath) -> int | None:
+        """Size of a file in the output, which may be from a previous build. None if it doesn't exist."""
+
+        return self.backend.get_size(url)
+
+    def read_back(self, url: URLPath) -> bytes | Path | None:
+        """Content of a file in the output, or a path to read it from (see OutputBackend.read_back())."""
+
+        return self.backend.read_back(url)
+
+    def build_manifest(self, url: URLPath) -> None:
+        """Build a file listing every file built so far (excluding itself)."""
+
+        content = json.dumps(
+            {str(u): {'size': r.size, 'sha256': r.sha256} for u, r in sorted(self.manifest.items())},
+            indent=1)
+        self.build_content(content, url)
+
+    def close(self, *, success: bool) -> None:
+        """See OutputBackend.close()."""
+
+        self.backend.close(success=success)
+
+
+@dataclass(frozen=True)
+class PreloadImage:
+    srcset: ImageSrcSet
+    sizes: str
+    """The sizes attribute of the img element, which is needed to pick the same srcset entry."""
+
+
+@dataclass(frozen=True)
+class HTMLPageRecord:
+    template: str
+
+
+class ImageBuildRecord(pydantic.BaseModel, frozen=True):
+    """Everything built for one image, so it can be reused by the next build if the source image is unchanged."""
+
+    source_path: Path
+    srcset: ImageSrcSet
+    outputs: dict[URLPath, OutputRecord]
+    encoder_profiles: dict[URLPath, str]
+    encoder_profile_baseline_bytes: dict[URLPath, int]
+    fixed_ladder_bytes: int | None
+    perceptual_qualities: dict[int, int] | None
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+@dataclass(frozen=True)
+class InputChanges:
+    """Input files which changed since the previous build. If there was no previous build, everything is added."""
+
+    added: frozenset[Path]
+    modified: frozenset[Path]
+    removed: frozenset[Path]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    def is_unchanged(self, path: Path) -> bool:
+        return path not in self.added and path not in self.modified and path not in self.removed
+
+
+@dataclass(frozen=True)
+class ReencodeTrace:
+    """Measurement of one image reencode, for the build cost model."""
+
+    operator: str
+    source_pixels: int
+    output_pixels: int
+    quality: int
+    seconds: float
+    bytes: int
+
+
+@dataclass(frozen=True)
+class PageTrace:
+    """Measurement of building one HTML page, for the build cost model."""
 
-    def resolve_url_path(self, url: URLPath) -> Path:
-        return self.root / url.fs_path
+    template: str
+    cached: bool
+    """If the page came from the page cache instead of being rendered."""
+    seconds: float
+    bytes: int
 
 
 @dataclass
 class BuildState:
     photo_id_to_image_id: dict[PhotoID, ImageID] = field(default_factory=dict)
+    image_sources: dict[ImageID, Path] = field(default_factory=dict)
     image_srcsets: dict[ImageID, ImageSrcSet] = field(default_factory=dict)
+    # Maps CSS and JS URLs without fingerprint to the real URL.
+    asset_urls: dict[URLPath, URLPath] = field(default_factory=dict)
+    # Minified content of each CSS asset.
+    css_assets: dict[URLPath, str] = field(default_factory=dict)
+    html_pages: dict[URLPath, HTMLPageRecord] = field(default_factory=dict)
+    # Manifest of the photo search index.
+    search_index_url: URLPath | None = None
+    # Only populated for images with optimised srcsets.
+    fixed_ladder_bytes: dict[ImageID, int] = field(default_factory=dict)
+    # Only populated for images with perceptually targeted quality. Maps max width to chosen quality.
+    perceptual_qualities: dict[ImageID, dict[int, int]] = field(default_factory=dict)
+    # Encoder profile name of each reencoded image.
+    encoder_profiles: dict[URLPath, str] = field(default_factory=dict)
+    # Only populated if measuring encoder profiles. Size of each reencoded image without its encoder profile.
+    encoder_profile_baseline_bytes: dict[URLPath, int] = field(default_factory=dict)
+    reencode_traces: list[ReencodeTrace] = field(default_factory=list)
+    page_traces: list[PageTrace] = field(default_factory=list)
 
 
 @dataclass(frozen=True)
@@ -86,5 +219,16 @@ class BuildContext:
     resources_path: Path
     fast: bool
     dry_run: bool
+    srcset_mode: SrcSetMode
+    quality_mode: QualityMode
+    measure_encoder_profiles: bool
+    cache: BuildCache
+    changes: InputChanges
+    prebuilt_images: Mapping[ImageID, ImageBuildRecord]
+    """Images built by the previous build or by shards, which are still valid and whose outputs are already in the
+        build directory."""
+    shard: Shard | None
+    """If set, only this shard's images are built."""
     photos: PhotoCollection
     state: BuildState
+    metrics: BuildMetrics
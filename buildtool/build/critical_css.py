@@ -0,0 +1,292 @@
+from collections.abc import Collection, Iterable, Mapping
+from dataclasses import dataclass
+from html.parser import HTMLParser
+import logging
+import re
+
+from buildtool.types import URLPath
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DOMElement:
+    tag: str
+    id: str | None
+    classes: frozenset[str]
+    attributes: frozenset[tuple[str, str | None]]
+
+
+class DOMElementCollector(HTMLParser):
+    """Collects the distinct elements of a document. Structure is discarded, we only need to know what exists."""
+
+    def __init__(self, relevant_attributes: Collection[str]) -> None:
+        super().__init__(convert_charrefs=True)
+        # Other attributes are dropped so that pages differing only in content collect the same elements.
+        self.relevant_attributes = relevant_attributes
+        self.elements: set[DOMElement] = set()
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        attributes = dict(attrs)
+        self.elements.add(DOMElement(
+            tag=tag,
+            id=attributes.get('id'),
+            classes=frozenset((attributes.get('class') or '').split()),
+            attributes=frozenset((n, v) for n, v in attrs if n in self.relevant_attributes)))
+
+
+def collect_dom_elements(html: str, relevant_attributes: Collection[str]) -> frozenset[DOMElement]:
+    collector = DOMElementCollector(relevant_attributes)
+    collector.feed(html)
+    collector.close()
+    return frozenset(collector.elements)
+
+
+@dataclass(frozen=True)
+class CSSRule:
+    selectors: tuple[str, ...]
+    body: str
+
+
+@dataclass(frozen=True)
+class CSSAtBlock:
+    """An at-rule containing nested rules, e.g. @media."""
+
+    prelude: str
+    children: tuple['CSSNode', ...]
+
+
+@dataclass(frozen=True)
+class CSSVerbatim:
+    """Anything else (e.g. @font-face, @keyframes, @import), which is always kept as is."""
+
+    text: str
+
+
+CSSNode = CSSRule | CSSAtBlock | CSSVerbatim
+
+
+# At-rules whose blocks contain rules which should be pruned individually.
+NESTED_RULE_AT_RULES = ('@media', '@supports', '@layer', '@container')
+
+
+def split_top_level(s: str, separators: str) -> list[str]:
+    """Splits a string on separator characters which aren't nested in brackets or quotes."""
+
+    parts: list[str] = []
+    depth = 0
+    quote: str | None = None
+    start = 0
+    for i, c in enumerate(s):
+        if quote:
+            if c == quote and s[i - 1] != '\\':
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif depth == 0 and c in separators:
+            parts.append(s[start:i])
+            start = i + 1
+    parts.append(s[start:])
+    return parts
+
+
+def find_block_end(css: str, open_idx: int) -> int:
+    """Given the index of a {, returns the index of the matching }."""
+
+    depth = 0
+    quote: str | None = None
+    for i in range(open_idx, len(css)):
+        c = css[i]
+        if quote:
+            if c == quote and css[i - 1] != '\\':
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError('Unbalanced braces in CSS')
+
+
+def parse_css(css: str) -> tuple[CSSNode, ...]:
+    """Parses a stylesheet into rules. Expects comments to have already been removed (i.e. minified CSS)."""
+
+    nodes: list[CSSNode] = []
+    idx = 0
+    while idx < len(css):
+        open_idx = css.find('{', idx)
+        semicolon_idx = css.find(';', idx)
+        if css[idx:].strip() == '':
+            break
+        if css[idx:].lstrip()[:1] == '@' and semicolon_idx != -1 and (open_idx == -1 or semicolon_idx < open_idx):
+            # Block-less at-rule, e.g. @import.
+            nodes.append(CSSVerbatim(css[idx:semicolon_idx + 1].strip()))
+            idx = semicolon_idx + 1
+            continue
+        if open_idx == -1:
+            raise ValueError(f'Unexpected trailing CSS: {css[idx:]!r}')
+        close_idx = find_block_end(css, open_idx)
+        prelude = css[idx:open_idx].strip()
+        body = css[open_idx + 1:close_idx]
+        if prelude.startswith('@'):
+            if prelude.split()[0].split('(')[0] in NESTED_RULE_AT_RULES:
+                nodes.append(CSSAtBlock(prelude, parse_css(body)))
+            else:
+                nodes.append(CSSVerbatim(css[idx:close_idx + 1].strip()))
+        else:
+            selectors = tuple(s.strip() for s in split_top_level(prelude, ','))
+            nodes.append(CSSRule(selectors, body))
+        idx = close_idx + 1
+    return tuple(nodes)
+
+
+def serialise_css(nodes: Iterable[CSSNode]) -> str:
+    parts: list[str] = []
+    for node in nodes:
+        match node:
+            case CSSRule(selectors, body):
+                parts.append(f'{",".join(selectors)}{{{body}}}')
+            case CSSAtBlock(prelude, children):
+                parts.append(f'{prelude}{{{serialise_css(children)}}}')
+            case CSSVerbatim(text):
+                parts.append(text)
+    return ''.join(parts)
+
+
+COMBINATOR_REGEX = re.compile(r'\s*[>+~]\s*|\s+')
+SIMPLE_SELECTOR_REGEX = re.compile(
+    r'(?P<tag>^[a-zA-Z][\w-]*|^\*)'
+    r'|#(?P<id>[\w-]+)'
+    r'|\.(?P<class>[\w-]+)'
+    r'|\[(?P<attr>[\w-]+)(?:(?P<operator>[~|^$*]?=)["\']?(?P<value>[^"\'\]]*)["\']?)?(?:\s+[is])?\]'
+    r'|::?(?P<pseudo>[\w-]+)(?P<pseudo_args>\((?:[^()]|\([^()]*\))*\))?')
+
+
+def compound_selector_matches(compound: str, elements: Iterable[DOMElement]) -> bool:
+    """Checks if any element could match a compound selector (no combinators).
+        Errs on the side of matching for anything that depends on state we can't know at build time."""
+
+    tag: str | None = None
+    id_: str | None = None
+    classes: set[str] = set()
+    attributes: list[tuple[str, str | None]] = []
+    pos = 0
+    while pos < len(compound):
+        m = SIMPLE_SELECTOR_REGEX.match(compound, pos)
+        if not m or m.end() == pos:
+            # Something we don't understand, assume it's used.
+            return True
+        if m['tag'] and m['tag'] != '*':
+            tag = m['tag'].lower()
+        elif m['id']:
+            id_ = m['id']
+        elif m['class']:
+            classes.add(m['class'])
+        elif m['attr']:
+            # Only check exact values, other operators just require the attribute to exist.
+            attributes.append((m['attr'].lower(), m['value'] if m['operator'] == '=' else None))
+        elif m['pseudo'] == 'root':
+            tag = 'html'
+        # Other pseudo classes and elements (:hover, ::before, :not(), etc.) depend on runtime state, so ignore them.
+        pos = m.end()
+
+    for element in elements:
+        if tag is not None and element.tag != tag:
+            continue
+        if id_ is not None and element.id != id_:
+            continue
+        if not classes <= element.classes:
+            continue
+        element_attributes = dict(element.attributes)
+        if not all(name in element_attributes and (value is None or element_attributes[name] == value)
+                for name, value in attributes):
+            continue
+        return True
+    return False
+
+
+def find_selector_attributes(nodes: Iterable[CSSNode]) -> set[str]:
+    """Finds all attribute names referenced by attribute selectors."""
+
+    result: set[str] = set()
+    for node in nodes:
+        match node:
+            case CSSRule(selectors, _):
+                for selector in selectors:
+                    result.update(m.lower() for m in re.findall(r'\[\s*([\w-]+)', selector))
+            case CSSAtBlock(_, children):
+                result.update(find_selector_attributes(children))
+    return result
+
+
+def selector_is_used(selector: str, elements: Iterable[DOMElement]) -> bool:
+    """Conservative: only requires each compound selector to match some element, ignoring how they are related."""
+
+    compounds = [c for c in COMBINATOR_REGEX.split(selector.strip()) if c]
+    return all(compound_selector_matches(c, elements) for c in compounds)
+
+
+def prune_css(nodes: Iterable[CSSNode], elements: frozenset[DOMElement]) -> tuple[CSSNode, ...]:
+    """Removes rules (and selectors within rules) which can't match any of the elements."""
+
+    result: list[CSSNode] = []
+    for node in nodes:
+        match node:
+            case CSSRule(selectors, body):
+                used_selectors = tuple(s for s in selectors if selector_is_used(s, elements))
+                if used_selectors:
+                    result.append(CSSRule(used_selectors, body))
+            case CSSAtBlock(prelude, children):
+                pruned_children = prune_css(children, elements)
+                if pruned_children:
+                    result.append(CSSAtBlock(prelude, pruned_children))
+            case CSSVerbatim():
+                result.append(node)
+    return tuple(result)
+
+
+STYLESHEET_LINK_REGEX = re.compile(r'<link\s+rel="stylesheet"\s+href="(?P<href>[^"]+)"\s*/?>')
+
+
+class CriticalCSSInliner:
+    """Replaces render blocking stylesheet links in a page with the CSS rules the page actually uses, inlined.
+        The full stylesheets are still loaded, but deferred, in case something is added to the DOM at runtime."""
+
+    def __init__(self, stylesheets: Mapping[URLPath, str]) -> None:
+        self.stylesheets = {str(url): parse_css(content) for url, content in stylesheets.items()}
+        self.selector_attributes = frozenset(
+            a for nodes in self.stylesheets.values() for a in find_selector_attributes(nodes))
+
+    def process(self, template_name: str, html: str) -> str:
+        hrefs = tuple(m['href'] for m in STYLESHEET_LINK_REGEX.finditer(html) if m['href'] in self.stylesheets)
+        if not hrefs:
+            return html
+
+        elements = collect_dom_elements(html, self.selector_attributes)
+        critical_css = ''.join(serialise_css(prune_css(self.stylesheets[h], elements)) for h in hrefs)
+        logger.debug(f'Critical CSS for {template_name}: {len(critical_css)} characters')
+
+        inlined = False
+
+        def replace_link(m: re.Match[str]) -> str:
+            nonlocal inlined
+            href = m['href']
+            if href not in self.stylesheets:
+                return m[0]
+            deferred_link = (f'<link rel="preload" href="{href}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">'
+                f'<noscript><link rel="stylesheet" href="{href}"></noscript>')
+            if inlined:
+                return deferred_link
+            # Inline all the critical CSS in place of the first link to preserve the cascade order.
+            inlined = True
+            return f'<style>{critical_css}</style>{deferred_link}'
+
+        return STYLESHEET_LINK_REGEX.sub(replace_link, html)
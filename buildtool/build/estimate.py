@@ -0,0 +1,331 @@
+from collections import defaultdict
+from collections.abc import Collection, Iterable, Mapping, Sequence
+from dataclasses import dataclass
+import heapq
+import logging
+from pathlib import Path
+from typing import TypeVar
+
+import pydantic
+
+from buildtool.build.asset.image import IMAGE_SRCSET_SPEC, WORKING_COPY_WIDTH, ImageSrcSetSpec, \
+    calculate_new_image_size, get_photo_image_id
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildState, ImageBuildRecord, OutputRecord
+from buildtool.build.html import BASIC_PAGES
+from buildtool.build.progress import format_duration
+from buildtool.image import get_resize_operator, read_image_size
+from buildtool.photo_collection import PhotoCollection
+from buildtool.resource.image import is_graphic_file
+from buildtool.types import ImageID, PhotoID, Size, URLPath
+from buildtool.url import ASSETS_IMAGE_URL, get_image_base_url, get_photo_page_url
+
+
+logger = logging.getLogger(__name__)
+
+
+K = TypeVar('K')
+
+
+class RatioStatistic(pydantic.BaseModel, frozen=True):
+    """A cost per unit (e.g. seconds per megapixel), kept as totals so observations from several builds combine."""
+
+    total: float
+    units: float
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+    @property
+    def ratio(self) -> float:
+        return self.total / self.units if self.units else 0
+
+    def combine(self, other: 'RatioStatistic', decay: float) -> 'RatioStatistic':
+        """Adds newer observations, discounting these ones by decay so the statistic follows changes (e.g. new
+            hardware)."""
+
+        return RatioStatistic(total=self.total * decay + other.total, units=self.units * decay + other.units)
+
+
+def combine_statistics(old: Mapping[str, RatioStatistic], new: Mapping[str, RatioStatistic], decay: float) \
+        -> dict[str, RatioStatistic]:
+    combined = {key: statistic.combine(RatioStatistic(total=0, units=0), decay) for key, statistic in old.items()}
+    for key, statistic in new.items():
+        combined[key] = combined[key].combine(statistic, 1) if key in combined else statistic
+    return combined
+
+
+def sum_statistics(items: Iterable[tuple[str, float, float]]) -> dict[str, RatioStatistic]:
+    """Groups (key, total, units) observations."""
+
+    totals: defaultdict[str, list[float]] = defaultdict(lambda: [0.0, 0.0])
+    for key, total, units in items:
+        totals[key][0] += total
+        totals[key][1] += units
+    return {key: RatioStatistic(total=total, units=units) for key, (total, units) in totals.items()}
+
+
+def get_quality_tag(quality: int) -> str:
+    return f'q{quality}'
+
+
+class BuildCostModel(pydantic.BaseModel, frozen=True):
+    """How long builds take and how big their output is, fitted from previous builds."""
+
+    reencode_seconds_per_megapixel: dict[str, RatioStatistic]
+    """By resize operator. Per megapixel of the image reencoded from, since decoding it is most of the work."""
+    bytes_per_pixel: dict[str, RatioStatistic]
+    """Of reencoded images, by quality tag (e.g. q80)."""
+    page_render_seconds: dict[str, RatioStatistic]
+    """Per page, by template."""
+    page_cached_seconds: dict[str, RatioStatistic]
+    """Per page loaded from the page cache, by template."""
+    page_bytes: dict[str, RatioStatistic]
+    """Per page, by template."""
+    other_seconds: RatioStatistic
+    """Per build, everything except building images and pages."""
+    builds: int
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+    def combine(self, newer: 'BuildCostModel', decay: float) -> 'BuildCostModel':
+        return BuildCostModel(
+            reencode_seconds_per_megapixel=combine_statistics(
+                self.reencode_seconds_per_megapixel, newer.reencode_seconds_per_megapixel, decay),
+            bytes_per_pixel=combine_statistics(self.bytes_per_pixel, newer.bytes_per_pixel, decay),
+            page_render_seconds=combine_statistics(self.page_render_seconds, newer.page_render_seconds, decay),
+            page_cached_seconds=combine_statistics(self.page_cached_seconds, newer.page_cached_seconds, decay),
+            page_bytes=combine_statistics(self.page_bytes, newer.page_bytes, decay),
+            other_seconds=self.other_seconds.combine(newer.other_seconds, decay),
+            builds=self.builds + newer.builds)
+
+    def get_reencode_seconds(self, operator: str, source_size: Size) -> float | None:
+        statistic = self.reencode_seconds_per_megapixel.get(operator)
+        return statistic.ratio * source_size[0] * source_size[1] / 1e6 if statistic else None
+
+    def get_reencode_bytes(self, quality: int, output_size: Size) -> float | None:
+        """Uses the nearest measured quality if this one hasn't been measured."""
+
+        if not self.bytes_per_pixel:
+            return None
+        tag = min(self.bytes_per_pixel, key=lambda t: abs(int(t.removeprefix('q')) - quality))
+        return self.bytes_per_pixel[tag].ratio * output_size[0] * output_size[1]
+
+    def get_page_seconds(self, template: str, cached: bool) -> float | None:
+        statistic = (self.page_cached_seconds if cached else self.page_render_seconds).get(template)
+        return statistic.ratio if statistic else None
+
+    def get_page_bytes(self, template: str) -> float | None:
+        statistic = self.page_bytes.get(template)
+        return statistic.ratio if statistic else None
+
+
+COST_MODEL_CACHE_NAMESPACE = 'build-cost-model'
+COST_MODEL_CACHE_KEY = 'model'
+# Weight of the model so far when adding a build, so recent builds count more.
+COST_MODEL_DECAY = 0.5
+
+
+def fit_cost_model(state: BuildState, other_seconds: float) -> BuildCostModel:
+    return BuildCostModel(
+        reencode_seconds_per_megapixel=sum_statistics(
+            (t.operator, t.seconds, t.source_pixels / 1e6) for t in state.reencode_traces),
+        bytes_per_pixel=sum_statistics(
+            (get_quality_tag(t.quality), t.bytes, t.output_pixels) for t in state.reencode_traces),
+        page_render_seconds=sum_statistics((t.template, t.seconds, 1) for t in state.page_traces if not t.cached),
+        page_cached_seconds=sum_statistics((t.template, t.seconds, 1) for t in state.page_traces if t.cached),
+        page_bytes=sum_statistics((t.template, t.bytes, 1) for t in state.page_traces),
+        other_seconds=RatioStatistic(total=other_seconds, units=1),
+        builds=1)
+
+
+def load_cost_model(cache: BuildCache) -> BuildCostModel | None:
+    return cache.load(COST_MODEL_CACHE_NAMESPACE, COST_MODEL_CACHE_KEY, BuildCostModel)
+
+
+def update_cost_model(cache: BuildCache, state: BuildState, other_seconds: float) -> None:
+    """Adds a build's traces to the cost model."""
+
+    model = fit_cost_model(state, other_seconds)
+    previous = load_cost_model(cache)
+    if previous is not None:
+        model = previous.combine(model, COST_MODEL_DECAY)
+    logger.debug(f'Build cost model: {model}')
+    cache.save(COST_MODEL_CACHE_NAMESPACE, COST_MODEL_CACHE_KEY, model)
+
+
+@dataclass(frozen=True)
+class ImageEstimate:
+    image_id: ImageID
+    seconds: float
+    bytes: int
+
+
+class ImageCostEstimator:
+    def __init__(self, model: BuildCostModel, specs: Sequence[ImageSrcSetSpec]) -> None:
+        self.model = model
+        self.specs = specs
+        self.missing: set[str] = set()
+        """What the model has no data for, so was counted as zero."""
+
+    def estimate(self, image_id: ImageID, image_size: Size, original_bytes: int | None) -> ImageEstimate:
+        """Follows the same reencoding sources as build_image_srcset_assets(). original_bytes is given if the original
+            image is also output."""
+
+        seconds = 0.0
+        size_bytes = float(original_bytes or 0)
+        working_size = calculate_new_image_size(image_size, min(WORKING_COPY_WIDTH, image_size[0]))
+        metadata_image_size: Size | None = None
+        for spec in sorted(self.specs, key=lambda s: s.max_width, reverse=True):
+            if spec.max_width > image_size[0]:
+                continue
+            new_size = calculate_new_image_size(image_size, spec.max_width)
+            if spec.profile.strip_metadata:
+                source_size = working_size
+            elif metadata_image_size is not None:
+                source_size = metadata_image_size
+            else:
+                source_size = image_size
+                metadata_image_size = new_size
+            operator = get_resize_operator(spec.fast).name
+            seconds += self.get_or_missing(self.model.get_reencode_seconds(operator, source_size),
+                f'reencode time ({operator})')
+            size_bytes += self.get_or_missing(self.model.get_reencode_bytes(spec.quality, new_size), 'image size')
+        return ImageEstimate(image_id, seconds, round(size_bytes))
+
+    def get_or_missing(self, value: float | None, name: str) -> float:
+        if value is None:
+            self.missing.add(name)
+            return 0
+        return value
+
+
+class BuildEstimate(pydantic.BaseModel, frozen=True):
+    workers: int
+    wall_seconds: float
+    image_seconds: float
+    """Total over all workers."""
+    html_seconds: float
+    other_seconds: float
+    images_built: int
+    images_reused: int
+    pages_rendered: int
+    pages_cached: int
+    section_bytes: dict[str, int]
+    """Output size by URL directory."""
+    slowest_images: list[tuple[ImageID, float, int]]
+    """(image ID, seconds, bytes) of the images which take longest to build."""
+    missing: list[str]
+    """What the cost model has no data for."""
+    based_on_builds: int
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+def get_section(url: URLPath) -> str:
+    """Groups output URLs for reporting, e.g. /asset/image/photo."""
+
+    return str(URLPath('/', *url.parent.parts[1:4]))
+
+
+def schedule_wall_seconds(durations: Iterable[float], workers: int) -> float:
+    """Time to run independent tasks on a pool of workers, taking the longest first (which is close to optimal)."""
+
+    loads = [0.0] * max(1, workers)
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(loads, loads[0] + duration)
+    return max(loads)
+
+
+def sum_by(items: Iterable[tuple[K, int]]) -> dict[K, int]:
+    totals: defaultdict[K, int] = defaultdict(int)
+    for key, value in items:
+        totals[key] += value
+    return dict(totals)
+
+
+def estimate_build(model: BuildCostModel, *, workers: int, image_sources: Mapping[ImageID, Path],
+        photos: PhotoCollection, prebuilt_images: Mapping[ImageID, ImageBuildRecord],
+        changed_photo_ids: Collection[PhotoID], previous_outputs: Mapping[URLPath, OutputRecord],
+        page_cache_enabled: bool) -> BuildEstimate:
+    """Predicts a build from the cost model. Images already built are reused, and pages are assumed to come from the
+        page cache unless their photo or a neighbour changed. previous_outputs gives the size of other files."""
+
+    image_estimator = ImageCostEstimator(model, IMAGE_SRCSET_SPEC)
+    photo_sizes = {get_photo_image_id(photo.id): photo.size_px for photo in photos}
+    image_estimates: list[ImageEstimate] = []
+    section_bytes: list[tuple[str, int]] = []
+    for image_id, source_path in image_sources.items():
+        record = prebuilt_images.get(image_id)
+        if record is not None and record.source_path == source_path:
+            section_bytes.extend((get_section(url), output.size) for url, output in record.outputs.items())
+            continue
+        if image_id in photo_sizes:
+            # Photos also output the original.
+            estimate = image_estimator.estimate(image_id, photo_sizes[image_id], source_path.stat().st_size)
+        elif is_graphic_file(source_path):
+            # Usually small and quick to optimise, and the output is at most the size of the source.
+            estimate = ImageEstimate(image_id, 0, source_path.stat().st_size)
+        else:
+            estimate = image_estimator.estimate(image_id, read_image_size(source_path), None)
+        image_estimates.append(estimate)
+        section_bytes.append((get_section(get_image_base_url(image_id)), estimate.bytes))
+
+    # A photo page shows its neighbours, so changes to a photo also change the pages next to it.
+    changed_pages = set(changed_photo_ids)
+    photo_ids = {photo.id for photo in photos}
+    for photo_id in changed_photo_ids:
+        if photo_id in photo_ids:
+            changed_pages.update(p.id for p in (photos.get_previous(photo_id), photos.get_next(photo_id)) if p)
+    pages: list[tuple[URLPath, str, bool]] = [
+        # The basic pages list photos, so change whenever any do.
+        (page.url, page.template, page_cache_enabled and not changed_pages and not image_estimates)
+        for page in BASIC_PAGES]
+    pages += [(get_photo_page_url(photo.id), 'pages/photo.html', page_cache_enabled and photo.id not in changed_pages)
+        for photo in photos]
+    html_seconds = 0.0
+    for url, template, cached in pages:
+        html_seconds += image_estimator.get_or_missing(model.get_page_seconds(template, cached),
+            f'page {"cache" if cached else "render"} time ({template})')
+        page_bytes = model.get_page_bytes(template)
+        section_bytes.append((get_section(url), round(page_bytes) if page_bytes is not None
+            else previous_outputs[url].size if url in previous_outputs else 0))
+
+    # CSS, JS and other generated files are small and don't change much, so assume the same as last time.
+    image_prefix = f'{ASSETS_IMAGE_URL}/'
+    page_urls = {url for url, _, _ in pages}
+    section_bytes.extend((get_section(url), output.size) for url, output in previous_outputs.items()
+        if url not in page_urls and not str(url).startswith(image_prefix))
+
+    image_seconds = sum(e.seconds for e in image_estimates)
+    other_seconds = model.other_seconds.ratio
+    # Images are built in parallel, then pages one at a time.
+    wall_seconds = schedule_wall_seconds((e.seconds for e in image_estimates), workers) + html_seconds + other_seconds
+    slowest = heapq.nlargest(10, image_estimates, key=lambda e: (e.seconds, e.bytes))
+    return BuildEstimate(
+        workers=workers, wall_seconds=wall_seconds, image_seconds=image_seconds, html_seconds=html_seconds,
+        other_seconds=other_seconds,
+        images_built=len(image_estimates), images_reused=len(image_sources) - len(image_estimates),
+        pages_rendered=sum(not cached for _, _, cached in pages), pages_cached=sum(cached for _, _, cached in pages),
+        section_bytes=dict(sorted(sum_by(section_bytes).items())),
+        slowest_images=[(e.image_id, e.seconds, e.bytes) for e in slowest if e.seconds or e.bytes],
+        missing=sorted(image_estimator.missing),
+        based_on_builds=model.builds)
+
+
+def print_build_estimate(estimate: BuildEstimate) -> None:
+    print(f'Estimated build time: {format_duration(estimate.wall_seconds)} ({estimate.workers} workers)')
+    print(f'Images: {estimate.images_built} to build ({format_duration(estimate.image_seconds)} of work),'
+        f' {estimate.images_reused} reused')
+    print(f'HTML: {estimate.pages_rendered} pages to render, {estimate.pages_cached} from cache'
+        f' ({format_duration(estimate.html_seconds)})')
+    print(f'Other: {format_duration(estimate.other_seconds)}')
+    print(f'Estimated output: {sum(estimate.section_bytes.values()) // 1000}KB')
+    for section, size_bytes in sorted(estimate.section_bytes.items(), key=lambda s: s[1], reverse=True):
+        print(f'{section}: {size_bytes // 1000}KB')
+    if estimate.slowest_images:
+        print('Slowest images:')
+        for image_id, seconds, size_bytes in estimate.slowest_images:
+            print(f'{image_id}: {format_duration(seconds)}, {size_bytes // 1000}KB')
+    if estimate.missing:
+        print(f'No data yet for: {", ".join(estimate.missing)}')
+    print(f'Based on {estimate.based_on_builds} previous builds')
@@ -0,0 +1,96 @@
+from collections.abc import Collection
+from dataclasses import dataclass
+import json
+import logging
+
+from buildtool.build.common import BuildContext
+from buildtool.types import URLPath
+from buildtool.url import ASSETS_CSS_URL, ASSETS_IMAGE_URL, ASSETS_JS_URL, ASSETS_SEARCH_URL, HEADERS_JSON_URL, \
+    HEADERS_URL, INDEX_PAGE_URL, SERVICE_WORKER_URL
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HeaderRule:
+    path: str
+    """URL path pattern. May end with * to match everything under a directory."""
+    headers: tuple[tuple[str, str], ...]
+
+
+# Fingerprinted, so the content at a URL never changes.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Image URLs are stable but not fingerprinted (a photo could be replaced), so allow eventual revalidation.
+IMAGE_CACHE_CONTROL = 'public, max-age=2592000, stale-while-revalidate=86400'
+# Pages change whenever anything is added, and reference the fingerprinted asset URLs.
+HTML_CACHE_CONTROL = 'public, max-age=300, must-revalidate'
+# Browsers check for service worker updates on navigation, which should see a new deploy immediately.
+SERVICE_WORKER_CACHE_CONTROL = 'no-cache'
+
+
+def build_headers(context: BuildContext) -> None:
+    """Builds a file describing the HTTP headers the host should send. Doesn't depend on any particular host,
+        the _headers format is understood by Netlify and Cloudflare Pages, and the JSON form is easy to convert."""
+
+    logger.info('Building headers')
+    rules = get_header_rules(context)
+    context.build_dir.build_content(format_headers_file(rules), HEADERS_URL)
+    context.build_dir.build_content(format_headers_json(rules), HEADERS_JSON_URL)
+
+
+def get_header_rules(context: BuildContext) -> list[HeaderRule]:
+    rules = [
+        HeaderRule(f'{ASSETS_CSS_URL}/*', (('Cache-Control', IMMUTABLE_CACHE_CONTROL),)),
+        HeaderRule(f'{ASSETS_JS_URL}/*', (('Cache-Control', IMMUTABLE_CACHE_CONTROL),)),
+        HeaderRule(f'{ASSETS_SEARCH_URL}/*', (('Cache-Control', IMMUTABLE_CACHE_CONTROL),)),
+        HeaderRule(f'{ASSETS_IMAGE_URL}/*', (('Cache-Control', IMAGE_CACHE_CONTROL),)),
+        HeaderRule(str(SERVICE_WORKER_URL), (('Cache-Control', SERVICE_WORKER_CACHE_CONTROL),)),
+    ]
+    for path in get_page_rule_paths(context.state.html_pages.keys(), context.build_dir.manifest.keys()):
+        rules.append(HeaderRule(path, (('Cache-Control', HTML_CACHE_CONTROL),)))
+    return rules
+
+
+def get_page_rule_paths(page_urls: Collection[URLPath], output_urls: Collection[URLPath]) -> list[str]:
+    """Paths matching every page and nothing else, as few as possible, because hosts limit the number of rules (e.g.
+        Cloudflare Pages allows 100). Hosts apply every matching rule, so a directory is matched with a wildcard only if
+        everything in it is a page, and the root never is."""
+
+    other_urls = [u for u in output_urls if u not in page_urls]
+    paths: list[str] = []
+    # Directory -> whether it's matched with a wildcard.
+    directories: dict[URLPath, bool] = {}
+    for url in sorted(page_urls):
+        directory = url.parent
+        if directory not in directories:
+            directories[directory] = directory != directory.parent \
+                and not any(u.is_relative_to(directory) for u in other_urls)
+            if directories[directory]:
+                paths.append(f'{directory}/*')
+        if not directories[directory]:
+            paths += get_page_url_paths(url)
+    return paths
+
+
+def get_page_url_paths(url: URLPath) -> list[str]:
+    """All the paths a page may be requested with."""
+
+    if url == INDEX_PAGE_URL:
+        return ['/', str(url)]
+    # Most hosts also serve pages without the .html extension.
+    return [str(url), str(url.with_suffix(''))]
+
+
+def format_headers_file(rules: list[HeaderRule]) -> str:
+    lines: list[str] = []
+    for rule in rules:
+        lines.append(rule.path)
+        lines.extend(f'  {name}: {value}' for name, value in rule.headers)
+    return '\n'.join(lines) + '\n'
+
+
+def format_headers_json(rules: list[HeaderRule]) -> str:
+    return json.dumps(
+        [{'path': rule.path, 'headers': dict(rule.headers)} for rule in rules],
+        indent=2)
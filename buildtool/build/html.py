@@ -1,19 +1,26 @@
 from collections.abc import Mapping
 from dataclasses import dataclass, fields
+from functools import cache
 import logging
 from pathlib import Path
 import re
+import time
 from typing import Any
 
 import jinja2
 import minify_html
 
-from buildtool.build.common import BuildContext, BuildState
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildContext, BuildState, HTMLPageRecord, PageTrace, PreloadImage
+from buildtool.build.critical_css import CriticalCSSInliner
+from buildtool.build.page_cache import PageOutputCache
+from buildtool.build.progress import ProgressTracker
 from buildtool.photo_collection import PhotoCollection
 from buildtool.photo_info import PhotoInfo
 from buildtool.resource.html import get_html_resources_path
-from buildtool.types import ImageSrcSet, URLPath
-from buildtool.url import ABOUT_PAGE_URL, ASSETS_CSS_URL, ASSETS_JS_URL, GALLERY_PAGE_URL, INDEX_PAGE_URL, get_photo_page_url
+from buildtool.types import ImageID, ImageSrcSet, PhotoID, URLPath
+from buildtool.url import ABOUT_PAGE_URL, ASSETS_CSS_URL, ASSETS_JS_URL, GALLERY_PAGE_URL, INDEX_PAGE_URL, \
+    SERVICE_WORKER_URL, get_photo_page_url
 from buildtool.utility import get_latest_commit_date
 
 
@@ -23,10 +30,17 @@ logger = logging.getLogger(__name__)
 def build_all_html(context: BuildContext) -> None:
     logger.info('Building HTML')
     html_resources_path = get_html_resources_path(context.resources_path)
-    jinja2_env = create_jinja2_environment(html_resources_path)
-    context = HTMLBuildContext.new(context, jinja2_env, get_common_html_render_context(context))
-    build_basic_pages(context)
-    build_photo_pages(context)
+    jinja2_env = create_jinja2_environment(html_resources_path, context.cache)
+    # The common context is the same for every page, so it's shared as globals instead of copied into each page's
+    # render context.
+    common_render_context = get_common_html_render_context(context)
+    jinja2_env.globals.update(common_render_context)
+    context = HTMLBuildContext.new(context, jinja2_env, create_photo_render_contexts(context),
+        CriticalCSSInliner(context.state.css_assets), PageOutputCache(context.cache, jinja2_env, common_render_context))
+    with context.metrics.phase('HTML', len(BASIC_PAGES) + len(context.photos)) as progress:
+        build_basic_pages(context, progress)
+        build_photo_pages(context, progress)
+    context.page_cache.log_statistics()
 
 
 RenderContext = Mapping[str, Any]
@@ -35,51 +49,102 @@ RenderContext = Mapping[str, Any]
 @dataclass(frozen=True)
 class HTMLBuildContext(BuildContext):
     jinja2_env: jinja2.Environment
-    common_html_render_context: RenderContext   # Compute this once at the start because it's kinda slow.
+    # Each photo is rendered on the gallery page and its own page, so compute these once.
+    photo_render_contexts: Mapping[PhotoID, RenderContext]
+    critical_css_inliner: CriticalCSSInliner
+    page_cache: PageOutputCache
 
     @classmethod
-    def new(cls, build_context: BuildContext, jinja2_env: jinja2.Environment, common_html_render_context: RenderContext):
+    def new(cls, build_context: BuildContext, jinja2_env: jinja2.Environment,
+            photo_render_contexts: Mapping[PhotoID, RenderContext], critical_css_inliner: CriticalCSSInliner,
+            page_cache: PageOutputCache):
         return cls(
             **{f.name: getattr(build_context, f.name) for f in fields(build_context)},
-            jinja2_env=jinja2_env, common_html_render_context=common_html_render_context)
+            jinja2_env=jinja2_env, photo_render_contexts=photo_render_contexts,
+            critical_css_inliner=critical_css_inliner, page_cache=page_cache)
 
 
-def create_jinja2_environment(html_resources_path: Path) -> jinja2.Environment:
+JINJA2_BYTECODE_CACHE_NAMESPACE = 'jinja2-bytecode'
+
+
+def create_jinja2_environment(html_resources_path: Path, cache: BuildCache | None = None) -> jinja2.Environment:
+    """If a cache is given, compiled templates are saved to it so they don't need to be compiled again next build."""
+
+    bytecode_cache = None
+    if cache is not None and not cache.dry_run \
+            and (bytecode_cache_path := cache.get_namespace_path(JINJA2_BYTECODE_CACHE_NAMESPACE)) is not None:
+        bytecode_cache_path.mkdir(parents=True, exist_ok=True)
+        # Entries are keyed by template name and source checksum, so edited templates are recompiled.
+        bytecode_cache = jinja2.FileSystemBytecodeCache(str(bytecode_cache_path))
     return jinja2.Environment(
         loader=jinja2.FileSystemLoader(html_resources_path),
         autoescape=jinja2.select_autoescape(),
         undefined=jinja2.StrictUndefined,
         trim_blocks=True,
-        lstrip_blocks=True
+        lstrip_blocks=True,
+        bytecode_cache=bytecode_cache
     )
 
 
 def build_html_page(template_name: str, url: URLPath, context: HTMLBuildContext,
-        render_context: Mapping[str, Any] = {}) -> None:
-    logger.info(f'Building HTML page URL: {url}')
+        render_context: Mapping[str, Any] = {}, preload_image: PreloadImage | None = None) -> None:
+    logger.debug(f'Building HTML page URL: {url}')
+    start_time = time.perf_counter()
+    render_context = {
+        **render_context,
+        'preload_image': create_preload_image_render_context(preload_image) if preload_image else None
+    }
+    if context.page_cache.enabled:
+        cache_key = context.page_cache.get_key(template_name, render_context)
+        cached_path = context.page_cache.load(template_name, cache_key)
+    else:
+        cache_key = None
+        cached_path = None
+
+    if cached_path is not None:
+        context.build_dir.build_file(cached_path, url)
+    else:
+        minified_html = render_html_page(template_name, render_context, context)
+        if cache_key is not None:
+            context.page_cache.save(cache_key, minified_html)
+        context.build_dir.build_content(minified_html, url)
+    context.state.page_traces.append(PageTrace(template_name, cached_path is not None,
+        time.perf_counter() - start_time, context.build_dir.manifest[url].size))
+    # Saved for later build steps which need to know about all the pages.
+    context.state.html_pages[url] = HTMLPageRecord(template_name)
+
+
+def render_html_page(template_name: str, render_context: RenderContext, context: HTMLBuildContext) -> str:
     template = context.jinja2_env.get_template(template_name)
-    render_context = create_html_render_context(context, render_context)
-    logger.debug(f'Render context: {render_context}')
+    if logger.isEnabledFor(logging.DEBUG):
+        # Formatting is slow for big pages (e.g. the gallery), so don't do it unless it's logged.
+        logger.debug(f'Render context: {render_context}')
     rendered_html = template.render(render_context)
-    minified_html = minify_html.minify(
+    # Stylesheets are render blocking, so inline the rules the page needs and load the rest later.
+    rendered_html = context.critical_css_inliner.process(template_name, rendered_html)
+    return minify_html.minify(
         rendered_html,
         minify_js=True, minify_css=True,
         keep_closing_tags=True, keep_html_and_head_opening_tags=True, keep_input_type_text_attr=True)
-    context.build_dir.build_content(minified_html, url)
 
 
 def get_common_html_render_context(context: BuildContext) -> RenderContext:
     return {
+        # Asset URLs are fingerprinted, so look up the real URLs.
         'css': {
-            'main': ASSETS_CSS_URL / 'main.css',
-            'index': ASSETS_CSS_URL / 'index.css',
-            'about': ASSETS_CSS_URL / 'about.css',
-            'gallery': ASSETS_CSS_URL / 'gallery.css',
-            'photo': ASSETS_CSS_URL / 'photo.css'
+            'main': context.state.asset_urls[ASSETS_CSS_URL / 'main.css'],
+            'index': context.state.asset_urls[ASSETS_CSS_URL / 'index.css'],
+            'about': context.state.asset_urls[ASSETS_CSS_URL / 'about.css'],
+            'gallery': context.state.asset_urls[ASSETS_CSS_URL / 'gallery.css'],
+            'photo': context.state.asset_urls[ASSETS_CSS_URL / 'photo.css']
         },
         'js': {
-            'gallery': ASSETS_JS_URL / 'gallery.js'
+            'gallery': context.state.asset_urls[ASSETS_JS_URL / 'gallery.js'],
+            'photo': context.state.asset_urls[ASSETS_JS_URL / 'photo.js'],
+            'search': context.state.asset_urls[ASSETS_JS_URL / 'search.js']
         },
+        'search_index': context.state.search_index_url,
+        'service_worker': SERVICE_WORKER_URL,
         'pages': {
             'about': ABOUT_PAGE_URL,
             'gallery': GALLERY_PAGE_URL
@@ -92,15 +157,9 @@ def get_common_html_render_context(context: BuildContext) -> RenderContext:
     }
 
 
-def create_html_render_context(context: HTMLBuildContext, extra: RenderContext) -> RenderContext:
-    render_context = dict(context.common_html_render_context)
-    render_context.update(extra)
-    return render_context
-
-
 def get_copyright_date_tag(photos: PhotoCollection) -> str:
-    oldest_photo = min(p.date.year for p in photos if p.date.year)
-    newest_photo = max(p.date.year for p in photos if p.date.year)
+    oldest_photo = photos.years[0]
+    newest_photo = photos.years[-1]
 
     website_creation = 2025
 
@@ -120,10 +179,19 @@ def get_copyright_date_tag(photos: PhotoCollection) -> str:
 class BasicPage:
     template: str
     url: URLPath
+    preload_image_id: ImageID | None = None
+    preload_image_sizes: str | None = None
+    """Must match the sizes attribute of the img element in the template."""
 
-    def render_context(self, context: BuildContext) -> RenderContext:
+    def render_context(self, context: HTMLBuildContext) -> RenderContext:
         return {}
 
+    def preload_image(self, context: BuildContext) -> PreloadImage | None:
+        if self.preload_image_id is None:
+            return None
+        assert self.preload_image_sizes is not None
+        return PreloadImage(context.state.image_srcsets[self.preload_image_id], self.preload_image_sizes)
+
 
 @dataclass(frozen=True)
 class GalleryPage(BasicPage):
@@ -133,19 +201,15 @@ class GalleryPage(BasicPage):
             url=GALLERY_PAGE_URL
         )
 
-    def render_context(self, context: BuildContext) -> dict[str, Any]:
-        # Get all photos sorted by date (newest first). Also order by ID to break ties consistently.
-        all_photos = sorted(context.photos, key=lambda p: p.chronological_sort_key, reverse=True)
-        
-        # Get unique years and months for filters
-        years = sorted({d.year for d in context.photos.dates if d.year}, reverse=True)
-        months = sorted(
-            {f'{d.year}-{d.month:02d}' for d in context.photos.dates if d.year and d.month},
-            reverse=True
-        )
-        
+    def render_context(self, context: HTMLBuildContext) -> dict[str, Any]:
+        # Newest first, ties are broken by ID so the order is consistent.
+        all_photos = context.photos.newest_first()
+        # For the filters.
+        years = context.photos.years[::-1]
+        months = [f'{year}-{month:02d}' for year, month in reversed(context.photos.year_months)]
+
         return {
-            'photos': [create_photo_render_context(p, context.state) for p in all_photos],
+            'photos': [context.photo_render_contexts[p.id] for p in all_photos],
             'genres': [genre.value for genre in context.photos.genres],
             'years': years,
             'months': months
@@ -153,30 +217,51 @@ class GalleryPage(BasicPage):
 
 
 BASIC_PAGES = (
-    BasicPage('pages/index.html', INDEX_PAGE_URL),
-    BasicPage('pages/about.html', ABOUT_PAGE_URL),
+    BasicPage('pages/index.html', INDEX_PAGE_URL,
+        # The image is scaled to fill the viewport vertically, so need to calculate the corresponding width.
+        ImageID('general/homepage_hero.jpg'), 'calc(95vh * 6240 / 3831)'),
+    BasicPage('pages/about.html', ABOUT_PAGE_URL,
+        # Determined based on the section width and image width.
+        ImageID('general/the_photographer.jpg'), '(max-width: 480px) 90vw, 30vw'),
+    # Gallery images are small and there are many of them, so nothing stands out to preload.
     GalleryPage()
 )
 
 
-def build_basic_pages(context: HTMLBuildContext) -> None:
+def build_basic_pages(context: HTMLBuildContext, progress: ProgressTracker) -> None:
     for page in BASIC_PAGES:
-        render_context = page.render_context(context)
-        build_html_page(page.template, page.url, context, render_context)
+        with progress.task(str(page.url)):
+            render_context = page.render_context(context)
+            build_html_page(page.template, page.url, context, render_context, page.preload_image(context))
+
+
+def build_photo_pages(context: HTMLBuildContext, progress: ProgressTracker) -> None:
+    # Pages link to their neighbours in chronological order.
+    for photo in context.photos.oldest_first():
+        with progress.task(photo.id):
+            build_photo_page(photo, context, context.photos.get_previous(photo.id), context.photos.get_next(photo.id))
 
 
-def build_photo_pages(context: HTMLBuildContext) -> None:
-    for photo in context.photos:
-        build_photo_page(photo, context)
+# Determined based on the section width.
+# If the image is portrait then the width may be much smaller,
+# but I don't think there's a way to account for that because the browser doesn't know.
+PHOTO_PAGE_IMAGE_SIZES = '(max-width: 480px) 90vw, (max-width: 768px) 80vw, (max-width: 1024px) 70vw, 60vw'
 
 
-def build_photo_page(photo: PhotoInfo, context: HTMLBuildContext) -> None:
+def build_photo_page(photo: PhotoInfo, context: HTMLBuildContext,
+        previous_photo: PhotoInfo | None, next_photo: PhotoInfo | None) -> None:
+    """previous_photo is older, next_photo is newer."""
+
     url = get_photo_page_url(photo.id)
-    render_context = create_html_render_context(context, {
+    render_context = {
         'photo_page_title': photo.title or photo.id.split('.')[0],
-        'photo': create_photo_render_context(photo, context.state)
-    })
-    build_html_page('pages/photo.html', url, context, render_context)
+        'photo': context.photo_render_contexts[photo.id],
+        'previous_photo': create_photo_link_render_context(previous_photo, context.state) if previous_photo else None,
+        'next_photo': create_photo_link_render_context(next_photo, context.state) if next_photo else None
+    }
+    preload_image = PreloadImage(
+        context.state.image_srcsets[context.state.photo_id_to_image_id[photo.id]], PHOTO_PAGE_IMAGE_SIZES)
+    build_html_page('pages/photo.html', url, context, render_context, preload_image)
 
 
 def create_image_render_context(srcset: ImageSrcSet) -> RenderContext:
@@ -189,6 +274,17 @@ def create_image_render_context(srcset: ImageSrcSet) -> RenderContext:
     return render_context
 
 
+def create_preload_image_render_context(preload_image: PreloadImage) -> RenderContext:
+    return {
+        **create_image_render_context(preload_image.srcset),
+        'sizes': preload_image.sizes
+    }
+
+
+def create_photo_render_contexts(context: BuildContext) -> dict[PhotoID, RenderContext]:
+    return {photo.id: create_photo_render_context(photo, context.state) for photo in context.photos}
+
+
 def create_photo_render_context(photo: PhotoInfo, build_state: BuildState) -> RenderContext:
     # Page design doesn't really support photos without year or month (e.g. how do you sort them?).
     # Should think twice about allowing photos with no date.
@@ -210,6 +306,16 @@ def create_photo_render_context(photo: PhotoInfo, build_state: BuildState) -> Re
     }
 
 
+def create_photo_link_render_context(photo: PhotoInfo, build_state: BuildState) -> RenderContext:
+    """Minimal information for linking to another photo's page."""
+
+    return {
+        'title': photo.title,
+        'page_url': get_photo_page_url(photo.id),
+        'image_url': build_state.image_srcsets[build_state.photo_id_to_image_id[photo.id]].default.url
+    }
+
+
 def fix_up_canon_lens_model(lens_model: str) -> str:
     # Some Canon lens names from the camera don't have a space between the "EF" and the rest of the name, e.g.:
     # EF50mm f/1.8 STM
@@ -235,14 +341,18 @@ def replace_f_number_with_symbol(s: str) -> str:
     return s.replace('f/', f'{F_NUMBER_SYMBOL}/')
 
 
+@cache
+def format_lens_model(lens_model: str) -> str:
+    # Memoised because there are far fewer lenses than photos.
+    return replace_f_number_with_symbol(fix_up_canon_lens_model(lens_model))
+
+
 def create_photo_settings_list(photo: PhotoInfo) -> list[str]:
     result: list[str] = []
     if photo.camera_model:
         result.append(photo.camera_model)
     if photo.lens_model:
-        lens_model = fix_up_canon_lens_model(photo.lens_model)
-        lens_model = replace_f_number_with_symbol(lens_model)
-        result.append(lens_model)
+        result.append(format_lens_model(photo.lens_model))
     if photo.focal_length:
         if photo.focal_length < 10:
             focal_length_str = str(round(photo.focal_length, 1))
@@ -0,0 +1,150 @@
+from collections.abc import Iterable, Mapping
+import hashlib
+import json
+import logging
+from pathlib import Path, PurePosixPath
+from typing import Any
+
+import pydantic
+
+import buildtool
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildDirectory, ImageBuildRecord, InputChanges, OutputRecord
+from buildtool.file_scan import FileSnapshot, scan_files
+from buildtool.photo_info import PhotoInfo
+from buildtool.types import ImageID, URLPath
+from buildtool.utility import hash_file
+
+
+logger = logging.getLogger(__name__)
+
+
+class InputFileRecord(pydantic.BaseModel, frozen=True):
+    size: int
+    mtime_ns: int
+    sha256: str | None = None
+    """Only computed if the file is touched without its size changing, to check if the content really changed."""
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class BuildJournal(pydantic.BaseModel, frozen=True):
+    """What the previous build read and produced, so the next build only has to redo what changed."""
+
+    options_fingerprint: str
+    inputs: dict[str, InputFileRecord]
+    """Keyed by POSIX path relative to the resources directory."""
+    photos: tuple[PhotoInfo, ...]
+    images: dict[ImageID, ImageBuildRecord]
+    outputs: dict[URLPath, OutputRecord]
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+JOURNAL_CACHE_NAMESPACE = 'build-journal'
+
+
+def get_journal_cache_key(output_path: Path) -> str:
+    # Each build directory (or archive) has its own history.
+    return str(output_path.resolve())
+
+
+def get_options_fingerprint(options: Mapping[str, Any]) -> str:
+    """Identifies build options and the build tool code. If these change then nothing from the previous build can be
+        trusted to be the same."""
+
+    fingerprint = hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode('utf8'))
+    source_root = Path(buildtool.__file__).parent
+    for path in scan_files(source_root, ('.py',)):
+        fingerprint.update(str(PurePosixPath(path.relative_to(source_root))).encode('utf8'))
+        fingerprint.update(path.read_bytes())
+    return fingerprint.hexdigest()
+
+
+def load_journal(cache: BuildCache, output_path: Path, options_fingerprint: str) -> BuildJournal | None:
+    journal = cache.load(JOURNAL_CACHE_NAMESPACE, get_journal_cache_key(output_path), BuildJournal)
+    if journal is None:
+        logger.info('No previous build journal, doing a full build')
+        return None
+    if journal.options_fingerprint != options_fingerprint:
+        logger.info('Build options or build tool changed since the previous build, doing a full build')
+        return None
+    return journal
+
+
+def save_journal(cache: BuildCache, output_path: Path, journal: BuildJournal) -> None:
+    logger.info('Saving build journal')
+    cache.save(JOURNAL_CACHE_NAMESPACE, get_journal_cache_key(output_path), journal)
+
+
+def get_input_key(path: Path, resources_path: Path) -> str:
+    return str(PurePosixPath(path.relative_to(resources_path)))
+
+
+def get_input_changes(journal: BuildJournal | None, snapshot: FileSnapshot) \
+        -> tuple[InputChanges, dict[str, InputFileRecord]]:
+    """Diffs the current input files against the previous build.
+        Also returns records of the current input files, to save for the next build."""
+
+    previous = journal.inputs if journal is not None else {}
+    records: dict[str, InputFileRecord] = {}
+    added: set[Path] = set()
+    modified: set[Path] = set()
+    for path, stat in snapshot.files.items():
+        key = get_input_key(path, snapshot.root)
+        previous_record = previous.get(key)
+        if previous_record is None:
+            added.add(path)
+            records[key] = InputFileRecord(size=stat.size, mtime_ns=stat.mtime_ns)
+        elif previous_record.size == stat.size and previous_record.mtime_ns == stat.mtime_ns:
+            records[key] = previous_record
+        elif previous_record.size == stat.size:
+            # Possibly only touched (e.g. by a checkout), so compare content.
+            # The hash is saved either way so that the next touch can be detected.
+            sha256 = hash_file(path)
+            if sha256 != previous_record.sha256:
+                modified.add(path)
+            records[key] = InputFileRecord(size=stat.size, mtime_ns=stat.mtime_ns, sha256=sha256)
+        else:
+            modified.add(path)
+            records[key] = InputFileRecord(size=stat.size, mtime_ns=stat.mtime_ns)
+    removed = {snapshot.root / key for key in previous.keys() - records.keys()}
+
+    changes = InputChanges(frozenset(added), frozenset(modified), frozenset(removed))
+    logger.info(f'Input changes: {len(added)} added, {len(modified)} modified, {len(removed)} removed')
+    for path in sorted(modified):
+        logger.debug(f'Modified input: "{path}"')
+    return changes, records
+
+
+def outputs_exist(outputs: Iterable[tuple[URLPath, OutputRecord]], build_dir: BuildDirectory) -> bool:
+    """Cheap check that built files haven't been deleted or modified. Doesn't check content, that would be as slow as
+        building."""
+
+    for url, record in outputs:
+        if build_dir.get_file_size(url) != record.size:
+            logger.debug(f'Output missing or modified: {url}')
+            return False
+    return True
+
+
+def get_reusable_images(journal: BuildJournal | None, changes: InputChanges, image_sources: Mapping[ImageID, Path],
+        build_dir: BuildDirectory) -> dict[ImageID, ImageBuildRecord]:
+    """Images from the previous build which can be reused as is: same ID, same unchanged source, outputs intact."""
+
+    if journal is None:
+        return {}
+    return {
+        image_id: record for image_id, record in journal.images.items()
+        if image_sources.get(image_id) == record.source_path
+            and changes.is_unchanged(record.source_path)
+            and outputs_exist(record.outputs.items(), build_dir)}
+
+
+def get_reusable_photo_infos(journal: BuildJournal | None, changes: InputChanges) -> dict[Path, PhotoInfo]:
+    """Photos from the previous build, keyed by image file, if the image file is unchanged.
+        The metadata file must be checked separately."""
+
+    if journal is None:
+        return {}
+    return {photo.source_path: photo for photo in journal.photos if changes.is_unchanged(photo.source_path)}
@@ -1,15 +1,22 @@
 from collections import Counter
-from collections.abc import Sequence
+from collections.abc import Mapping, Sequence
+import datetime as dt
 import logging
+import os
 from pathlib import Path
 
-from buildtool.build.asset import build_all_assets
-from buildtool.build.common import BuildContext, BuildDirectory, BuildState
-from buildtool.build.html import build_all_html
-from buildtool.build.statistics import print_build_statistics
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildContext, BuildDirectory, BuildState, OutputRecord, QualityMode, Shard, \
+    SrcSetMode
+from buildtool.build.journal import BuildJournal, get_input_changes, get_options_fingerprint, \
+    get_reusable_images, get_reusable_photo_infos, load_journal, outputs_exist, save_journal
+from buildtool.build.output import ArchiveOutputBackend, LocalOutputBackend, MemoryOutputBackend, OutputBackend
+from buildtool.build.progress import BuildMetrics, MetricsSnapshot, write_metrics
+from buildtool.file_scan import scan_files
 from buildtool.photo_collection import PhotoCollection
-from buildtool.photo_info import PhotoInfo, read_photo_info
-from buildtool.resource.photo import find_photos, get_photo_resources_path
+from buildtool.photo_info import PhotoInfo, read_photo_infos
+from buildtool.resource.photo import PhotoResourceRecord, get_photo_resources_path, pair_photo_files
+from buildtool.url import MANIFEST_URL, URLPath
 
 
 logger = logging.getLogger(__name__)
@@ -23,31 +30,181 @@ def verify_photo_ids(photo_infos: Sequence[PhotoInfo]) -> None:
         raise RuntimeError(f'Duplicate photo unique IDs: {duplicated}')
 
 
-def run_build(build_path: Path, resources_path: Path, *, fast: bool, dry_run: bool) -> None:
+def create_metrics_snapshot(metrics: BuildMetrics, outputs: Mapping[URLPath, OutputRecord], build_dir: BuildDirectory,
+        cache: BuildCache) -> MetricsSnapshot:
+    return MetricsSnapshot(
+        timestamp=dt.datetime.now(dt.timezone.utc),
+        duration_seconds=metrics.elapsed,
+        phases=metrics.phases,
+        files_written=build_dir.files_written,
+        bytes_written=build_dir.bytes_written,
+        output_files=len(outputs),
+        output_bytes=sum(r.size for r in outputs.values()),
+        images_built=metrics.images_built,
+        images_reused=metrics.images_reused,
+        cache_hits=dict(cache.hits),
+        cache_misses=dict(cache.misses))
+
+
+def run_build(build_path: Path, resources_path: Path, *, fast: bool, dry_run: bool,
+        cache_path: Path | None = None, srcset_mode: SrcSetMode = SrcSetMode.FIXED,
+        quality_mode: QualityMode = QualityMode.FIXED, measure_encoder_profiles: bool = False,
+        output_archive: Path | None = None, shard: Shard | None = None, merge_shard_paths: Sequence[Path] = (),
+        metrics_path: Path | None = None, progress_interval: float = 5,
+        estimate: bool = False, estimate_workers: int | None = None, verify: bool = True) -> None:
+    """If output_archive is given, the site is built into that archive file instead of build_path.
+        If shard is given, only that shard's images are built, plus a manifest of them. The shards' build directories
+        are then passed as merge_shard_paths to a final build, which reuses their images and builds the rest.
+        If metrics_path is given, a snapshot of the build metrics is written to it (see write_metrics()).
+        Progress of the slow build phases is logged every progress_interval seconds.
+        If estimate is True (which requires dry_run), nothing is built. Instead the build time for estimate_workers
+        workers and the output size are predicted from the cost model fitted from previous builds.
+        If verify is True, the built site is checked for broken links and images (see verify_site())."""
+
     logger.info(f'Running website build')
-    logger.info(f'Build directory: "{build_path}"')
+    output_path = output_archive if output_archive is not None else build_path
+    logger.info(f'Output path: "{output_path}"')
     logger.info(f'Resources directory: "{resources_path}"')
+    logger.info(f'Cache directory: "{cache_path}"')
+    if shard is not None:
+        logger.info(f'Building shard {shard}')
+    if merge_shard_paths:
+        logger.info(f'Merging {len(merge_shard_paths)} shards')
+
+    backend: OutputBackend
+    if dry_run:
+        # Builds in memory, so it can still report what would be built. Srcset images aren't reencoded, which is most
+        # of the build time, only recorded with estimated sizes.
+        backend = MemoryOutputBackend()
+    elif output_archive is not None:
+        backend = ArchiveOutputBackend(output_archive)
+    else:
+        backend = LocalOutputBackend(build_path)
+    build_dir = BuildDirectory(backend, fast=fast)
+    # Dry runs (and estimates) need to know what a real build could reuse, which the in memory build directory can't
+    # tell.
+    existing_build_dir = BuildDirectory(LocalOutputBackend(build_path), fast=fast) \
+        if dry_run and output_archive is None else build_dir
+    cache = BuildCache(cache_path, dry_run=dry_run)
+    metrics = BuildMetrics(progress_interval)
+    failed = False
+    try:
+        # Options which affect the content of images, which must be the same for all shards.
+        image_options = {'fast': fast, 'srcset_mode': srcset_mode, 'quality_mode': quality_mode,
+            'measure_encoder_profiles': measure_encoder_profiles}
+        options_fingerprint = get_options_fingerprint(
+            image_options | {'resources_path': resources_path.resolve(), 'shard': shard})
+        # Shard outputs may have changed since the last merge, so always merge from scratch.
+        journal = None if merge_shard_paths else load_journal(cache, output_path, options_fingerprint)
+
+        logger.info(f'Scanning resources')
+        input_snapshot = scan_files(resources_path, parallel=True)
+        changes, input_records = get_input_changes(journal, input_snapshot)
+        if journal is not None and not changes:
+            if outputs_exist(journal.outputs.items(), existing_build_dir):
+                logger.info('No inputs changed and all outputs exist, nothing to do')
+                if metrics_path is not None:
+                    write_metrics(create_metrics_snapshot(metrics, journal.outputs, build_dir, cache), metrics_path)
+                return
+            logger.info('Some outputs are missing or modified, rebuilding')
+
+        # Imported here because they have slow to import dependencies (PIL, Jinja2, minifiers),
+        # which aren't needed if there's nothing to build.
+        from buildtool.build.asset import build_all_assets
+        from buildtool.build.asset.image import build_all_image_assets, create_image_build_records, get_image_sources, \
+            get_photo_image_id
+        from buildtool.build.estimate import estimate_build, load_cost_model, print_build_estimate, update_cost_model
+        from buildtool.build.headers import build_headers
+        from buildtool.build.html import build_all_html
+        from buildtool.build.service_worker import build_service_worker
+        from buildtool.build.shard import build_shard_manifest, import_shard_images, load_shard_images
+        from buildtool.build.statistics import print_build_statistics
+        from buildtool.build.verify import verify_site
+
+        photo_path = get_photo_resources_path(resources_path)
+        logger.info(f'Finding photos in: "{photo_path}"')
+        photo_resource_records = pair_photo_files(input_snapshot.subtree(photo_path))
+
+        reusable_photo_infos = get_reusable_photo_infos(journal, changes)
+        photo_infos: list[PhotoInfo] = []
+        changed_records: list[PhotoResourceRecord] = []
+        for record in photo_resource_records:
+            if record.image_file_path in reusable_photo_infos and changes.is_unchanged(record.metadata_file_path):
+                photo_infos.append(reusable_photo_infos[record.image_file_path])
+            else:
+                changed_records.append(record)
+        photo_infos += read_photo_infos(changed_records)
+        # Sort by ID for stability and debuggability.
+        photo_infos = tuple(sorted(photo_infos, key=lambda p: p.id))
+        verify_photo_ids(photo_infos)
+
+        photo_collection = PhotoCollection(photo_infos)
 
-    build_dir = BuildDirectory(build_path, fast=fast, dry_run=dry_run)
-    build_dir.clean()
+        # Images are by far the slowest to build, so only those are built incrementally, everything else is rebuilt.
+        image_sources = get_image_sources(resources_path, photo_collection)
+        if merge_shard_paths:
+            shard_images = load_shard_images(merge_shard_paths, resources_path,
+                get_options_fingerprint(image_options), image_sources, input_snapshot)
+            build_dir.clean()
+            prebuilt_images = import_shard_images(shard_images, build_dir)
+        else:
+            prebuilt_images = get_reusable_images(journal, changes, image_sources, existing_build_dir)
+            build_dir.clean(keep=[url for record in prebuilt_images.values() for url in record.outputs])
 
-    photo_resource_records = find_photos(get_photo_resources_path(resources_path))
+        if estimate:
+            model = load_cost_model(cache)
+            if model is None:
+                logger.warning('Can\'t estimate without a cost model, which is fitted from builds using the cache')
+                return
+            changed_image_paths = {record.image_file_path for record in changed_records}
+            changed_photo_ids = {photo.id for photo in photo_infos
+                if photo.source_path in changed_image_paths or get_photo_image_id(photo.id) not in prebuilt_images}
+            print_build_estimate(estimate_build(model, workers=estimate_workers or os.cpu_count() or 1,
+                image_sources=image_sources, photos=photo_collection, prebuilt_images=prebuilt_images,
+                changed_photo_ids=changed_photo_ids, previous_outputs=journal.outputs if journal is not None else {},
+                page_cache_enabled=cache.enabled))
+            return
 
-    photo_infos = [read_photo_info(r) for r in photo_resource_records]
-    # Sort by ID for stability and debuggability.
-    photo_infos = tuple(sorted(photo_infos, key=lambda p: p.id))
-    verify_photo_ids(photo_infos)
+        build_context = BuildContext(
+            build_dir=build_dir, resources_path=resources_path,
+            fast=fast, dry_run=dry_run,
+            srcset_mode=srcset_mode, quality_mode=quality_mode,
+            measure_encoder_profiles=measure_encoder_profiles, cache=cache,
+            changes=changes, prebuilt_images=prebuilt_images, shard=shard,
+            photos=photo_collection,
+            state=BuildState(), metrics=metrics)
 
-    photo_collection = PhotoCollection(photo_infos)
+        if shard is not None:
+            # The rest of the site is built by the merge build, once all the shards' images are available.
+            build_all_image_assets(build_context)
+            build_shard_manifest(build_context, get_options_fingerprint(image_options))
+        else:
+            # Note: must build photo assets first because they generate the srcset state which is read later when building pages.
+            build_all_assets(build_context)
+            build_all_html(build_context)
+            # Must be after pages, which are listed in the headers.
+            build_headers(build_context)
+            build_service_worker(build_context)
+            build_dir.build_manifest(MANIFEST_URL)
+            if verify:
+                verify_site(build_context)
 
-    build_context = BuildContext(
-        build_dir=build_dir, resources_path=resources_path,
-        fast=fast, dry_run=dry_run,
-        photos=photo_collection,
-        state=BuildState())
+        save_journal(cache, output_path, BuildJournal(
+            options_fingerprint=options_fingerprint,
+            inputs=input_records,
+            photos=photo_infos,
+            images=create_image_build_records(build_context),
+            outputs=build_dir.manifest))
 
-    # Note: must build photo assets first because they generate the srcset state which is read later when building pages.
-    build_all_assets(build_context)
-    build_all_html(build_context)
+        if not dry_run:
+            phase_seconds = sum(p.duration_seconds for p in metrics.phases.values())
+            update_cost_model(cache, build_context.state, metrics.elapsed - phase_seconds)
 
-    print_build_statistics(build_context)
+        print_build_statistics(build_context)
+        if metrics_path is not None:
+            write_metrics(create_metrics_snapshot(metrics, build_dir.manifest, build_dir, cache), metrics_path)
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        build_dir.close(success=not failed)
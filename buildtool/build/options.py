@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from enum import StrEnum
+import hashlib
+
+
+# Kept separate from the rest of the build code so the command line can use these without importing it all.
+
+
+class SrcSetMode(StrEnum):
+    FIXED = 'fixed'
+    """Use IMAGE_SRCSET_SPEC for every image."""
+    OPTIMISED = 'optimised'
+    """Choose breakpoints per image based on how its file size changes with width."""
+
+
+class QualityMode(StrEnum):
+    FIXED = 'fixed'
+    """Use the quality from the srcset spec."""
+    PERCEPTUAL = 'perceptual'
+    """Search for the lowest quality which meets a perceptual error target."""
+
+
+@dataclass(frozen=True)
+class Shard:
+    """One of several builds which each build a slice of the images, to be merged by a final build."""
+
+    index: int
+    """Starts from 1."""
+    count: int
+
+    def __post_init__(self) -> None:
+        if self.count < 1 or not 1 <= self.index <= self.count:
+            raise ValueError(f'Invalid shard {self.index}/{self.count}')
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.count}'
+
+    @classmethod
+    def parse(cls, value: str) -> 'Shard':
+        """Parses "i/N"."""
+
+        index, sep, count = value.partition('/')
+        if not sep:
+            raise ValueError(f'Invalid shard "{value}", expected "i/N"')
+        return cls(int(index), int(count))
+
+    def contains(self, key: str) -> bool:
+        # Python's hash() is randomised per process, which would give each shard a different partition.
+        digest = hashlib.sha256(key.encode('utf8')).digest()
+        return int.from_bytes(digest[:8], 'big') % self.count == self.index - 1
@@ -0,0 +1,445 @@
+from abc import ABC, abstractmethod
+from collections.abc import Collection
+from dataclasses import dataclass
+import hashlib
+import io
+import logging
+import os
+from pathlib import Path
+import queue
+import shutil
+import tarfile
+import tempfile
+from threading import Lock, Thread
+import time
+from typing import BinaryIO
+import zipfile
+
+import pydantic
+
+from buildtool.types import URLPath
+from buildtool.utility import hash_file
+
+
+logger = logging.getLogger(__name__)
+
+
+class OutputBackend(ABC):
+    """Where built files are stored. BuildDirectory does the bookkeeping on top of this."""
+
+    @abstractmethod
+    def clean(self, keep: Collection[URLPath]) -> None:
+        """Deletes all existing output, except for files being reused from a previous build."""
+
+    @abstractmethod
+    def prepare_file(self, url: URLPath) -> Path:
+        """Returns a path for code which needs to write to a real file (e.g. external tools).
+            commit_file() must be called once the file is written."""
+
+    @abstractmethod
+    def commit_file(self, url: URLPath) -> Path:
+        """Stores a file written to the path from prepare_file().
+            Returns the path, which can still be read from until close()."""
+
+    @abstractmethod
+    def write_bytes(self, url: URLPath, data: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def copy_file(self, source_path: Path, url: URLPath, *, link: bool) -> None:
+        """If link is true, the output may refer to the source file instead of being a copy of it."""
+
+    @abstractmethod
+    def get_size(self, url: URLPath) -> int | None:
+        """Size of an output file, or None if it doesn't exist."""
+
+    @abstractmethod
+    def read_back(self, url: URLPath) -> bytes | Path | None:
+        """Content of an output file, or a path to read it from until close(). None if it doesn't exist."""
+
+    def close(self, *, success: bool) -> None:
+        """Called once at the end of the build. If the build failed, output which could be mistaken for a complete
+            build (e.g. a deploy archive) is discarded."""
+
+
+class LocalOutputBackend(OutputBackend):
+    """Writes to a directory on disk."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def clean(self, keep: Collection[URLPath]) -> None:
+        if not keep:
+            if self.root.exists():
+                shutil.rmtree(self.root, ignore_errors=False)
+            return
+        keep_paths = {self.resolve_url_path(url) for url in keep}
+        for dir_path, _subdirs, files in os.walk(self.root, topdown=False):
+            dir_path = Path(dir_path)
+            for f in files:
+                if dir_path / f not in keep_paths:
+                    (dir_path / f).unlink()
+            if dir_path != self.root and not any(dir_path.iterdir()):
+                dir_path.rmdir()
+
+    def prepare_file(self, url: URLPath) -> Path:
+        path = self.resolve_url_path(url)
+        logger.debug(f'Creating build directory: "{path.parent}"')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            raise RuntimeError('Attempting to build file that already exists, probably a mistake!')
+        return path
+
+    def commit_file(self, url: URLPath) -> Path:
+        # Already in place.
+        return self.resolve_url_path(url)
+
+    def write_bytes(self, url: URLPath, data: bytes) -> None:
+        self.prepare_file(url).write_bytes(data)
+
+    def copy_file(self, source_path: Path, url: URLPath, *, link: bool) -> None:
+        dest_path = self.prepare_file(url)
+        if link:
+            logger.debug(f'Symlinking file: "{source_path}" -> "{dest_path}"')
+            dest_path.symlink_to(source_path.resolve())
+        else:
+            logger.debug(f'Copying file: "{source_path}" -> "{dest_path}"')
+            shutil.copy(source_path, dest_path)
+
+    def get_size(self, url: URLPath) -> int | None:
+        path = self.resolve_url_path(url)
+        return path.stat().st_size if path.is_file() else None
+
+    def read_back(self, url: URLPath) -> bytes | Path | None:
+        path = self.resolve_url_path(url)
+        return path if path.is_file() else None
+
+    def resolve_url_path(self, url: URLPath) -> Path:
+        return self.root / url.fs_path
+
+
+class ScratchDirectory:
+    """Temporary files for backends which don't store files on disk, for outputs written by external tools."""
+
+    def __init__(self) -> None:
+        self._dir = tempfile.TemporaryDirectory(prefix='buildtool-')
+
+    def get_path(self, url: URLPath) -> Path:
+        path = Path(self._dir.name) / url.fs_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def close(self) -> None:
+        self._dir.cleanup()
+
+
+class MemoryOutputBackend(OutputBackend):
+    """Keeps outputs in memory, so the build can be inspected without writing anything (e.g. for dry runs)."""
+
+    def __init__(self) -> None:
+        # Copied files are kept as a reference to the source, rather than read into memory.
+        self.files: dict[URLPath, bytes | Path] = {}
+        self._lock = Lock()
+        self._scratch = ScratchDirectory()
+
+    def clean(self, keep: Collection[URLPath]) -> None:
+        with self._lock:
+            self.files = {url: f for url, f in self.files.items() if url in keep}
+
+    def prepare_file(self, url: URLPath) -> Path:
+        return self._scratch.get_path(url)
+
+    def commit_file(self, url: URLPath) -> Path:
+        path = self._scratch.get_path(url)
+        # The scratch file is kept because subsequent build steps may read it (e.g. reencoding srcset images).
+        self._store(url, path.read_bytes())
+        return path
+
+    def write_bytes(self, url: URLPath, data: bytes) -> None:
+        self._store(url, data)
+
+    def copy_file(self, source_path: Path, url: URLPath, *, link: bool) -> None:
+        self._store(url, source_path.resolve())
+
+    def get_size(self, url: URLPath) -> int | None:
+        content = self.files.get(url)
+        if content is None:
+            return None
+        return content.stat().st_size if isinstance(content, Path) else len(content)
+
+    def read_bytes(self, url: URLPath) -> bytes:
+        content = self.files[url]
+        return content.read_bytes() if isinstance(content, Path) else content
+
+    def read_back(self, url: URLPath) -> bytes | Path | None:
+        return self.files.get(url)
+
+    def close(self, *, success: bool) -> None:
+        self._scratch.close()
+
+    def _store(self, url: URLPath, content: bytes | Path) -> None:
+        with self._lock:
+            if url in self.files:
+                raise RuntimeError('Attempting to build file that already exists, probably a mistake!')
+            self.files[url] = content
+
+
+class ArchiveWriter(ABC):
+    """Writes entries to a particular archive format. Not thread safe."""
+
+    @abstractmethod
+    def add(self, name: str, content: bytes | Path, size: int) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class LinkingArchiveWriter(ArchiveWriter):
+    """For formats which can store an entry as a link to another, so duplicate content is only stored once."""
+
+    @abstractmethod
+    def add_link(self, name: str, target: str) -> None:
+        """Adds an entry with the same content as an existing entry."""
+
+
+class TarArchiveWriter(LinkingArchiveWriter):
+    def __init__(self, tar: tarfile.TarFile, stream: BinaryIO | None = None) -> None:
+        self.tar = tar
+        # If the tar file was opened on a stream, closing the tar file doesn't close the stream.
+        self.stream = stream
+        # Use the same timestamp for everything, it's all part of the one build.
+        self.mtime = int(time.time())
+
+    def add(self, name: str, content: bytes | Path, size: int) -> None:
+        info = self._create_tar_info(name)
+        info.size = size
+        if isinstance(content, Path):
+            with open(content, 'rb') as f:
+                self.tar.addfile(info, f)
+        else:
+            self.tar.addfile(info, io.BytesIO(content))
+
+    def add_link(self, name: str, target: str) -> None:
+        info = self._create_tar_info(name)
+        info.type = tarfile.LNKTYPE
+        info.linkname = target
+        self.tar.addfile(info)
+
+    def close(self) -> None:
+        self.tar.close()
+        if self.stream is not None:
+            self.stream.close()
+
+    def _create_tar_info(self, name: str) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        return info
+
+
+# Compressing these again is a waste of time.
+ALREADY_COMPRESSED_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp', '.gz', '.br', '.zst')
+
+
+class ZipArchiveWriter(ArchiveWriter):
+    """Zip has no links, so duplicate content is stored again."""
+
+    def __init__(self, archive_path: Path) -> None:
+        self.zip = zipfile.ZipFile(archive_path, 'w')
+        self.date_time = time.localtime()[:6]
+
+    def add(self, name: str, content: bytes | Path, size: int) -> None:
+        info = zipfile.ZipInfo(name, self.date_time)
+        info.compress_type = zipfile.ZIP_STORED if name.lower().endswith(ALREADY_COMPRESSED_SUFFIXES) \
+            else zipfile.ZIP_DEFLATED
+        with self.zip.open(info, 'w') as dest:
+            if isinstance(content, Path):
+                with open(content, 'rb') as f:
+                    shutil.copyfileobj(f, dest)
+            else:
+                dest.write(content)
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+TAR_COMPRESSION_SUFFIXES = {
+    '.tar': '',
+    '.tar.gz': 'gz',
+    '.tgz': 'gz',
+    '.tar.bz2': 'bz2',
+    '.tar.xz': 'xz',
+}
+
+
+def open_zstd_tar(archive_path: Path) -> TarArchiveWriter:
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('The zstandard package is required to write .tar.zst archives') from None
+    stream = zstandard.ZstdCompressor(threads=-1).stream_writer(open(archive_path, 'wb'))
+    return TarArchiveWriter(tarfile.open(fileobj=stream, mode='w|'), stream)
+
+
+def open_archive_writer(archive_path: Path) -> ArchiveWriter:
+    """Picks the archive format from the file extension."""
+
+    name = archive_path.name.lower()
+    if name.endswith('.zip'):
+        return ZipArchiveWriter(archive_path)
+    if name.endswith(('.tar.zst', '.tzst')):
+        return open_zstd_tar(archive_path)
+    for suffix, compression in TAR_COMPRESSION_SUFFIXES.items():
+        if name.endswith(suffix):
+            # Stream mode, so the output is written sequentially.
+            return TarArchiveWriter(tarfile.open(str(archive_path), f'w|{compression}'))
+    raise ValueError(f'Unsupported archive type: "{archive_path}"')
+
+
+def is_archive_path(path: Path) -> bool:
+    name = path.name.lower()
+    return name.endswith(('.zip', '.tar.zst', '.tzst', *TAR_COMPRESSION_SUFFIXES))
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    url: URLPath
+    content: bytes | Path
+    size: int
+
+
+class ArchiveIndexEntry(pydantic.BaseModel, frozen=True):
+    path: str
+    size: int
+    sha256: str
+    link: str | None
+    """If not None, the entry is a hardlink to this path."""
+
+
+class ArchiveIndex(pydantic.BaseModel, frozen=True):
+    """Written next to the archive, so its contents can be listed without decompressing it."""
+
+    entries: list[ArchiveIndexEntry]
+
+
+def get_archive_index_path(archive_path: Path) -> Path:
+    return archive_path.with_name(f'{archive_path.name}.index.json')
+
+
+# Outputs written from memory which are read back later in the build (pages, by verification). Others are only kept by
+# the archive writer.
+READ_BACK_SUFFIXES = ('.html',)
+
+
+class ArchiveOutputBackend(OutputBackend):
+    """Streams outputs into an archive as they're built, e.g. for deploying the site as a single file.
+        Builds are multithreaded, so outputs are put on a bounded queue and written in order by a single writer thread.
+        The archive is always written from scratch, so nothing can be reused from a previous build."""
+
+    # Limits memory usage if the build produces files faster than they can be compressed.
+    QUEUE_SIZE = 32
+
+    def __init__(self, archive_path: Path) -> None:
+        self.archive_path = archive_path
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = open_archive_writer(archive_path)
+        self._queue: queue.Queue[ArchiveEntry | None] = queue.Queue(self.QUEUE_SIZE)
+        self._lock = Lock()
+        self._sizes: dict[URLPath, int] = {}
+        # Content of outputs which can be read back until close(), e.g. to verify the build.
+        self._readable: dict[URLPath, bytes | Path] = {}
+        self._index: list[ArchiveIndexEntry] = []
+        self._error: BaseException | None = None
+        self._scratch = ScratchDirectory()
+        self._writer_thread = Thread(target=self._write_entries, name='archive-writer', daemon=True)
+        self._writer_thread.start()
+
+    def clean(self, keep: Collection[URLPath]) -> None:
+        # Nothing to do, the archive is truncated when opened.
+        assert not keep
+
+    def prepare_file(self, url: URLPath) -> Path:
+        return self._scratch.get_path(url)
+
+    def commit_file(self, url: URLPath) -> Path:
+        # The scratch file is kept because subsequent build steps may read it (e.g. reencoding srcset images).
+        path = self._scratch.get_path(url)
+        self._enqueue(ArchiveEntry(url, path, path.stat().st_size))
+        self._readable[url] = path
+        return path
+
+    def write_bytes(self, url: URLPath, data: bytes) -> None:
+        self._enqueue(ArchiveEntry(url, data, len(data)))
+        if url.suffix in READ_BACK_SUFFIXES:
+            # Only the archive writer has the content after this.
+            self._readable[url] = data
+
+    def copy_file(self, source_path: Path, url: URLPath, *, link: bool) -> None:
+        # Can't link to something outside the archive.
+        self._enqueue(ArchiveEntry(url, source_path, source_path.stat().st_size))
+        self._readable[url] = source_path
+
+    def get_size(self, url: URLPath) -> int | None:
+        return self._sizes.get(url)
+
+    def read_back(self, url: URLPath) -> bytes | Path | None:
+        """None for outputs written from memory other than pages (see READ_BACK_SUFFIXES)."""
+
+        return self._readable.get(url)
+
+    def close(self, *, success: bool) -> None:
+        self._queue.put(None)
+        self._writer_thread.join()
+        self._writer.close()
+        self._scratch.close()
+        index_path = get_archive_index_path(self.archive_path)
+        if not success:
+            logger.info(f'Build failed, deleting partial archive: "{self.archive_path}"')
+            self.archive_path.unlink(missing_ok=True)
+            # Would describe an archive which no longer exists.
+            index_path.unlink(missing_ok=True)
+            return
+        if self._error is not None:
+            raise RuntimeError(f'Failed to write archive: "{self.archive_path}"') from self._error
+        logger.info(f'Finished archive: "{self.archive_path}"')
+        logger.info(f'Writing archive index: "{index_path}"')
+        index_path.write_text(ArchiveIndex(entries=self._index).model_dump_json(indent=1), encoding='utf8')
+
+    def _enqueue(self, entry: ArchiveEntry) -> None:
+        if self._error is not None:
+            raise RuntimeError(f'Failed to write archive: "{self.archive_path}"') from self._error
+        with self._lock:
+            if entry.url in self._sizes:
+                raise RuntimeError('Attempting to build file that already exists, probably a mistake!')
+            self._sizes[entry.url] = entry.size
+        # Blocks if the writer is behind.
+        self._queue.put(entry)
+
+    def _write_entries(self) -> None:
+        names_by_hash: dict[str, str] = {}
+        while (entry := self._queue.get()) is not None:
+            if self._error is not None:
+                # Keep consuming so producers don't block forever.
+                continue
+            try:
+                name = entry.url.fs_path.as_posix()
+                if isinstance(entry.content, Path):
+                    sha256 = hash_file(entry.content)
+                else:
+                    sha256 = hashlib.sha256(entry.content).hexdigest()
+                link = names_by_hash.get(sha256)
+                if link is not None and isinstance(self._writer, LinkingArchiveWriter):
+                    logger.debug(f'Archiving {name} as link to {link}')
+                    self._writer.add_link(name, link)
+                else:
+                    # Formats without links store duplicate content again.
+                    link = None
+                    logger.debug(f'Archiving {name}')
+                    self._writer.add(name, entry.content, entry.size)
+                    names_by_hash[sha256] = name
+                self._index.append(ArchiveIndexEntry(path=name, size=entry.size, sha256=sha256, link=link))
+            except BaseException as e:
+                logger.error(f'Failed to write {entry.url} to archive: {e}')
+                self._error = e
@@ -0,0 +1,107 @@
+from collections import Counter
+from collections.abc import Mapping
+import hashlib
+from importlib.metadata import version
+import json
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import Any
+
+import jinja2
+import jinja2.meta
+
+from buildtool.build.cache import BuildCache
+from buildtool.build.journal import get_options_fingerprint
+
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint_render_context(render_context: Mapping[str, Any]) -> str:
+    # Render contexts are plain data, except for some frozen dataclasses (e.g. PartialDate) whose repr is stable.
+    data = json.dumps(render_context, sort_keys=True, default=repr)
+    return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+
+class PageOutputCache:
+    """Rendered and post-processed HTML pages from previous builds. A page is keyed by everything its output depends on:
+        the templates it's rendered from, the shared context variables they use, its own render context, and the build
+        tool code. So a page is only rendered if one of those changed."""
+
+    CACHE_NAMESPACE = 'html-page'
+
+    def __init__(self, cache: BuildCache, jinja2_env: jinja2.Environment, shared_context: Mapping[str, Any]) -> None:
+        """shared_context is the part of the render context which is the same for every page (i.e. Jinja2 globals)."""
+
+        self.cache = cache
+        self.jinja2_env = jinja2_env
+        self.shared_context = shared_context
+        # Critical CSS inlining and minification happen after rendering, which is covered by the code fingerprint.
+        self.code_fingerprint = get_options_fingerprint({'minify_html': version('minify_html')})
+        self._template_fingerprints: dict[str, str] = {}
+        self._lock = Lock()
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.enabled
+
+    def get_template_fingerprint(self, template_name: str) -> str:
+        """Identifies the source of a template and all the templates it extends, includes or imports, plus the values of
+            the shared variables they use."""
+
+        with self._lock:
+            if template_name in self._template_fingerprints:
+                return self._template_fingerprints[template_name]
+
+        fingerprint = hashlib.sha256()
+        shared_names: set[str] = set()
+        pending = [template_name]
+        seen: set[str] = set()
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            assert self.jinja2_env.loader is not None
+            source, _, _ = self.jinja2_env.loader.get_source(self.jinja2_env, name)
+            fingerprint.update(f'{name}\0{source}\0'.encode('utf8'))
+            ast = self.jinja2_env.parse(source)
+            for referenced in jinja2.meta.find_referenced_templates(ast):
+                # Dynamic template names can't be followed, which would make the key incomplete.
+                if referenced is None:
+                    raise RuntimeError(f'Template "{name}" references a template by a dynamic name, can\'t cache it')
+                pending.append(referenced)
+            shared_names.update(n for n in jinja2.meta.find_undeclared_variables(ast) if n in self.shared_context)
+        # E.g. photo pages don't use the srcsets of all images, so don't need to be rebuilt when an unrelated image is.
+        fingerprint.update(fingerprint_render_context(
+            {name: self.shared_context[name] for name in shared_names}).encode('utf8'))
+
+        with self._lock:
+            self._template_fingerprints[template_name] = fingerprint.hexdigest()
+        return fingerprint.hexdigest()
+
+    def get_key(self, template_name: str, render_context: Mapping[str, Any]) -> str:
+        return (f'{self.code_fingerprint}:{self.get_template_fingerprint(template_name)}'
+            f':{fingerprint_render_context(render_context)}')
+
+    def load(self, template_name: str, key: str) -> Path | None:
+        path = self.cache.load_file(self.CACHE_NAMESPACE, key, '.html')
+        with self._lock:
+            if path is None:
+                self.misses[template_name] += 1
+            else:
+                self.hits[template_name] += 1
+        return path
+
+    def save(self, key: str, html: str) -> None:
+        self.cache.save_file(self.CACHE_NAMESPACE, key, html.encode('utf8'), '.html')
+
+    def log_statistics(self) -> None:
+        if not self.enabled:
+            return
+        for template_name in sorted(self.hits.keys() | self.misses.keys()):
+            logger.info(f'Page cache for {template_name}: hits: {self.hits[template_name]},'
+                f' misses: {self.misses[template_name]}')
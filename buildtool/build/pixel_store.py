@@ -0,0 +1,131 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+import io
+import logging
+import math
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+import numpy.typing as npt
+from PIL import ExifTags, ImageCms, ImageOps
+from PIL.Image import Image, Resampling, fromarray
+
+from buildtool.image import RawImageFile, open_image_file
+from buildtool.types import Size
+
+
+logger = logging.getLogger(__name__)
+
+
+RAW_DTYPE = np.dtype('<u2')
+RAW_MAX = 65535
+
+
+def srgb_to_linear(values: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+
+def linear_to_srgb(values: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055).astype(np.float32)
+
+
+# ICC profile colour space -> image mode the profile is applied to.
+ICC_COLOUR_SPACE_MODES = {
+    'RGB': 'RGB',
+    'CMYK': 'CMYK',
+    'GRAY': 'L'
+}
+
+# Indexed by 8-bit sRGB value.
+SRGB_TO_LINEAR_LUT = srgb_to_linear(np.arange(256, dtype=np.float32) / 255)
+
+
+@dataclass(frozen=True)
+class DecodedPixels:
+    """Working copy of an image (see RawImageFile). Only valid while opened from the store."""
+
+    raw: RawImageFile
+    pixels: np.memmap
+    """Read only view of the file, shape (height, width, 3)."""
+
+    @property
+    def size(self) -> Size:
+        return self.raw.size
+
+    def to_srgb_image(self) -> Image:
+        srgb = linear_to_srgb(self.pixels.astype(np.float32) / RAW_MAX)
+        return fromarray(np.round(srgb * 255).astype(np.uint8), 'RGB')
+
+
+class DecodedPixelStore:
+    """Decodes each source image once into a working copy no wider than working_width, for all the derived images to
+        read from instead of decoding the source again.
+        The working copies are memory mapped files, so they are shared with ImageMagick through the page cache rather
+        than copied. Each is deleted when closed, so only the images being built take up space."""
+
+    def __init__(self, root: Path, working_width: int) -> None:
+        self.root = root
+        self.working_width = working_width
+        self.decodes = 0
+        self._lock = Lock()
+
+    @contextmanager
+    def open(self, image_path: Path) -> Iterator[DecodedPixels]:
+        with self._lock:
+            raw_path = self.root / f'{self.decodes}.raw'
+            self.decodes += 1
+        pixels = decode_working_copy(image_path, self.working_width, raw_path)
+        try:
+            yield pixels
+        finally:
+            logger.debug(f'Deleting decoded pixels: "{raw_path}"')
+            raw_path.unlink()
+
+
+def decode_working_copy(image_path: Path, working_width: int, output_path: Path) -> DecodedPixels:
+    logger.debug(f'Decoding image: "{image_path}" -> "{output_path}"')
+    with open_image_file(image_path) as image:
+        orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+        # Orientations 5-8 swap width and height.
+        upright_width = image.height if orientation >= 5 else image.width
+        scale = min(working_width / upright_width, 1)
+        # JPEGs can be decoded at a fraction of full size for much less work. Rounded up because draft() only picks
+        # scales which give at least the requested size.
+        image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        upright_image = convert_to_upright_srgb(image)
+    linear = SRGB_TO_LINEAR_LUT[np.asarray(upright_image)]
+    upright_image.close()
+
+    width, height = linear.shape[1], linear.shape[0]
+    if width > working_width:
+        size = Size((working_width, round(height * working_width / width)))
+        # Pillow can only resize floating point images one channel at a time.
+        linear = np.stack([np.asarray(fromarray(np.ascontiguousarray(linear[..., channel]), 'F')
+            .resize(size, Resampling.LANCZOS)) for channel in range(3)], axis=-1)
+    else:
+        size = Size((width, height))
+
+    pixels = np.memmap(output_path, dtype=RAW_DTYPE, mode='w+', shape=(size[1], size[0], 3))
+    pixels[:] = np.round(np.clip(linear, 0, 1) * RAW_MAX)
+    pixels.flush()
+    del pixels
+    return DecodedPixels(RawImageFile(output_path, size),
+        np.memmap(output_path, dtype=RAW_DTYPE, mode='r', shape=(size[1], size[0], 3)))
+
+
+def convert_to_upright_srgb(image: Image) -> Image:
+    """Applies the EXIF orientation and ICC profile to the pixels, like they're displayed."""
+
+    icc_profile = image.info.get('icc_profile')
+    upright_image = ImageOps.exif_transpose(image)
+    if not icc_profile:
+        return upright_image.convert('RGB')
+    profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+    # The profile is for the image's own colour space (e.g. CMYK), so is applied before converting to RGB. Only
+    # channels it can't transform (e.g. palette or alpha) are converted first.
+    input_mode = ICC_COLOUR_SPACE_MODES.get(profile.profile.xcolor_space.strip(), 'RGB')
+    if upright_image.mode != input_mode:
+        upright_image = upright_image.convert(input_mode)
+    return ImageCms.profileToProfile(upright_image, profile, ImageCms.createProfile('sRGB'), outputMode='RGB')
@@ -0,0 +1,232 @@
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from dataclasses import dataclass
+import datetime as dt
+import logging
+from pathlib import Path
+import threading
+import time
+from typing import TypeVar
+
+import pydantic
+
+
+logger = logging.getLogger(__name__)
+
+
+T = TypeVar('T')
+
+
+@dataclass(frozen=True)
+class TaskTiming:
+    name: str
+    seconds: float
+
+
+class ProgressTracker:
+    """Tracks the tasks of one build phase, which may run concurrently, and periodically logs progress.
+        Per-task logging is left to debug level, this gives the overview."""
+
+    def __init__(self, phase: str, total: int, report_interval: float) -> None:
+        self.phase = phase
+        self.total = total
+        self.report_interval = report_interval
+        self.done = 0
+        self.start_time = time.monotonic()
+        self.end_time: float | None = None
+        self.slowest: TaskTiming | None = None
+        # Task name -> start time.
+        self._active: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reporter: threading.Thread | None = None
+
+    def start_reporting(self) -> None:
+        if self.total and self.report_interval > 0:
+            self._reporter = threading.Thread(target=self._report_periodically, name=f'progress-{self.phase}',
+                daemon=True)
+            self._reporter.start()
+
+    def finish(self) -> None:
+        self.end_time = time.monotonic()
+        self._stop.set()
+        if self._reporter is not None:
+            self._reporter.join()
+        if self.total:
+            logger.info(f'{self.phase}: {self.done} tasks in {format_duration(self.elapsed)}'
+                + (f', slowest: {self.slowest.name} ({format_duration(self.slowest.seconds)})' if self.slowest else ''))
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    @contextmanager
+    def task(self, name: str) -> Iterator[None]:
+        start_time = time.monotonic()
+        with self._lock:
+            self._active[name] = start_time
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - start_time
+            with self._lock:
+                del self._active[name]
+            self.record(name, seconds)
+
+    def record(self, name: str, seconds: float) -> None:
+        """Counts a task which was timed elsewhere, e.g. in another process."""
+
+        with self._lock:
+            self.done += 1
+            if self.slowest is None or seconds > self.slowest.seconds:
+                self.slowest = TaskTiming(name, seconds)
+
+    def run(self, name: str, function: Callable[[], T]) -> T:
+        with self.task(name):
+            return function()
+
+    def get_status(self) -> str:
+        now = time.monotonic()
+        with self._lock:
+            done = self.done
+            active = dict(self._active)
+        elapsed = now - self.start_time
+        status = f'{self.phase}: {done}/{self.total} ({done / self.total:.0%})'
+        if done:
+            rate = done / elapsed
+            # Assumes the remaining tasks take as long as the finished ones on average.
+            status += f', {rate:.2f}/s, ETA {format_duration((self.total - done) / rate)}'
+        status += f', {len(active)} active'
+        if active:
+            slowest_name, slowest_start = min(active.items(), key=lambda a: a[1])
+            status += f', slowest running: {slowest_name} ({format_duration(now - slowest_start)})'
+        return status
+
+    def _report_periodically(self) -> None:
+        while not self._stop.wait(self.report_interval):
+            logger.info(self.get_status())
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f'{seconds:.1f}s'
+    return str(dt.timedelta(seconds=round(seconds)))
+
+
+class PhaseMetrics(pydantic.BaseModel, frozen=True):
+    duration_seconds: float
+    tasks: int
+    slowest_task: str | None
+    slowest_task_seconds: float | None
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class MetricsSnapshot(pydantic.BaseModel, frozen=True):
+    """Summary of a build, for dashboards."""
+
+    timestamp: dt.datetime
+    duration_seconds: float
+    phases: dict[str, PhaseMetrics]
+    files_written: int
+    bytes_written: int
+    """Excludes files reused from a previous build."""
+    output_files: int
+    output_bytes: int
+    images_built: int
+    images_reused: int
+    cache_hits: dict[str, int]
+    """By cache namespace."""
+    cache_misses: dict[str, int]
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class BuildMetrics:
+    def __init__(self, report_interval: float = 5) -> None:
+        self.report_interval = report_interval
+        self.start_time = time.monotonic()
+        self.phases: dict[str, PhaseMetrics] = {}
+        self.images_built = 0
+        self.images_reused = 0
+
+    @contextmanager
+    def phase(self, name: str, total: int) -> Iterator[ProgressTracker]:
+        tracker = ProgressTracker(name, total, self.report_interval)
+        tracker.start_reporting()
+        try:
+            yield tracker
+        finally:
+            tracker.finish()
+            self.phases[name] = PhaseMetrics(
+                duration_seconds=tracker.elapsed, tasks=tracker.done,
+                slowest_task=tracker.slowest.name if tracker.slowest else None,
+                slowest_task_seconds=tracker.slowest.seconds if tracker.slowest else None)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+
+PROMETHEUS_METRIC_PREFIX = 'buildtool_'
+
+
+def format_prometheus_labels(labels: Mapping[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = {k: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in labels.items()}
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped.items()) + '}'
+
+
+def format_prometheus_value(value: float) -> str:
+    # Avoid exponent notation for large counts (e.g. bytes), which would lose precision.
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_prometheus_metrics(snapshot: MetricsSnapshot) -> str:
+    """Text exposition format, for the node exporter textfile collector."""
+
+    metrics: list[tuple[str, str, list[tuple[dict[str, str], float]]]] = [
+        ('last_build_timestamp_seconds', 'When the build finished.', [({}, snapshot.timestamp.timestamp())]),
+        ('build_duration_seconds', 'Total build time.', [({}, snapshot.duration_seconds)]),
+        ('phase_duration_seconds', 'Time taken by each build phase.',
+            [({'phase': name}, p.duration_seconds) for name, p in snapshot.phases.items()]),
+        ('phase_tasks', 'Tasks completed by each build phase.',
+            [({'phase': name}, p.tasks) for name, p in snapshot.phases.items()]),
+        ('phase_slowest_task_seconds', 'Slowest task of each build phase.',
+            [({'phase': name}, p.slowest_task_seconds) for name, p in snapshot.phases.items()
+                if p.slowest_task_seconds is not None]),
+        ('files_written', 'Output files written, excluding reused files.', [({}, snapshot.files_written)]),
+        ('bytes_written', 'Output bytes written, excluding reused files.', [({}, snapshot.bytes_written)]),
+        ('output_files', 'Files in the build output.', [({}, snapshot.output_files)]),
+        ('output_bytes', 'Bytes in the build output.', [({}, snapshot.output_bytes)]),
+        ('images_built', 'Images built.', [({}, snapshot.images_built)]),
+        ('images_reused', 'Images reused from a previous build or shards.', [({}, snapshot.images_reused)]),
+        ('cache_hits', 'Build cache hits.',
+            [({'namespace': n}, count) for n, count in snapshot.cache_hits.items()]),
+        ('cache_misses', 'Build cache misses.',
+            [({'namespace': n}, count) for n, count in snapshot.cache_misses.items()]),
+    ]
+    lines: list[str] = []
+    for name, help_text, samples in metrics:
+        full_name = PROMETHEUS_METRIC_PREFIX + name
+        lines.append(f'# HELP {full_name} {help_text}')
+        lines.append(f'# TYPE {full_name} gauge')
+        for labels, value in samples:
+            lines.append(f'{full_name}{format_prometheus_labels(labels)} {format_prometheus_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(snapshot: MetricsSnapshot, path: Path) -> None:
+    """Prometheus text format if the file name ends with .prom, otherwise JSON."""
+
+    logger.info(f'Writing build metrics: "{path}"')
+    if path.suffix == '.prom':
+        content = format_prometheus_metrics(snapshot)
+    else:
+        content = snapshot.model_dump_json(indent=1)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so collectors never see a partial file.
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(content, encoding='utf8')
+    tmp_path.replace(path)
@@ -0,0 +1,40 @@
+import hashlib
+import logging
+
+from rjsmin import jsmin
+
+from buildtool.build.common import BuildContext
+from buildtool.build.html import create_jinja2_environment
+from buildtool.resource.html import get_html_resources_path
+from buildtool.url import ASSETS_CSS_URL, ASSETS_IMAGE_URL, ASSETS_JS_URL, ASSETS_SEARCH_URL, SERVICE_WORKER_URL
+
+
+logger = logging.getLogger(__name__)
+
+
+SERVICE_WORKER_TEMPLATE = 'scripts/service_worker.js'
+
+
+def build_service_worker(context: BuildContext) -> None:
+    """Must be built last, because the cache name depends on the content of everything else."""
+
+    logger.info('Building service worker')
+    jinja2_env = create_jinja2_environment(get_html_resources_path(context.resources_path), context.cache)
+    template = jinja2_env.get_template(SERVICE_WORKER_TEMPLATE)
+    content = template.render({
+        'cache_name': f'site-{get_content_version(context)}',
+        # The shell: styles and scripts used by every page. They are fingerprinted so are safe to cache forever.
+        'precache_urls': sorted(str(u) for u in context.state.asset_urls.values()),
+        'immutable_url_prefixes': [f'{ASSETS_CSS_URL}/', f'{ASSETS_JS_URL}/', f'{ASSETS_SEARCH_URL}/'],
+        'image_url_prefix': f'{ASSETS_IMAGE_URL}/'
+    })
+    context.build_dir.build_content(jsmin(content), SERVICE_WORKER_URL)
+
+
+def get_content_version(context: BuildContext) -> str:
+    """Hash of the content of every built file."""
+
+    version_hash = hashlib.sha256()
+    for url, record in sorted(context.build_dir.manifest.items()):
+        version_hash.update(f'{url}:{record.sha256}\n'.encode('utf8'))
+    return version_hash.hexdigest()[:16]
@@ -0,0 +1,128 @@
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+
+import pydantic
+
+from buildtool.build.asset.image import create_image_build_records
+from buildtool.build.common import BuildContext, BuildDirectory, ImageBuildRecord
+from buildtool.build.journal import InputFileRecord
+from buildtool.build.options import Shard
+from buildtool.file_scan import FileSnapshot
+from buildtool.types import ImageID, PhotoID
+from buildtool.url import SHARD_MANIFEST_URL
+from buildtool.utility import hash_file
+
+
+logger = logging.getLogger(__name__)
+
+
+class ShardManifest(pydantic.BaseModel, frozen=True):
+    """The part of the build state produced by one shard build, for the merge build to combine."""
+
+    shard: str
+    options_fingerprint: str
+    """Must match the merge build, otherwise the shards' images would be inconsistent with the rest of the site."""
+    resources_path: Path
+    """Resources directory used by the shard, which may be on a different machine to the merge build."""
+    images: dict[ImageID, ImageBuildRecord]
+    sources: dict[ImageID, InputFileRecord]
+    """The source file of each image when the shard built it, so the merge can tell if it changed since."""
+    photo_id_to_image_id: dict[PhotoID, ImageID]
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+def build_shard_manifest(context: BuildContext, options_fingerprint: str) -> None:
+    assert context.shard is not None
+    images = create_image_build_records(context)
+    sources: dict[ImageID, InputFileRecord] = {}
+    for image_id, record in images.items():
+        stat = record.source_path.stat()
+        sources[image_id] = InputFileRecord(size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+            sha256=context.cache.hash_file(record.source_path))
+    manifest = ShardManifest(
+        shard=str(context.shard),
+        options_fingerprint=options_fingerprint,
+        resources_path=context.resources_path.resolve(),
+        images=images,
+        sources=sources,
+        photo_id_to_image_id=context.state.photo_id_to_image_id)
+    context.build_dir.build_content(manifest.model_dump_json(indent=1), SHARD_MANIFEST_URL)
+
+
+@dataclass(frozen=True)
+class ShardImage:
+    shard_path: Path
+    """The shard's build directory, containing the image outputs."""
+    record: ImageBuildRecord
+
+
+def is_source_unchanged(path: Path, record: InputFileRecord, input_snapshot: FileSnapshot) -> bool:
+    stat = input_snapshot.files.get(path)
+    if stat is None or stat.size != record.size:
+        return False
+    # Shards may be built from a different checkout, where modification times differ, so then compare the content.
+    return stat.mtime_ns == record.mtime_ns or hash_file(path) == record.sha256
+
+
+def load_shard_images(shard_paths: Sequence[Path], resources_path: Path, options_fingerprint: str,
+        image_sources: Mapping[ImageID, Path], input_snapshot: FileSnapshot) -> dict[ImageID, ShardImage]:
+    """Reads the images built by each shard. Images which aren't in the merge build's sources, or whose source files
+        changed since the shard was built, are skipped, and will be built by the merge build."""
+
+    manifests = [
+        (shard_path, ShardManifest.model_validate_json((shard_path / SHARD_MANIFEST_URL.fs_path).read_bytes()))
+        for shard_path in shard_paths]
+
+    shards = [Shard.parse(manifest.shard) for _, manifest in manifests]
+    for (shard_path, manifest), shard in zip(manifests, shards):
+        if manifest.options_fingerprint != options_fingerprint:
+            raise RuntimeError(f'Shard {shard} in "{shard_path}" was built with different options or build tool code')
+    counts = {shard.count for shard in shards}
+    if len(counts) > 1:
+        raise RuntimeError(f'Shards are from different partitions: {", ".join(map(str, shards))}')
+    if len(set(shards)) < len(shards):
+        raise RuntimeError(f'Duplicate shards: {", ".join(map(str, shards))}')
+    if counts:
+        count, = counts
+        missing = sorted(set(range(1, count + 1)) - {shard.index for shard in shards})
+        if missing:
+            logger.warning(f'Missing shards {missing} of {count}, their images will be built now')
+
+    images: dict[ImageID, ShardImage] = {}
+    for (shard_path, manifest), shard in zip(manifests, shards):
+        removed_count = 0
+        changed_count = 0
+        for image_id, record in manifest.images.items():
+            # Shards may have been built from a checkout in a different location.
+            if record.source_path.is_relative_to(manifest.resources_path):
+                source_path = resources_path / record.source_path.relative_to(manifest.resources_path)
+                record = record.model_copy(update={'source_path': source_path})
+            if image_sources.get(image_id) != record.source_path:
+                removed_count += 1
+            elif not is_source_unchanged(record.source_path, manifest.sources[image_id], input_snapshot):
+                logger.debug(f'Source changed since shard {shard} was built: "{record.source_path}"')
+                changed_count += 1
+            else:
+                images[image_id] = ShardImage(shard_path, record)
+        if removed_count:
+            logger.warning(f'Shard {shard} has {removed_count} images which aren\'t in the resources, ignoring them')
+        if changed_count:
+            logger.warning(f'Shard {shard} has {changed_count} images whose sources changed since, they will be'
+                ' built now')
+        logger.info(f'Shard {shard}: {len(manifest.images) - removed_count - changed_count} images,'
+            f' {len(manifest.photo_id_to_image_id)} photos')
+    return images
+
+
+def import_shard_images(shard_images: Mapping[ImageID, ShardImage], build_dir: BuildDirectory) \
+        -> dict[ImageID, ImageBuildRecord]:
+    """Copies the shards' image outputs into the build directory. Returns the images to reuse."""
+
+    logger.info(f'Importing {len(shard_images)} images from shards')
+    for image in shard_images.values():
+        for url, output in image.record.outputs.items():
+            build_dir.import_file(image.shard_path / url.fs_path, url, output)
+    return {image_id: image.record for image_id, image in shard_images.items()}
@@ -1,22 +1,95 @@
 from collections import defaultdict
-
-import numpy as np
+from statistics import mean
 
 from buildtool.build.common import BuildContext
+from buildtool.types import URLPath
 
 
 def print_build_statistics(context: BuildContext) -> None:
+    print_output_statistics(context)
     print_image_statistics(context)
+    print_srcset_ladder_statistics(context)
+    print_perceptual_quality_statistics(context)
+    print_encoder_profile_statistics(context)
+
+
+def print_output_statistics(context: BuildContext) -> None:
+    count_by_type: defaultdict[str, int] = defaultdict(int)
+    bytes_by_type: defaultdict[str, int] = defaultdict(int)
+    for url, record in context.build_dir.manifest.items():
+        file_type = url.suffix.lower() or '(none)'
+        count_by_type[file_type] += 1
+        bytes_by_type[file_type] += record.size
+
+    prefix = 'Would build' if context.dry_run else 'Built'
+    total_bytes = sum(bytes_by_type.values())
+    print(f'{prefix} {len(context.build_dir.manifest)} files, {int(total_bytes / 1000)}KB:')
+    for file_type in sorted(bytes_by_type.keys(), key=lambda t: bytes_by_type[t], reverse=True):
+        print(f'{file_type}: {count_by_type[file_type]} files, {int(bytes_by_type[file_type] / 1000)}KB')
 
 
 def print_image_statistics(context: BuildContext) -> None:
     image_file_sizes_by_tag: defaultdict[str, list[int]] = defaultdict(list)
     for srcset in context.state.image_srcsets.values():
         for entry in srcset:
-            image_file_sizes_by_tag[entry.descriptor].append(context.build_dir.resolve_url_path(entry.url).stat().st_size)
-    averages = {tag: np.mean(sizes) for tag, sizes in image_file_sizes_by_tag.items()}
+            image_file_sizes_by_tag[entry.descriptor].append(context.build_dir.manifest[entry.url].size)
+    averages = {tag: mean(sizes) for tag, sizes in image_file_sizes_by_tag.items()}
 
     print(f'Image srcset average files sizes:')
     for tag in sorted(averages.keys(), key=lambda t: (len(t), t)):
         avg = averages[tag]
         print(f'{tag}: {int(avg / 1000)}KB')
+
+
+def print_srcset_ladder_statistics(context: BuildContext) -> None:
+    if not context.state.fixed_ladder_bytes:
+        return
+
+    optimised_bytes = 0
+    fixed_bytes = 0
+    for image_id, image_fixed_bytes in context.state.fixed_ladder_bytes.items():
+        srcset = context.state.image_srcsets[image_id]
+        optimised_bytes += sum(context.build_dir.manifest[e.url].size for e in srcset)
+        fixed_bytes += image_fixed_bytes
+    optimised_count = sum(len(context.state.image_srcsets[i]) for i in context.state.fixed_ladder_bytes)
+
+    print(f'Optimised srcset ladders ({len(context.state.fixed_ladder_bytes)} images):')
+    print(f'Optimised: {int(optimised_bytes / 1000)}KB in {optimised_count} files')
+    print(f'Fixed (estimated): {int(fixed_bytes / 1000)}KB')
+    if fixed_bytes:
+        print(f'Difference: {(optimised_bytes - fixed_bytes) / fixed_bytes:+.1%}')
+
+
+def print_perceptual_quality_statistics(context: BuildContext) -> None:
+    if not context.state.perceptual_qualities:
+        return
+
+    qualities_by_width: defaultdict[int, list[int]] = defaultdict(list)
+    for chosen in context.state.perceptual_qualities.values():
+        for width, quality in chosen.items():
+            qualities_by_width[width].append(quality)
+
+    print(f'Perceptual srcset qualities (min/mean/max):')
+    for width in sorted(qualities_by_width.keys()):
+        qualities = qualities_by_width[width]
+        print(f'{width}w: {min(qualities)}/{mean(qualities):.0f}/{max(qualities)}')
+
+
+def print_encoder_profile_statistics(context: BuildContext) -> None:
+    if not context.state.encoder_profiles:
+        return
+
+    urls_by_profile: defaultdict[str, list[URLPath]] = defaultdict(list)
+    for url, profile in context.state.encoder_profiles.items():
+        urls_by_profile[profile].append(url)
+
+    print(f'Image encoder profiles:')
+    for profile in sorted(urls_by_profile.keys()):
+        urls = urls_by_profile[profile]
+        total_bytes = sum(context.build_dir.manifest[u].size for u in urls)
+        line = f'{profile}: {len(urls)} files, {int(total_bytes / 1000)}KB'
+        baseline_bytes = [context.state.encoder_profile_baseline_bytes.get(u) for u in urls]
+        if all(b is not None for b in baseline_bytes):
+            saved_bytes = sum(baseline_bytes) - total_bytes
+            line += f', saved {int(saved_bytes / 1000)}KB ({saved_bytes / sum(baseline_bytes):.1%})'
+        print(line)
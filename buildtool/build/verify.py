@@ -0,0 +1,262 @@
+"""Checks the built site before it's deployed: every URL referenced from a page is in the output, and every srcset
+    image decodes, in the format of its file extension, with the size recorded in its srcset entry.
+Results are cached by output content, so with the cache, only outputs which changed since they were last verified are
+    read again. Links are still checked against the whole output every build, because they may break when other files
+    change."""
+
+import codecs
+from collections.abc import Iterable
+from dataclasses import dataclass
+from html.parser import HTMLParser
+import io
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import time
+from urllib.parse import unquote, urljoin, urlsplit
+
+import pydantic
+
+from buildtool.build.cache import BuildCache
+from buildtool.build.common import BuildContext, OutputRecord
+from buildtool.types import Size, URLPath
+
+
+logger = logging.getLogger(__name__)
+
+
+VERIFY_VERSION = 1
+"""Changing what is checked must invalidate cached results."""
+
+# Attributes whose values are a URL, and whose values are a srcset (a list of URLs).
+URL_ATTRIBUTES = frozenset({'href', 'src', 'data-index-url'})
+SRCSET_ATTRIBUTES = frozenset({'srcset', 'imagesrcset'})
+
+IMAGE_FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.svg': 'SVG'
+}
+
+READ_CHUNK_BYTES = 1 << 16
+
+MAX_LOGGED_PROBLEMS = 50
+
+
+class PageLinks(pydantic.BaseModel, frozen=True):
+    urls: list[URLPath]
+    """Site URLs referenced by the page, resolved against the page URL. Excludes URLs on other hosts."""
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class ImageCheck(pydantic.BaseModel, frozen=True):
+    format: str | None
+    size: Size | None
+    error: str | None
+    """Why the image couldn't be decoded, if it couldn't."""
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+@dataclass(frozen=True)
+class VerifyTask:
+    url: URLPath
+    content: bytes | Path
+    is_page: bool
+
+
+class LinkParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.references: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        for name, value in attrs:
+            if value is None:
+                continue
+            if name in URL_ATTRIBUTES:
+                self.references.append(value)
+            elif name in SRCSET_ATTRIBUTES:
+                # Candidates are a URL then an optional descriptor. URLs can't contain unescaped commas or spaces.
+                self.references += (c.split()[0] for c in value.split(',') if c.strip())
+
+
+def resolve_reference(page_url: URLPath, reference: str) -> URLPath | None:
+    """None if the reference is to another host, or isn't to a file (e.g. mailto:)."""
+
+    parts = urlsplit(urljoin(str(page_url), reference.strip()))
+    if parts.scheme or parts.netloc:
+        return None
+    return URLPath(unquote(parts.path))
+
+
+def open_content(content: bytes | Path) -> io.BufferedIOBase:
+    return io.BytesIO(content) if isinstance(content, bytes) else content.open('rb')
+
+
+def read_page_links(page_url: URLPath, content: bytes | Path) -> PageLinks:
+    """Parses the page incrementally, so large pages are never held in memory whole."""
+
+    parser = LinkParser()
+    decoder = codecs.getincrementaldecoder('utf8')()
+    with open_content(content) as file:
+        while chunk := file.read(READ_CHUNK_BYTES):
+            parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    urls = {resolve_reference(page_url, r) for r in parser.references}
+    return PageLinks(urls=sorted(u for u in urls if u is not None))
+
+
+def check_image(url: URLPath, content: bytes | Path) -> ImageCheck:
+    # Imported here because only the worker processes need them.
+    from buildtool.build.asset.graphic import read_svg_size
+    from buildtool.image import open_image_file
+
+    try:
+        if url.suffix.lower() == '.svg':
+            with open_content(content) as file:
+                return ImageCheck(format='SVG', size=read_svg_size(file.read().decode('utf8')), error=None)
+        with open_content(content) as file, open_image_file(file) as image:
+            # Decodes every pixel, which catches truncated files, unlike only reading the header.
+            image.load()
+            return ImageCheck(format=image.format, size=Size(image.size), error=None)
+    except Exception as e:
+        return ImageCheck(format=None, size=None, error=f'{type(e).__name__}: {e}')
+
+
+def run_verify_task(task: VerifyTask) -> tuple[VerifyTask, PageLinks | ImageCheck, float]:
+    """Runs in a worker process. Returns the result and seconds taken."""
+
+    start_time = time.perf_counter()
+    result = read_page_links(task.url, task.content) if task.is_page else check_image(task.url, task.content)
+    return task, result, time.perf_counter() - start_time
+
+
+def resolve_site_url(url: URLPath, outputs: dict[URLPath, OutputRecord]) -> URLPath | None:
+    """Finds the output a URL is served from, like the host does: directories serve their index.html, and pages can be
+        requested without .html."""
+
+    if str(url).endswith('/'):
+        candidates = [url / 'index.html']
+    else:
+        candidates = [url, url.with_name(f'{url.name}.html'), url / 'index.html']
+    return next((c for c in candidates if c in outputs), None)
+
+
+class SiteVerifier:
+    PAGE_CACHE_NAMESPACE = 'verify-page'
+    IMAGE_CACHE_NAMESPACE = 'verify-image'
+
+    def __init__(self, cache: BuildCache) -> None:
+        self.cache = cache
+        self.problems: list[str] = []
+        self.page_links: dict[URLPath, PageLinks] = {}
+        self.image_checks: dict[URLPath, ImageCheck] = {}
+        self.unreadable: list[URLPath] = []
+        """In the manifest but missing from the output."""
+
+    def get_cache_key(self, url: URLPath, record: OutputRecord) -> str:
+        # Relative links resolve differently at other URLs, but images don't depend on their URL.
+        return f'{url}:{record.sha256}:{VERIFY_VERSION}' if url.suffix == '.html' \
+            else f'{record.sha256}:{VERIFY_VERSION}'
+
+    def load_cached(self, context: BuildContext, page_urls: Iterable[URLPath], image_urls: Iterable[URLPath]) \
+            -> list[VerifyTask]:
+        """Returns tasks for the outputs whose results aren't cached."""
+
+        outputs = context.build_dir.manifest
+        tasks: list[VerifyTask] = []
+        for urls, is_page in ((page_urls, True), (image_urls, False)):
+            for url in urls:
+                key = self.get_cache_key(url, outputs[url])
+                cached: PageLinks | ImageCheck | None
+                if is_page:
+                    cached = self.cache.load(self.PAGE_CACHE_NAMESPACE, key, PageLinks)
+                else:
+                    cached = self.cache.load(self.IMAGE_CACHE_NAMESPACE, key, ImageCheck)
+                if cached is not None:
+                    self.add_result(url, cached)
+                    continue
+                content = context.build_dir.read_back(url)
+                if content is None:
+                    self.unreadable.append(url)
+                else:
+                    tasks.append(VerifyTask(url, content, is_page))
+        return tasks
+
+    def run_tasks(self, context: BuildContext, tasks: list[VerifyTask]) -> None:
+        outputs = context.build_dir.manifest
+        with context.metrics.phase('Verify', len(tasks)) as progress:
+            if not tasks:
+                return
+            # Parsing and decoding are CPU bound pure Python and Pillow work, so use processes rather than threads.
+            # Spawned rather than forked, because the build's other threads (e.g. progress reporting) may hold locks.
+            process_count = min(len(tasks), os.cpu_count() or 1)
+            with multiprocessing.get_context('spawn').Pool(process_count) as pool:
+                for task, result, seconds in pool.imap_unordered(run_verify_task, tasks,
+                        chunksize=max(1, len(tasks) // (process_count * 8))):
+                    progress.record(str(task.url), seconds)
+                    key = self.get_cache_key(task.url, outputs[task.url])
+                    namespace = self.PAGE_CACHE_NAMESPACE if task.is_page else self.IMAGE_CACHE_NAMESPACE
+                    self.cache.save(namespace, key, result)
+                    self.add_result(task.url, result)
+
+    def add_result(self, url: URLPath, result: PageLinks | ImageCheck) -> None:
+        if isinstance(result, PageLinks):
+            self.page_links[url] = result
+        else:
+            self.image_checks[url] = result
+
+    def check_links(self, outputs: dict[URLPath, OutputRecord]) -> None:
+        for page_url, links in sorted(self.page_links.items()):
+            for url in links.urls:
+                if resolve_site_url(url, outputs) is None:
+                    self.problems.append(f'{page_url}: links to {url}, which isn\'t in the output')
+
+    def check_images(self, context: BuildContext) -> None:
+        for image_id, srcset in sorted(context.state.image_srcsets.items()):
+            for entry in srcset.entries:
+                if entry.url not in context.build_dir.manifest:
+                    self.problems.append(f'{entry.url}: srcset entry of {image_id} isn\'t in the output')
+                    continue
+                check = self.image_checks.get(entry.url)
+                if check is None:
+                    # Missing from the output, which is already reported.
+                    continue
+                if check.error is not None:
+                    self.problems.append(f'{entry.url}: can\'t be decoded: {check.error}')
+                elif check.format != IMAGE_FORMATS.get(entry.url.suffix.lower()):
+                    self.problems.append(f'{entry.url}: is {check.format}, which doesn\'t match its extension')
+                elif check.size != entry.size_px:
+                    self.problems.append(f'{entry.url}: is {check.size[0]}x{check.size[1]},'
+                        f' but its srcset entry says {entry.size_px[0]}x{entry.size_px[1]}')
+
+
+def verify_site(context: BuildContext) -> None:
+    """Must be run after the whole site is built. Raises RuntimeError if any problems are found."""
+
+    outputs = context.build_dir.manifest
+    page_urls = sorted(u for u in outputs if u.suffix == '.html')
+    # Images a dry run didn't build can't be checked, but links to them can.
+    image_urls = sorted({e.url for s in context.state.image_srcsets.values() for e in s.entries
+        if e.url in outputs and e.url not in context.build_dir.expected})
+    verifier = SiteVerifier(context.cache)
+    tasks = verifier.load_cached(context, page_urls, image_urls)
+    logger.info(f'Verifying {len(page_urls)} pages and {len(image_urls)} images'
+        f' ({len(page_urls) + len(image_urls) - len(tasks) - len(verifier.unreadable)} unchanged since last verified)')
+    verifier.problems += (f'{u}: in the manifest, but can\'t be read from the output' for u in verifier.unreadable)
+    verifier.run_tasks(context, tasks)
+    verifier.check_links(outputs)
+    verifier.check_images(context)
+
+    if verifier.problems:
+        for problem in verifier.problems[:MAX_LOGGED_PROBLEMS]:
+            logger.error(f'Verification failed: {problem}')
+        if len(verifier.problems) > MAX_LOGGED_PROBLEMS:
+            logger.error(f'... and {len(verifier.problems) - MAX_LOGGED_PROBLEMS} more problems')
+        raise RuntimeError(f'Build verification found {len(verifier.problems)} problems')
+    logger.info('Verification passed')
@@ -0,0 +1,94 @@
+from collections.abc import Collection, Iterator, Mapping
+from dataclasses import dataclass
+from functools import partial
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class FileStat:
+    size: int
+    mtime_ns: int
+
+
+@dataclass(frozen=True)
+class FileSnapshot:
+    """The files found under a directory at some point in time, with enough stat data to detect changes."""
+
+    root: Path
+    files: Mapping[Path, FileStat]
+    """Sorted by path."""
+
+    def __iter__(self) -> Iterator[Path]:
+        return iter(self.files)
+
+    def __contains__(self, path: object) -> bool:
+        return path in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def subtree(self, root: Path) -> 'FileSnapshot':
+        """The files within a subdirectory."""
+
+        return FileSnapshot(root, {path: stat for path, stat in self.files.items() if path.is_relative_to(root)})
+
+
+ScanResult = tuple[dict[Path, FileStat], list[Path]]
+"""(files, subdirectories)"""
+
+
+def scan_directory(dir_path: Path, suffixes: Collection[str]) -> ScanResult:
+    """Lists a single directory (not recursive)."""
+
+    files: dict[Path, FileStat] = {}
+    subdirs: list[Path] = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            # Like os.walk, don't descend into symlinked directories.
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(Path(entry.path))
+            elif entry.is_file() and (not suffixes or os.path.splitext(entry.name)[1] in suffixes):
+                # splitext() gives the same suffix as Path.suffix, without creating a Path for every file.
+                # DirEntry caches the stat result, and only files we keep are stat'ed.
+                stat = entry.stat()
+                files[Path(entry.path)] = FileStat(stat.st_size, stat.st_mtime_ns)
+    return files, subdirs
+
+
+def walk_directory(dir_path: Path, suffixes: Collection[str]) -> dict[Path, FileStat]:
+    files: dict[Path, FileStat] = {}
+    pending = [dir_path]
+    while pending:
+        dir_files, subdirs = scan_directory(pending.pop(), suffixes)
+        files.update(dir_files)
+        pending.extend(subdirs)
+    return files
+
+
+def scan_files(root: Path, suffixes: Collection[str] = (), *, parallel: bool = False) -> FileSnapshot:
+    """Recursively finds all files within a directory, optionally only those with particular (case sensitive)
+        suffixes. If parallel is true, the top level subdirectories are walked concurrently, which helps for large
+        trees on network or cold storage where listing is latency bound."""
+
+    logger.debug(f'Scanning files in "{root}"')
+    if not root.is_dir():
+        # Consistent with os.walk.
+        return FileSnapshot(root, {})
+    suffixes = frozenset(suffixes)
+    files, subdirs = scan_directory(root, suffixes)
+    walk = partial(walk_directory, suffixes=suffixes)
+    if parallel and len(subdirs) > 1:
+        with ThreadPool(min(len(subdirs), os.cpu_count() or 1)) as pool:
+            for subtree_files in pool.imap_unordered(walk, subdirs):
+                files.update(subtree_files)
+    else:
+        for subdir in subdirs:
+            files.update(walk(subdir))
+    logger.debug(f'Found {len(files)} files in "{root}"')
+    return FileSnapshot(root, dict(sorted(files.items())))
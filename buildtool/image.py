@@ -1,20 +1,28 @@
+from dataclasses import dataclass
 import datetime as dt
+from functools import cache
 import logging
 from pathlib import Path
 import subprocess
-from typing import Annotated
+import tempfile
+from typing import TYPE_CHECKING, Annotated, BinaryIO
 
-from PIL import ExifTags
-from PIL.Image import Image, open as pil_image_open
 import pydantic
 
-from buildtool.types import Aperture, ExposureTime, FocalLength, ISO, CoerceNumber
+from buildtool.types import Aperture, ExposureTime, FocalLength, ISO, CoerceNumber, Size
 from buildtool.utility import parse_datetime
 
+if TYPE_CHECKING:
+    from PIL.Image import Image
+
+# PIL is imported where it's used, because it's slow to import (it also imports NumPy) and ingesting doesn't use it.
+
 logger = logging.getLogger(__name__)
 
 
-def open_image_file(path: Path) -> Image:
+def open_image_file(path: Path | BinaryIO) -> 'Image':
+    from PIL.Image import open as pil_image_open
+
     return pil_image_open(path)
 
 
@@ -38,7 +46,9 @@ class EXIFMetadata(pydantic.BaseModel, frozen=True):
     iso: CoerceNumber[ISO] | None
 
 
-def read_image_exif_metadata(image: Image) -> EXIFMetadata:
+def read_image_exif_metadata(image: 'Image') -> EXIFMetadata:
+    from PIL import ExifTags
+
     exif = image.getexif()
     ifd_exif = exif.get_ifd(ExifTags.IFD.Exif)
 
@@ -60,13 +70,136 @@ def read_image_exif_metadata(image: Image) -> EXIFMetadata:
     return metadata
 
 
-def reencode_image(input_file: Path, output_file: Path, max_width: int | None, max_height: int | None, quality: int,
-        fast: bool = False) -> None:
+@dataclass(frozen=True)
+class ImageProbe:
+    """What is read from an image file's header, without decoding the pixels."""
+
+    size: Size
+    exif: EXIFMetadata
+
+
+def probe_image_file(path: Path) -> ImageProbe:
+    # PIL only reads the header on open, and the pixels aren't needed. Closing straight away releases the file handle
+    # and decoder state, rather than leaving them for the garbage collector.
+    with open_image_file(path) as image:
+        return ImageProbe(Size((image.width, image.height)), read_image_exif_metadata(image))
+
+
+def read_image_size(path: Path) -> Size:
+    with open_image_file(path) as image:
+        return Size((image.width, image.height))
+
+
+@dataclass(frozen=True)
+class JPEGEncoderProfile:
+    """Encoder settings which don't affect image dimensions or quality level."""
+
+    name: str
+    strip_metadata: bool
+    """If True, the pixels are converted to sRGB and rotated upright, then all metadata (EXIF, XMP, ICC) is removed.
+        Otherwise metadata is passed through as is."""
+    progressive: bool
+    chroma_subsampling: str | None
+    """E.g. 4:2:0. If None, the encoder picks based on quality."""
+    optimise_coding: bool
+    """Compute optimal Huffman tables instead of using the standard ones."""
+
+
+FULL_METADATA_ENCODER_PROFILE = JPEGEncoderProfile('full-metadata', False, True, None, True)
+"""For images which may be downloaded and inspected."""
+
+STRIPPED_ENCODER_PROFILE = JPEGEncoderProfile('stripped', True, True, None, True)
+"""For display only images, where metadata is a significant share of the file size."""
+
+STRIPPED_SUBSAMPLED_ENCODER_PROFILE = JPEGEncoderProfile('stripped-subsampled', True, True, '4:2:0', True)
+"""For small images, where colour detail is barely visible anyway."""
+
+
+@cache
+def get_srgb_icc_profile_path() -> Path:
+    path = Path(tempfile.gettempdir()) / 'buildtool-sRGB.icc'
+    if not path.is_file():
+        logger.debug(f'Writing sRGB ICC profile: "{path}"')
+        # Write then rename in case another process is doing the same.
+        tmp_path = path.with_name(f'{path.name}.{id(path)}.tmp')
+        from PIL import ImageCms
+
+        tmp_path.write_bytes(ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes())
+        tmp_path.replace(path)
+    return path
+
+
+def get_encoder_profile_args(profile: JPEGEncoderProfile, raw_input: bool = False) -> list[str]:
+    args: list[str] = []
+    if profile.strip_metadata:
+        if raw_input:
+            # Already upright and sRGB (see RawImageFile).
+            args += ['-strip']
+        else:
+            # Once stripped, the browser can't apply the orientation and colour profile, so bake them into the pixels.
+            args += ['-auto-orient', '-profile', str(get_srgb_icc_profile_path()), '-strip']
+    args += ['-interlace', 'Plane' if profile.progressive else 'None']
+    if profile.chroma_subsampling:
+        args += ['-sampling-factor', profile.chroma_subsampling]
+    args += ['-define', f'jpeg:optimize-coding={str(profile.optimise_coding).lower()}']
+    return args
+
+
+@dataclass(frozen=True)
+class ResizeOperator:
+    """An ImageMagick resizing method."""
+
+    name: str
+    args: tuple[str, ...]
+    """Arguments before the geometry, ending with the operator, e.g. ('-filter', 'Triangle', '-resize')."""
+    post_args: tuple[str, ...] = ()
+    """Arguments after the geometry, e.g. to blur the result."""
+
+    def get_args(self, geometry: str) -> list[str]:
+        return [*self.args, geometry, *self.post_args]
+
+
+SCALE_RESIZE_OPERATOR = ResizeOperator('scale', ('-scale',))
+"""Box filter averaging, fast."""
+
+DEFAULT_RESIZE_OPERATOR = ResizeOperator('resize', ('-resize',))
+"""ImageMagick's default filter for the scale factor (Lanczos for downscaling), high quality."""
+
+
+def get_resize_operator(fast: bool) -> ResizeOperator:
+    return SCALE_RESIZE_OPERATOR if fast else DEFAULT_RESIZE_OPERATOR
+
+
+@dataclass(frozen=True)
+class RawImageFile:
+    """Uncompressed pixels: linear light RGB, 16 bits per channel, little endian, rows top to bottom.
+        The pixels are upright and in sRGB primaries, and there is no metadata."""
+
+    path: Path
+    size: Size
+
+    def get_magick_input_args(self) -> list[str]:
+        width, height = self.size
+        # Tagging the pixels as linear makes ImageMagick resize in linear light.
+        return ['-size', f'{width}x{height}', '-depth', '16', '-endian', 'LSB', f'rgb:{self.path}',
+            '-set', 'colorspace', 'RGB']
+
+
+def reencode_image(input_file: Path | RawImageFile, output_file: Path, max_width: int | None, max_height: int | None,
+        quality: int, fast: bool = False, profile: JPEGEncoderProfile | None = None,
+        resize: ResizeOperator | None = None) -> None:
+    """If profile is None, ImageMagick's defaults are used and metadata is passed through.
+        If resize is None, the operator is chosen by fast (see get_resize_operator())."""
+
     if output_file.suffix != '.jpg':
         # We only deal with JPGs, so probably wrong to try to output anything else.
         raise ValueError('Only JPG output is supported')
+    raw_input = isinstance(input_file, RawImageFile)
+    if raw_input and profile is not None and not profile.strip_metadata:
+        raise ValueError('Raw images have no metadata to pass through')
     # We could do this with a Python library, but I only trust ImageMagick to pass through the metadata correctly.
-    operation = '-scale' if fast else '-resize'
+    if resize is None:
+        resize = get_resize_operator(fast)
     if max_width and max_height:
         size_str = f'{max_width}x{max_height}'
     elif max_width:
@@ -75,10 +208,15 @@ def reencode_image(input_file: Path, output_file: Path, max_width: int | None, m
         size_str = f'x{max_height}'
     else:
         raise ValueError('Either max_width or max_height must be specified')
+    profile_args = get_encoder_profile_args(profile, raw_input) if profile else []
     args = [
-        'magick', str(input_file),
-        operation, size_str,
+        'magick',
+        *(input_file.get_magick_input_args() if isinstance(input_file, RawImageFile) else [str(input_file)]),
+        *resize.get_args(size_str),
+        # Back to the usual gamma encoding for output.
+        *(['-colorspace', 'sRGB'] if raw_input else []),
         '-quality', str(quality),
+        *profile_args,
         str(output_file)
     ]
     logger.debug(f'> {args}')
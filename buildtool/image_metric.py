@@ -0,0 +1,48 @@
+import numpy as np
+import numpy.typing as npt
+from PIL.Image import Image
+
+
+FloatArray = npt.NDArray[np.float64]
+
+
+# Standard SSIM constants for 8-bit data.
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+SSIM_WINDOW_SIZE = 8
+
+
+def image_to_luma(image: Image) -> FloatArray:
+    """Converts an image to a 2D array of luma values in the range [0, 255]."""
+
+    return np.asarray(image.convert('L'), dtype=np.float64)
+
+
+def box_filter(a: FloatArray, size: int) -> FloatArray:
+    """Mean over every size x size window (valid region only), using a summed area table."""
+
+    sat = np.pad(a, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    window_sum = sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] + sat[:-size, :-size]
+    return window_sum / (size * size)
+
+
+def compute_ssim(reference: FloatArray, distorted: FloatArray) -> float:
+    """Mean structural similarity of two luma arrays. 1 means identical."""
+
+    if reference.shape != distorted.shape:
+        raise ValueError(f'Image shapes differ: {reference.shape} vs {distorted.shape}')
+    size = min(SSIM_WINDOW_SIZE, *reference.shape)
+    mu_x = box_filter(reference, size)
+    mu_y = box_filter(distorted, size)
+    var_x = box_filter(reference * reference, size) - mu_x * mu_x
+    var_y = box_filter(distorted * distorted, size) - mu_y * mu_y
+    cov = box_filter(reference * distorted, size) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2)) \
+        / ((mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (var_x + var_y + SSIM_C2))
+    return float(ssim_map.mean())
+
+
+def compute_dssim(reference: FloatArray, distorted: FloatArray) -> float:
+    """Structural dissimilarity. 0 means identical, larger is worse."""
+
+    return (1 - compute_ssim(reference, distorted)) / 2
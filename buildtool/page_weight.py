@@ -0,0 +1,487 @@
+"""Estimates what a visitor downloads for each page of a built site, for a matrix of viewport sizes and device pixel
+    ratios. Emulates how browsers choose from srcset candidates using the sizes attribute, and compresses HTML, CSS and
+    JS like the host would. Exits with an error if any page is over budget.
+
+"Above the fold" is the HTML, stylesheets, scripts and eagerly loaded images (including preloaded images). "Full scroll"
+    also includes lazily loaded images. Layout isn't computed, so lazily loaded images which happen to be in the first
+    viewport are only counted in the full scroll. Resources on other hosts aren't counted.
+
+Usage: python -m buildtool.page_weight [-o BUILD_PATH] [--json REPORT_PATH]"""
+
+import argparse
+from collections import defaultdict
+from collections.abc import Iterable, Mapping, Sequence
+from dataclasses import dataclass
+import gzip
+from html.parser import HTMLParser
+import json
+from pathlib import Path
+import re
+from statistics import median
+import sys
+from urllib.parse import urljoin, urlsplit
+
+import pydantic
+
+from buildtool.types import URLPath
+from buildtool.url import MANIFEST_URL
+
+
+@dataclass(frozen=True)
+class Viewport:
+    width: int
+    height: int
+    dpr: float
+
+    @property
+    def label(self) -> str:
+        return f'{self.width}x{self.height}@{self.dpr:g}x'
+
+    @classmethod
+    def parse(cls, value: str, dpr: float = 1) -> 'Viewport':
+        """Parses "WxH"."""
+
+        width, _, height = value.partition('x')
+        return cls(int(width), int(height), dpr)
+
+
+# Common phone, tablet, laptop and desktop sizes, in CSS pixels.
+DEFAULT_VIEWPORTS = ('360x780', '768x1024', '1366x768', '1920x1080')
+DEFAULT_DPRS = (1.0, 2.0, 3.0)
+
+# What CSS uses for em and rem if the user hasn't changed their font size.
+DEFAULT_FONT_SIZE_PX = 16
+
+
+class LengthParser:
+    """Evaluates a CSS length as used in the sizes attribute, e.g. "50vw" or "calc(95vh * 6240 / 3831)", in CSS pixels."""
+
+    TOKEN_REGEX = re.compile(r'\s*(?:(?P<number>\d+(?:\.\d+)?|\.\d+)(?P<unit>[a-z]+)?|(?P<op>calc\(|[-+*/()]))', re.I)
+
+    def __init__(self, expression: str, viewport: Viewport) -> None:
+        self.expression = expression
+        self.viewport = viewport
+        self.tokens = self.tokenise(expression)
+        self.position = 0
+
+    def tokenise(self, expression: str) -> list[tuple[str, float | None]]:
+        tokens: list[tuple[str, float | None]] = []
+        index = 0
+        expression = expression.strip()
+        while index < len(expression):
+            m = self.TOKEN_REGEX.match(expression, index)
+            if m is None or m.end() == index:
+                raise ValueError(f'Unsupported CSS length: "{self.expression}"')
+            index = m.end()
+            if m['number'] is not None:
+                tokens.append(('value', float(m['number']) * self.get_unit_px(m['unit'])))
+            else:
+                # calc() only groups, the same as parentheses.
+                tokens.append(('(' if m['op'].lower() == 'calc(' else m['op'], None))
+        return tokens
+
+    def get_unit_px(self, unit: str | None) -> float:
+        match (unit or '').lower():
+            case 'px' | '':
+                return 1
+            case 'vw':
+                return self.viewport.width / 100
+            case 'vh':
+                return self.viewport.height / 100
+            case 'em' | 'rem':
+                return DEFAULT_FONT_SIZE_PX
+            case _:
+                raise ValueError(f'Unsupported CSS unit in "{self.expression}": {unit}')
+
+    def peek(self) -> str | None:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self) -> tuple[str, float | None]:
+        if self.position >= len(self.tokens):
+            raise ValueError(f'Unexpected end of CSS length: "{self.expression}"')
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self) -> float:
+        value = self.parse_sum()
+        if self.peek() is not None:
+            raise ValueError(f'Unexpected token in CSS length: "{self.expression}"')
+        return value
+
+    def parse_sum(self) -> float:
+        value = self.parse_product()
+        while self.peek() in ('+', '-'):
+            op, _ = self.take()
+            operand = self.parse_product()
+            value = value + operand if op == '+' else value - operand
+        return value
+
+    def parse_product(self) -> float:
+        value = self.parse_operand()
+        while self.peek() in ('*', '/'):
+            op, _ = self.take()
+            operand = self.parse_operand()
+            value = value * operand if op == '*' else value / operand
+        return value
+
+    def parse_operand(self) -> float:
+        kind, value = self.take()
+        if kind == 'value':
+            assert value is not None
+            return value
+        if kind == '-':
+            return -self.parse_operand()
+        if kind == '(':
+            result = self.parse_sum()
+            if self.take()[0] != ')':
+                raise ValueError(f'Unbalanced parentheses in CSS length: "{self.expression}"')
+            return result
+        raise ValueError(f'Unexpected token in CSS length: "{self.expression}"')
+
+
+def evaluate_length(expression: str, viewport: Viewport) -> float:
+    return LengthParser(expression, viewport).parse()
+
+
+MEDIA_FEATURE_REGEX = re.compile(r'\(\s*(?P<name>[a-z-]+)\s*:\s*(?P<value>[^)]+?)\s*\)', re.I)
+
+
+def evaluate_media_condition(condition: str, viewport: Viewport) -> bool:
+    """Only supports features joined by "and", which is all the sizes attributes in the site use."""
+
+    for part in re.split(r'\s+and\s+', condition.strip(), flags=re.I):
+        m = MEDIA_FEATURE_REGEX.fullmatch(part.strip())
+        if m is None:
+            raise ValueError(f'Unsupported media condition: "{condition}"')
+        name = m['name'].lower()
+        value = m['value']
+        match name:
+            case 'max-width':
+                matches = viewport.width <= evaluate_length(value, viewport)
+            case 'min-width':
+                matches = viewport.width >= evaluate_length(value, viewport)
+            case 'max-height':
+                matches = viewport.height <= evaluate_length(value, viewport)
+            case 'min-height':
+                matches = viewport.height >= evaluate_length(value, viewport)
+            case '-webkit-min-device-pixel-ratio' | 'min-resolution':
+                matches = viewport.dpr >= float(value.lower().removesuffix('dppx').removesuffix('x'))
+            case '-webkit-max-device-pixel-ratio' | 'max-resolution':
+                matches = viewport.dpr <= float(value.lower().removesuffix('dppx').removesuffix('x'))
+            case 'orientation':
+                matches = (viewport.width > viewport.height) == (value.lower() == 'landscape')
+            case _:
+                raise ValueError(f'Unsupported media feature: "{condition}"')
+        if not matches:
+            return False
+    return True
+
+
+def split_top_level(s: str, separator: str) -> list[str]:
+    """Splits on the separator where it isn't inside parentheses."""
+
+    parts: list[str] = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(s):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(s[start:index])
+            start = index + 1
+    parts.append(s[start:])
+    return parts
+
+
+def split_sizes_entry(entry: str) -> tuple[str | None, str]:
+    """Splits an entry of a sizes attribute into its media condition (if any) and its length."""
+
+    index = 0
+    condition_end = 0
+    while True:
+        while index < len(entry) and entry[index].isspace():
+            index += 1
+        if entry.startswith('(', index):
+            depth = 0
+            for end in range(index, len(entry)):
+                depth += {'(': 1, ')': -1}.get(entry[end], 0)
+                if depth == 0:
+                    break
+            index = condition_end = end + 1
+        elif entry[index:index + 4].lower() == 'and ':
+            index += 4
+        else:
+            break
+    condition = entry[:condition_end].strip()
+    return condition or None, entry[condition_end:].strip()
+
+
+def evaluate_sizes(sizes: str | None, viewport: Viewport) -> float:
+    """The width in CSS pixels which the browser assumes the image is displayed at."""
+
+    if not sizes or not sizes.strip():
+        return viewport.width
+    for entry in split_top_level(sizes, ','):
+        condition, length = split_sizes_entry(entry)
+        if condition is None or evaluate_media_condition(condition, viewport):
+            return evaluate_length(length, viewport)
+    # Same as the browser default.
+    return viewport.width
+
+
+@dataclass(frozen=True)
+class SrcSetCandidate:
+    url: str
+    width: int | None
+    """From a w descriptor."""
+    density: float | None
+    """From an x descriptor."""
+
+
+def parse_srcset(srcset: str) -> list[SrcSetCandidate]:
+    candidates: list[SrcSetCandidate] = []
+    for entry in srcset.split(','):
+        url, _, descriptor = entry.strip().partition(' ')
+        if not url:
+            continue
+        descriptor = descriptor.strip().lower()
+        if descriptor.endswith('w'):
+            candidates.append(SrcSetCandidate(url, int(descriptor[:-1]), None))
+        elif descriptor.endswith('x'):
+            candidates.append(SrcSetCandidate(url, None, float(descriptor[:-1])))
+        else:
+            candidates.append(SrcSetCandidate(url, None, 1.0))
+    return candidates
+
+
+@dataclass(frozen=True)
+class ImageRequest:
+    src: str | None
+    srcset: tuple[SrcSetCandidate, ...]
+    sizes: str | None
+    lazy: bool
+
+    def choose_url(self, viewport: Viewport) -> str | None:
+        """Like browsers: the lowest density candidate which is at least the device pixel ratio, or the highest if none
+            are. Browsers may also consider cached images and network conditions, which isn't emulated."""
+
+        if not self.srcset:
+            return self.src
+        source_width = evaluate_sizes(self.sizes, viewport)
+        densities = [
+            (c.width / source_width if c.width is not None else c.density or 1.0, c.url)
+            for c in self.srcset]
+        sufficient = [d for d in densities if d[0] >= viewport.dpr]
+        return min(sufficient)[1] if sufficient else max(densities)[1]
+
+
+@dataclass(frozen=True)
+class PageResources:
+    stylesheets: tuple[str, ...]
+    scripts: tuple[str, ...]
+    images: tuple[ImageRequest, ...]
+
+
+class PageResourceParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.stylesheets: list[str] = []
+        self.scripts: list[str] = []
+        self.images: list[ImageRequest] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        attributes = {name: value or '' for name, value in attrs}
+        if tag == 'link':
+            rel = attributes.get('rel', '').lower().split()
+            as_ = attributes.get('as', '').lower()
+            href = attributes.get('href')
+            if 'stylesheet' in rel and href:
+                self.stylesheets.append(href)
+            elif 'preload' in rel and as_ == 'style' and href:
+                # Deferred stylesheets are still downloaded straight away.
+                self.stylesheets.append(href)
+            elif 'preload' in rel and as_ == 'image':
+                self.images.append(ImageRequest(href, tuple(parse_srcset(attributes.get('imagesrcset', ''))),
+                    attributes.get('imagesizes'), lazy=False))
+        elif tag == 'script' and attributes.get('src'):
+            self.scripts.append(attributes['src'])
+        elif tag == 'img':
+            self.images.append(ImageRequest(attributes.get('src'), tuple(parse_srcset(attributes.get('srcset', ''))),
+                attributes.get('sizes'), lazy=attributes.get('loading', '').lower() == 'lazy'))
+
+
+def parse_page_resources(html: str) -> PageResources:
+    parser = PageResourceParser()
+    parser.feed(html)
+    parser.close()
+    return PageResources(tuple(parser.stylesheets), tuple(parser.scripts), tuple(parser.images))
+
+
+class PageWeight(pydantic.BaseModel, frozen=True):
+    """Transfer bytes of one page at one viewport."""
+
+    url: str
+    viewport: str
+    html_bytes: int
+    css_bytes: int
+    js_bytes: int
+    above_fold_image_bytes: int
+    full_image_bytes: int
+    above_fold_bytes: int
+    full_bytes: int
+    over_budget: bool
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class PageWeightReport(pydantic.BaseModel, frozen=True):
+    viewports: tuple[str, ...]
+    above_fold_budget_bytes: int | None
+    full_budget_bytes: int | None
+    pages: tuple[PageWeight, ...]
+
+    model_config = pydantic.ConfigDict(extra='forbid')
+
+
+class SiteFiles:
+    """Files of a built site, with transfer sizes."""
+
+    COMPRESSED_SUFFIXES = ('.html', '.css', '.js', '.json', '.svg', '.txt')
+
+    def __init__(self, build_path: Path) -> None:
+        self.build_path = build_path
+        manifest = json.loads((build_path / MANIFEST_URL.fs_path).read_text(encoding='utf8'))
+        self.sizes: dict[str, int] = {url: record['size'] for url, record in manifest.items()}
+        self._compressed_sizes: dict[str, int] = {}
+
+    def read_text(self, url: str) -> str:
+        return (self.build_path / URLPath(url).fs_path).read_text(encoding='utf8')
+
+    def get_transfer_size(self, url: str) -> int:
+        """Text is compressed by the host. gzip is assumed, which is the most conservative of the common encodings."""
+
+        if not url.endswith(self.COMPRESSED_SUFFIXES):
+            return self.sizes[url]
+        if url not in self._compressed_sizes:
+            data = (self.build_path / URLPath(url).fs_path).read_bytes()
+            self._compressed_sizes[url] = len(gzip.compress(data, compresslevel=6))
+        return self._compressed_sizes[url]
+
+    def resolve(self, page_url: str, reference: str | None) -> str | None:
+        """The site URL of a reference from a page, or None if it's on another host or isn't in the site."""
+
+        if not reference:
+            return None
+        parts = urlsplit(urljoin(page_url, reference))
+        if parts.scheme or parts.netloc:
+            return None
+        return parts.path if parts.path in self.sizes else None
+
+
+def measure_page(files: SiteFiles, url: str, resources: PageResources, viewports: Iterable[Viewport],
+        above_fold_budget: int | None, full_budget: int | None) -> list[PageWeight]:
+    html_bytes = files.get_transfer_size(url)
+    stylesheet_urls = {u for u in (files.resolve(url, s) for s in resources.stylesheets) if u is not None}
+    script_urls = {u for u in (files.resolve(url, s) for s in resources.scripts) if u is not None}
+    css_bytes = sum(files.get_transfer_size(u) for u in stylesheet_urls)
+    js_bytes = sum(files.get_transfer_size(u) for u in script_urls)
+
+    weights: list[PageWeight] = []
+    for viewport in viewports:
+        # Each URL is only downloaded once, e.g. the preloaded image and the img element pick the same candidate.
+        eager_urls: set[str] = set()
+        lazy_urls: set[str] = set()
+        for image in resources.images:
+            image_url = files.resolve(url, image.choose_url(viewport))
+            if image_url is not None:
+                (lazy_urls if image.lazy else eager_urls).add(image_url)
+        above_fold_image_bytes = sum(files.get_transfer_size(u) for u in eager_urls)
+        full_image_bytes = sum(files.get_transfer_size(u) for u in eager_urls | lazy_urls)
+        above_fold_bytes = html_bytes + css_bytes + js_bytes + above_fold_image_bytes
+        full_bytes = html_bytes + css_bytes + js_bytes + full_image_bytes
+        weights.append(PageWeight(
+            url=url, viewport=viewport.label,
+            html_bytes=html_bytes, css_bytes=css_bytes, js_bytes=js_bytes,
+            above_fold_image_bytes=above_fold_image_bytes, full_image_bytes=full_image_bytes,
+            above_fold_bytes=above_fold_bytes, full_bytes=full_bytes,
+            over_budget=(above_fold_budget is not None and above_fold_bytes > above_fold_budget)
+                or (full_budget is not None and full_bytes > full_budget)))
+    return weights
+
+
+def measure_site(build_path: Path, viewports: Sequence[Viewport], above_fold_budget: int | None,
+        full_budget: int | None) -> PageWeightReport:
+    files = SiteFiles(build_path)
+    pages: list[PageWeight] = []
+    for url in sorted(u for u in files.sizes if u.endswith('.html')):
+        resources = parse_page_resources(files.read_text(url))
+        pages.extend(measure_page(files, url, resources, viewports, above_fold_budget, full_budget))
+    return PageWeightReport(
+        viewports=tuple(v.label for v in viewports),
+        above_fold_budget_bytes=above_fold_budget, full_budget_bytes=full_budget,
+        pages=tuple(pages))
+
+
+def get_page_group(url: str) -> str:
+    # Pages in a directory (e.g. photo pages) come from the same template, so summarise them together.
+    parent = url.rsplit('/', 1)[0]
+    return f'{parent}/*' if parent else url
+
+
+def print_report(report: PageWeightReport, top: int) -> None:
+    groups: Mapping[tuple[str, str], list[PageWeight]] = defaultdict(list)
+    for page in report.pages:
+        groups[(get_page_group(page.url), page.viewport)].append(page)
+
+    header = ('Pages', 'Viewport', 'Count', 'Above fold KB (median/max)', 'Full scroll KB (median/max)', 'Over')
+    rows = [header]
+    for (group, viewport), pages in sorted(groups.items(), key=lambda g: (g[0][0], report.viewports.index(g[0][1]))):
+        above_fold = [p.above_fold_bytes / 1000 for p in pages]
+        full = [p.full_bytes / 1000 for p in pages]
+        over_count = sum(p.over_budget for p in pages)
+        rows.append((group, viewport, str(len(pages)),
+            f'{median(above_fold):.0f}/{max(above_fold):.0f}', f'{median(full):.0f}/{max(full):.0f}',
+            f'{over_count} !' if over_count else '0'))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+    over_budget = sorted((p for p in report.pages if p.over_budget), key=lambda p: p.full_bytes, reverse=True)
+    if over_budget:
+        print(f'{len(over_budget)} pages and viewports over budget:')
+        for page in over_budget[:top]:
+            print(f'{page.url} at {page.viewport}: above fold {page.above_fold_bytes / 1000:.0f}KB,'
+                f' full scroll {page.full_bytes / 1000:.0f}KB')
+        if len(over_budget) > top:
+            print(f'... and {len(over_budget) - top} more')
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-o', '--output-path', type=Path, default=Path('./site'), help='Built site directory')
+    arg_parser.add_argument('--viewport', action='append', default=None, metavar='WxH',
+        help=f'Viewport size in CSS pixels, may be repeated (default: {", ".join(DEFAULT_VIEWPORTS)})')
+    arg_parser.add_argument('--dpr', type=float, nargs='+', default=list(DEFAULT_DPRS), help='Device pixel ratios')
+    arg_parser.add_argument('--budget-kb', type=float, default=1000, help='Above the fold budget per page')
+    arg_parser.add_argument('--full-budget-kb', type=float, default=None, help='Full scroll budget per page')
+    arg_parser.add_argument('--json', type=Path, default=None, help='Also write the full report to this file')
+    arg_parser.add_argument('--top', type=int, default=20, help='Number of pages over budget to list')
+    args = arg_parser.parse_args()
+
+    viewports = [Viewport.parse(v, dpr) for v in args.viewport or DEFAULT_VIEWPORTS for dpr in args.dpr]
+    report = measure_site(args.output_path, viewports,
+        round(args.budget_kb * 1000) if args.budget_kb is not None else None,
+        round(args.full_budget_kb * 1000) if args.full_budget_kb is not None else None)
+    print_report(report, args.top)
+    if args.json is not None:
+        args.json.write_text(report.model_dump_json(indent=1), encoding='utf8')
+
+    if any(p.over_budget for p in report.pages):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
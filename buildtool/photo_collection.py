@@ -1,27 +1,128 @@
-from collections.abc import Iterator, Sequence
-from dataclasses import dataclass
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import TypeVar
 
 from buildtool.photo_info import PhotoInfo
-from buildtool.types import PartialDate, PhotoGenre
+from buildtool.types import PartialDate, PhotoGenre, PhotoID
+
+
+K = TypeVar('K')
+
+Postings = tuple[int, ...]
+"""Indices into PhotoCollection.photos, in chronological order (oldest first)."""
 
 
 @dataclass(frozen=True)
 class PhotoCollection:
+    """All photos, with indices computed once up front so that lookups and views are cheap to use repeatedly."""
+
     photos: Sequence[PhotoInfo]
 
+    _index_by_id: Mapping[PhotoID, int] = field(init=False, repr=False, compare=False)
+    _chronological: Postings = field(init=False, repr=False, compare=False)
+    # Position of each photo (by index into photos) within _chronological.
+    _chronological_position: tuple[int, ...] = field(init=False, repr=False, compare=False)
+    _genre_postings: Mapping[PhotoGenre, Postings] = field(init=False, repr=False, compare=False)
+    _year_postings: Mapping[int, Postings] = field(init=False, repr=False, compare=False)
+    _year_month_postings: Mapping[tuple[int, int], Postings] = field(init=False, repr=False, compare=False)
+    _dates: tuple[PartialDate, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        photos = tuple(self.photos)
+        index_by_id = {p.id: i for i, p in enumerate(photos)}
+        if len(index_by_id) != len(photos):
+            raise ValueError('Duplicate photo IDs')
+        chronological = tuple(sorted(range(len(photos)), key=lambda i: photos[i].chronological_sort_key))
+        chronological_position = [0] * len(photos)
+        for position, idx in enumerate(chronological):
+            chronological_position[idx] = position
+
+        genre_postings: defaultdict[PhotoGenre, list[int]] = defaultdict(list)
+        year_postings: defaultdict[int, list[int]] = defaultdict(list)
+        year_month_postings: defaultdict[tuple[int, int], list[int]] = defaultdict(list)
+        # Iterating in chronological order keeps the postings in chronological order.
+        for idx in chronological:
+            photo = photos[idx]
+            for genre in photo.genre:
+                genre_postings[genre].append(idx)
+            if photo.date.year is not None:
+                year_postings[photo.date.year].append(idx)
+                if photo.date.month is not None:
+                    year_month_postings[(photo.date.year, photo.date.month)].append(idx)
+
+        # Frozen dataclass, so have to bypass the immutability.
+        object.__setattr__(self, 'photos', photos)
+        object.__setattr__(self, '_index_by_id', MappingProxyType(index_by_id))
+        object.__setattr__(self, '_chronological', chronological)
+        object.__setattr__(self, '_chronological_position', tuple(chronological_position))
+        object.__setattr__(self, '_genre_postings', freeze_postings(genre_postings))
+        object.__setattr__(self, '_year_postings', freeze_postings(year_postings))
+        object.__setattr__(self, '_year_month_postings', freeze_postings(year_month_postings))
+        object.__setattr__(self, '_dates', tuple(sorted({p.date for p in photos})))
+
     @property
-    def dates(self) -> list[PartialDate]:
-        return sorted({p.date for p in self.photos})
+    def dates(self) -> tuple[PartialDate, ...]:
+        return self._dates
 
     @property
     def genres(self) -> list[PhotoGenre]:
-        return sorted({g for p in self.photos for g in p.genre})
+        return sorted(self._genre_postings.keys())
+
+    @property
+    def years(self) -> list[int]:
+        return sorted(self._year_postings.keys())
+
+    @property
+    def year_months(self) -> list[tuple[int, int]]:
+        return sorted(self._year_month_postings.keys())
+
+    def get(self, photo_id: PhotoID) -> PhotoInfo:
+        return self.photos[self._index_by_id[photo_id]]
 
     def get_genre(self, genre: PhotoGenre) -> list[PhotoInfo]:
-        return [p for p in self.photos if genre in p.genre]
+        """In chronological order."""
+
+        return self._resolve(self._genre_postings.get(genre, ()))
+
+    def get_year(self, year: int) -> list[PhotoInfo]:
+        """In chronological order."""
+
+        return self._resolve(self._year_postings.get(year, ()))
+
+    def get_year_month(self, year: int, month: int) -> list[PhotoInfo]:
+        """In chronological order."""
+
+        return self._resolve(self._year_month_postings.get((year, month), ()))
+
+    def oldest_first(self) -> Iterator[PhotoInfo]:
+        return (self.photos[i] for i in self._chronological)
+
+    def newest_first(self) -> Iterator[PhotoInfo]:
+        return (self.photos[i] for i in reversed(self._chronological))
+
+    def get_previous(self, photo_id: PhotoID) -> PhotoInfo | None:
+        """The next oldest photo."""
+
+        position = self._chronological_position[self._index_by_id[photo_id]]
+        return self.photos[self._chronological[position - 1]] if position > 0 else None
+
+    def get_next(self, photo_id: PhotoID) -> PhotoInfo | None:
+        """The next newest photo."""
+
+        position = self._chronological_position[self._index_by_id[photo_id]]
+        return self.photos[self._chronological[position + 1]] if position + 1 < len(self._chronological) else None
+
+    def _resolve(self, postings: Iterable[int]) -> list[PhotoInfo]:
+        return [self.photos[i] for i in postings]
 
     def __iter__(self) -> Iterator[PhotoInfo]:
         return iter(self.photos)
-    
+
     def __len__(self) -> int:
         return len(self.photos)
+
+
+def freeze_postings(postings: Mapping[K, list[int]]) -> Mapping[K, Postings]:
+    return MappingProxyType({k: tuple(v) for k, v in postings.items()})
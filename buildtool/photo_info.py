@@ -1,9 +1,12 @@
+from collections.abc import Sequence
 from dataclasses import dataclass
 import datetime as dt
+from multiprocessing.pool import ThreadPool
+import os
 from pathlib import Path
 import logging
 
-from buildtool.image import open_image_file, read_image_exif_metadata
+from buildtool.image import probe_image_file
 from buildtool.resource.photo import PhotoResourceRecord, PhotoMetadataFile
 from buildtool.types import ISO, Aperture, ExposureTime, FocalLength, PartialDate, PhotoGenre, PhotoID, Size
 from buildtool.utility import remove_dashes
@@ -68,12 +71,12 @@ def resolve_photo_date(image_date: dt.date | None, user_date: PartialDate | None
 def read_photo_info(resource: PhotoResourceRecord) -> PhotoInfo:
     """Creates final information about a photo by combining the image file metadata and user specified metadata."""
 
-    logger.info(f'Reading photo info: {resource}')
+    logger.debug(f'Reading photo info: {resource}')
 
     user_metadata = PhotoMetadataFile.from_file(resource.metadata_file_path)
 
-    image = open_image_file(resource.image_file_path)
-    image_metadata = read_image_exif_metadata(image)
+    image_probe = probe_image_file(resource.image_file_path)
+    image_metadata = image_probe.exif
 
     # Normalise to lowercase so file names and URLs are consistent.
     file_extension = resource.image_file_path.suffix.lower()
@@ -88,7 +91,7 @@ def read_photo_info(resource: PhotoResourceRecord) -> PhotoInfo:
     aperture = user_metadata.aperture or image_metadata.aperture
     exposure_time = user_metadata.exposure_time or image_metadata.exposure_time
     iso = user_metadata.iso or image_metadata.iso
-    size_px = Size((image.width, image.height))
+    size_px = image_probe.size
 
     return PhotoInfo(
         source_path=resource.image_file_path,
@@ -107,3 +110,20 @@ def read_photo_info(resource: PhotoResourceRecord) -> PhotoInfo:
         genre=user_metadata.genre,
         size_px=size_px
     )
+
+
+# Probing is mostly waiting on file reads, so more probes than CPUs can run at once (same as ThreadPoolExecutor's
+# default). Each probe holds a file handle and decoder state while it runs, so the number in flight is limited
+# independently of the library size.
+PHOTO_PROBE_CONCURRENCY = min(32, (os.cpu_count() or 1) + 4)
+
+
+def read_photo_infos(resources: Sequence[PhotoResourceRecord], concurrency: int = PHOTO_PROBE_CONCURRENCY) \
+        -> list[PhotoInfo]:
+    """Reads many photos concurrently, with at most `concurrency` image files open at once. In the same order as
+        resources."""
+
+    if concurrency <= 1 or len(resources) <= 1:
+        return [read_photo_info(r) for r in resources]
+    with ThreadPool(min(concurrency, len(resources))) as pool:
+        return pool.map(read_photo_info, resources)
@@ -10,6 +10,13 @@ SUPPORTED_IMAGE_EXTENSIONS = (
     '.png'
 )
 
+GRAPHIC_EXTENSIONS = (
+    '.png',
+    '.svg'
+)
+"""Site graphics, which are optimised losslessly (see buildtool.build.asset.graphic). Only allowed in the image
+    resources, not photos."""
+
 
 def get_image_resources_path(resources_path: Path) -> Path:
     return resources_path / 'image'
@@ -19,5 +26,9 @@ def get_image_resources(resources_path: Path) -> Iterable[tuple[Path, Path]]:
     """Yields (full_path, relative_path)"""
 
     root = get_image_resources_path(resources_path)
-    for file in find_files(root, SUPPORTED_IMAGE_EXTENSIONS):
+    for file in find_files(root, {*SUPPORTED_IMAGE_EXTENSIONS, *GRAPHIC_EXTENSIONS}):
         yield file, file.relative_to(root)
+
+
+def is_graphic_file(path: Path) -> bool:
+    return path.name.lower().endswith(GRAPHIC_EXTENSIONS)
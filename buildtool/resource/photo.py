@@ -1,13 +1,12 @@
-from collections.abc import Iterable
 from dataclasses import dataclass
 from functools import partial
 from pathlib import Path
 import logging
-import os
 from typing import Annotated
 
 import pydantic
 
+from buildtool.file_scan import FileSnapshot, scan_files
 from buildtool.resource.image import SUPPORTED_IMAGE_EXTENSIONS
 from buildtool.types import Aperture, ExposureTime, FocalLength, ISO, NonEmptyStr, PartialDate, PhotoGenre
 
@@ -28,14 +27,12 @@ class PhotoResourceRecord:
 METADATA_FILE_EXTENSION = '.json'
 
 
-def get_image_files(dir_path: Path, file_names: Iterable[str]) -> list[Path]:
-    return [
-        dir_path / f for f in file_names
-        if any(f.lower().endswith(e) for e in SUPPORTED_IMAGE_EXTENSIONS)]
+def is_image_file(path: Path) -> bool:
+    return path.name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS)
 
 
-def get_photo_metadata_files(dir_path: Path, file_names: Iterable[str]) -> list[Path]:
-    return [dir_path / f for f in file_names if f.lower().endswith(METADATA_FILE_EXTENSION)]
+def is_photo_metadata_file(path: Path) -> bool:
+    return path.name.lower().endswith(METADATA_FILE_EXTENSION)
 
 
 def image_file_from_metadata_file(metadata_file: Path) -> Path:
@@ -46,46 +43,51 @@ def image_file_from_metadata_file(metadata_file: Path) -> Path:
     return metadata_file.with_suffix('')
 
 
+def scan_photo_files(root: Path) -> FileSnapshot:
+    logger.info(f'Finding photos in: "{root}"')
+    # Photo directories can be large, and are often grouped into subdirectories (e.g. by date).
+    return scan_files(root, parallel=True)
+
+
 def find_photos(root: Path, skip_invalid: bool = False) -> list[PhotoResourceRecord]:
     """Finds all photos within the directory."""
 
-    logger.info(f'Finding photos in: "{root}"')
+    return pair_photo_files(scan_photo_files(root), skip_invalid)
+
+
+def pair_photo_files(snapshot: FileSnapshot, skip_invalid: bool = False) -> list[PhotoResourceRecord]:
+    """Matches up image files and metadata files found by a scan."""
+
+    metadata_files = [f for f in snapshot if is_photo_metadata_file(f)]
+    expected_image_files = {image_file_from_metadata_file(f) for f in metadata_files}
+
+    for f in snapshot:
+        if is_image_file(f) and f not in expected_image_files:
+            if skip_invalid:
+                logger.warning(f'Image file with no metadata file: {f}')
+            else:
+                raise RuntimeError(f'Image file with no metadata file: {f}')
+
     records: list[PhotoResourceRecord] = []
-    for dir_path, _subdirs, files in os.walk(root):
-        dir_path = Path(dir_path)
-        files = sorted(files)
-        metadata_files = get_photo_metadata_files(dir_path, files)
-        logger.debug(f'Metadata files in "{dir_path}" : {metadata_files}')
-        image_files = get_image_files(dir_path, files)
-        logger.debug(f'Image files in "{dir_path}" : {image_files}')
-        expected_image_files = [image_file_from_metadata_file(f) for f in metadata_files]
-        logger.debug(f'Expected image files in "{dir_path}" : {expected_image_files}')
-
-        for f in image_files:
-            if f not in expected_image_files:
-                if skip_invalid:
-                    logger.warning(f'Image file with no metadata file: {f}')
-                else:
-                    raise RuntimeError(f'Image file with no metadata file: {f}')
-
-        for metadata_file, image_file in zip(metadata_files, expected_image_files):
-            logger.debug(f'Resolved metadata file to image file: "{metadata_file}" -> "{image_file}"')
-            if not image_file.exists():
-                error_msg = f'Metadata file with no image file: "{metadata_file}"'
-                if skip_invalid:
-                    logger.warning(error_msg)
-                    continue
-                else:
-                    raise RuntimeError(error_msg)
-            if not image_file.suffix.lower() in SUPPORTED_IMAGE_EXTENSIONS:
-                error_msg = f'Unsupported image format: "{image_file}"'
-                if skip_invalid:
-                    logger.warning(error_msg)
-                    continue
-                else:
-                    raise RuntimeError(error_msg)
-            record = PhotoResourceRecord(image_file, metadata_file)
-            records.append(record)
+    for metadata_file in metadata_files:
+        image_file = image_file_from_metadata_file(metadata_file)
+        logger.debug(f'Resolved metadata file to image file: "{metadata_file}" -> "{image_file}"')
+        if image_file not in snapshot:
+            error_msg = f'Metadata file with no image file: "{metadata_file}"'
+            if skip_invalid:
+                logger.warning(error_msg)
+                continue
+            else:
+                raise RuntimeError(error_msg)
+        if not is_image_file(image_file):
+            error_msg = f'Unsupported image format: "{image_file}"'
+            if skip_invalid:
+                logger.warning(error_msg)
+                continue
+            else:
+                raise RuntimeError(error_msg)
+        record = PhotoResourceRecord(image_file, metadata_file)
+        records.append(record)
     return records
 
 
@@ -0,0 +1,626 @@
+"""Serves a built site locally the way the production host would, so its performance can be tested before deploying.
+    Unlike http.server, it negotiates compression (precompressed .br/.zst/.gz files if there are any, otherwise text is
+    compressed on the fly), sends strong ETags from the output manifest, answers conditional and range requests, and
+    sends the headers from _headers.json. Optionally throttles bandwidth and adds latency to simulate a slow link.
+
+Usage: python -m buildtool serve [-o BUILD_PATH] [-p PORT] [--link slow-4g]"""
+
+import argparse
+import asyncio
+from collections.abc import Callable, Mapping, Sequence
+from dataclasses import dataclass
+import email.utils
+import gzip
+import json
+import logging
+import mimetypes
+import os
+from pathlib import Path
+import posixpath
+import time
+from urllib.parse import unquote, urlsplit
+
+from buildtool.types import URLPath
+from buildtool.url import HEADERS_JSON_URL, HEADERS_URL, MANIFEST_URL
+from buildtool.utility import hash_file
+
+
+logger = logging.getLogger(__name__)
+
+
+# HTTP content coding -> precompressed file suffix.
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'zstd': '.zst', 'gzip': '.gz'}
+# Used to break ties between encodings the client accepts equally.
+ENCODING_PREFERENCE = ('br', 'zstd', 'gzip')
+# Hosts compress these on the fly.
+COMPRESSIBLE_SUFFIXES = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.xml', '.webmanifest')
+# Host configuration which is read by the host rather than served.
+UNSERVED_URLS = (HEADERS_URL, HEADERS_JSON_URL)
+NOT_FOUND_PAGE_URL = URLPath('/404.html')
+
+SEND_CHUNK_SIZE = 64 * 1024
+MAX_REQUEST_HEADERS = 100
+
+
+def get_dynamic_encoders() -> dict[str, Callable[[bytes], bytes]]:
+    """Encodings to compress with on the fly. Brotli and zstd are only available if their packages are installed."""
+
+    encoders: dict[str, Callable[[bytes], bytes]] = {
+        'gzip': lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+    }
+    try:
+        import brotli
+        # Roughly the level CDNs use for dynamic compression.
+        encoders['br'] = lambda data: brotli.compress(data, quality=5)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        encoders['zstd'] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+    except ImportError:
+        pass
+    return encoders
+
+
+def parse_accept_encoding(header: str | None) -> dict[str, float]:
+    """Content coding -> q value. "*" applies to codings which aren't listed."""
+
+    accepted: dict[str, float] = {}
+    if not header:
+        return accepted
+    for item in header.split(','):
+        coding, *params = (p.strip() for p in item.split(';'))
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str | None, available: Sequence[str]) -> str | None:
+    """The best available content coding the client accepts, or None for no encoding."""
+
+    accepted = parse_accept_encoding(accept_encoding)
+    default_q = accepted.get('*', 0.0)
+    candidates = [(accepted.get(e, default_q), -ENCODING_PREFERENCE.index(e), e) for e in available]
+    candidates = [c for c in candidates if c[0] > 0]
+    if not candidates:
+        return None
+    return max(candidates)[2]
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parses a Range header for a single byte range, returning the inclusive (first, last) bytes.
+        Returns None if the header should be ignored (invalid or multiple ranges, which needn't be supported).
+        Raises RangeNotSatisfiable if the range is outside the content."""
+
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first_str, dash, last_str = ranges.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first_str:
+            # Suffix range, i.e. the last N bytes.
+            length = int(last_str)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        first = int(first_str)
+        last = int(last_str) if last_str else size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable()
+    if first > last:
+        return None
+    return first, min(last, size - 1)
+
+
+def parse_etags(header: str) -> list[str]:
+    """Entity tags of an If-Match or If-None-Match header, with weakness indicators removed."""
+
+    return [t.strip().removeprefix('W/') for t in header.split(',') if t.strip()]
+
+
+def format_http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value: str) -> float | None:
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class HeaderRule:
+    path: str
+    headers: Mapping[str, str]
+
+    def matches(self, path: str) -> bool:
+        if self.path.endswith('*'):
+            return path.startswith(self.path[:-1])
+        return path == self.path
+
+
+@dataclass(frozen=True)
+class Representation:
+    """One encoding of a file's content."""
+
+    encoding: str | None
+    etag: str
+    size: int
+    path: Path | None
+    """File to send, if not data."""
+    data: bytes | None = None
+
+
+class Site:
+    """The files of a built site. Reloads the manifest and headers when the site is rebuilt."""
+
+    def __init__(self, build_path: Path) -> None:
+        self.build_path = build_path.resolve()
+        self.encoders = get_dynamic_encoders()
+        self._loaded_mtime: float | None = None
+        self._content_hashes: dict[str, str] = {}
+        self.header_rules: list[HeaderRule] = []
+        # (path, mtime, size) -> content hash, for files which aren't in the manifest or have changed since.
+        self._hash_cache: dict[tuple[Path, int, int], str] = {}
+        # (ETag, encoding) -> compressed content.
+        self._compressed: dict[tuple[str, str], bytes] = {}
+
+    def refresh(self) -> None:
+        manifest_path = self.build_path / MANIFEST_URL.fs_path
+        try:
+            mtime = manifest_path.stat().st_mtime
+        except FileNotFoundError:
+            if self._loaded_mtime is None:
+                logger.warning(f'No manifest in "{self.build_path}", ETags are computed from file contents')
+                self.load_header_rules()
+                self._loaded_mtime = 0
+            return
+        if mtime == self._loaded_mtime:
+            return
+        if self._loaded_mtime is not None:
+            logger.info('Site was rebuilt, reloading manifest and headers')
+        manifest = json.loads(manifest_path.read_text(encoding='utf8'))
+        self._content_hashes = {url: record['sha256'] for url, record in manifest.items()}
+        self.load_header_rules()
+        self._compressed.clear()
+        self._loaded_mtime = mtime
+
+    def load_header_rules(self) -> None:
+        headers_path = self.build_path / HEADERS_JSON_URL.fs_path
+        if headers_path.is_file():
+            self.header_rules = [HeaderRule(r['path'], r['headers'])
+                for r in json.loads(headers_path.read_text(encoding='utf8'))]
+        else:
+            self.header_rules = []
+
+    def resolve(self, path: str) -> URLPath | None:
+        """Finds the file for a request path, like the host does: directories serve their index.html, and pages can be
+            requested without .html."""
+
+        if '\0' in path:
+            return None
+        normalised = posixpath.normpath(path)
+        if path.endswith('/') and normalised != '/':
+            normalised += '/'
+        candidates = [normalised + 'index.html'] if normalised.endswith('/') \
+            else [normalised, normalised + '.html', normalised + '/index.html']
+        for candidate in candidates:
+            url = URLPath(candidate)
+            if url in UNSERVED_URLS:
+                continue
+            # normpath already removed "..". Symlinks are followed because fast builds link to the resources.
+            if (self.build_path / url.fs_path).is_file():
+                return url
+        return None
+
+    def get_headers(self, path: str) -> dict[str, str]:
+        """Headers from the site's header rules. Every matching rule applies, later rules take precedence."""
+
+        headers: dict[str, str] = {}
+        for rule in self.header_rules:
+            if rule.matches(path):
+                headers.update(rule.headers)
+        return headers
+
+    def get_content_hash(self, url: URLPath, file_path: Path, stat: os.stat_result) -> str:
+        manifest_hash = self._content_hashes.get(str(url))
+        key = (file_path, stat.st_mtime_ns, stat.st_size)
+        # Unless the file was modified after the build.
+        if manifest_hash is not None and (self._loaded_mtime or 0) >= stat.st_mtime:
+            return manifest_hash
+        if key not in self._hash_cache:
+            self._hash_cache[key] = hash_file(file_path)
+        return self._hash_cache[key]
+
+    async def get_representation(self, url: URLPath, accept_encoding: str | None) -> Representation:
+        file_path = self.build_path / url.fs_path
+        stat = file_path.stat()
+        content_hash = self.get_content_hash(url, file_path, stat)
+        identity = Representation(None, f'"{content_hash}"', stat.st_size, file_path)
+
+        precompressed: dict[str, Path] = {}
+        for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+            precompressed_path = file_path.with_name(file_path.name + suffix)
+            # Ignore stale precompressed files, which would serve old content.
+            if precompressed_path.is_file() and precompressed_path.stat().st_mtime >= stat.st_mtime:
+                precompressed[encoding] = precompressed_path
+        dynamic = self.encoders if url.suffix in COMPRESSIBLE_SUFFIXES else {}
+
+        encoding = choose_encoding(accept_encoding, [e for e in ENCODING_PREFERENCE if e in precompressed or e in dynamic])
+        if encoding is None:
+            return identity
+        # Each encoding is a different representation, so needs a different strong ETag.
+        etag = f'"{content_hash}-{encoding}"'
+        if encoding in precompressed:
+            return Representation(encoding, etag, precompressed[encoding].stat().st_size, precompressed[encoding])
+        key = (etag, encoding)
+        if key not in self._compressed:
+            data = await asyncio.to_thread(file_path.read_bytes)
+            self._compressed[key] = await asyncio.to_thread(dynamic[encoding], data)
+        data = self._compressed[key]
+        return Representation(encoding, etag, len(data), None, data)
+
+    def is_negotiated(self, url: URLPath) -> bool:
+        """If the response depends on Accept-Encoding."""
+
+        file_path = self.build_path / url.fs_path
+        return url.suffix in COMPRESSIBLE_SUFFIXES \
+            or any(file_path.with_name(file_path.name + s).is_file() for s in PRECOMPRESSED_SUFFIXES.values())
+
+
+@dataclass(frozen=True)
+class LinkProfile:
+    kbit_per_second: float | None
+    """None for unlimited."""
+    latency_ms: float
+
+
+# Similar to the browser developer tools presets.
+LINK_PROFILES = {
+    'slow-3g': LinkProfile(400, 2000),
+    'fast-3g': LinkProfile(1440, 563),
+    'slow-4g': LinkProfile(1600, 150),
+    '4g': LinkProfile(9000, 85),
+}
+
+
+class Link:
+    """Simulates the network between the server and one client. Bandwidth is shared by all connections, and every
+        request and new connection waits a round trip."""
+
+    def __init__(self, profile: LinkProfile | None) -> None:
+        self.bytes_per_second = profile.kbit_per_second * 1000 / 8 if profile and profile.kbit_per_second else None
+        self.latency = profile.latency_ms / 1000 if profile else 0
+        # Event loop time when the link is next free.
+        self._free_time = 0.0
+
+    async def round_trip(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        if self.bytes_per_second is None:
+            writer.write(data)
+            await writer.drain()
+            return
+        loop = asyncio.get_running_loop()
+        # Small chunks so concurrent responses interleave like they would on a real link.
+        chunk_size = max(1024, int(self.bytes_per_second / 20))
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            now = loop.time()
+            self._free_time = max(now, self._free_time) + len(chunk) / self.bytes_per_second
+            await asyncio.sleep(self._free_time - now)
+            writer.write(chunk)
+            await writer.drain()
+
+
+class BadRequest(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Request:
+    method: str
+    target: str
+    version: str
+    headers: Mapping[str, str]
+    """Lowercase names."""
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+
+async def read_request(reader: asyncio.StreamReader) -> Request | None:
+    """Reads the next request of a connection, or returns None if the client closed it."""
+
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').rstrip('\r\n').split(' ')
+    if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+        raise BadRequest(f'Invalid request line: {line!r}')
+    method, target, version = parts
+    headers: dict[str, str] = {}
+    for _ in range(MAX_REQUEST_HEADERS):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, colon, value = line.decode('latin-1').partition(':')
+        if not colon:
+            raise BadRequest(f'Invalid header: {line!r}')
+        name = name.strip().lower()
+        headers[name] = f'{headers[name]}, {value.strip()}' if name in headers else value.strip()
+    else:
+        raise BadRequest('Too many headers')
+    if 'transfer-encoding' in headers:
+        raise BadRequest('Request bodies aren\'t supported')
+    if content_length := headers.get('content-length'):
+        await reader.readexactly(int(content_length))
+    return Request(method, target, version, headers)
+
+
+@dataclass
+class Response:
+    status: int
+    headers: dict[str, str]
+    representation: Representation | None = None
+    range: tuple[int, int] | None = None
+    """Inclusive byte range of the representation to send."""
+    body: bytes = b''
+
+    @property
+    def content_length(self) -> int:
+        if self.representation is None:
+            return len(self.body)
+        if self.range is not None:
+            return self.range[1] - self.range[0] + 1
+        return self.representation.size
+
+
+STATUS_REASONS = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 412: 'Precondition Failed', 416: 'Range Not Satisfiable'}
+
+
+class PreviewServer:
+    def __init__(self, site: Site, link: Link, max_connections: int, keep_alive_timeout: float) -> None:
+        self.site = site
+        self.link = link
+        self.keep_alive_timeout = keep_alive_timeout
+        # Connections over the limit are accepted but wait until another connection closes.
+        self._connection_slots = asyncio.Semaphore(max_connections)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        client = f'{peer[0]}:{peer[1]}' if peer else '?'
+        try:
+            async with self._connection_slots:
+                # TCP handshake.
+                await self.link.round_trip()
+                while True:
+                    try:
+                        request = await asyncio.wait_for(read_request(reader), self.keep_alive_timeout)
+                    except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                        break
+                    except (BadRequest, ValueError) as e:
+                        logger.warning(f'{client} bad request: {e}')
+                        await self.send_response(writer, Response(400, {}, body=b'Bad request\n'), 'GET', False)
+                        break
+                    if request is None:
+                        break
+                    response = await self.handle_request(request)
+                    keep_alive = request.keep_alive
+                    await self.send_response(writer, response, request.method, keep_alive)
+                    logger.info(f'{client} "{request.method} {request.target}" {response.status}'
+                        f' {response.content_length if request.method != "HEAD" else 0}'
+                        + (f' {response.representation.encoding}' if response.representation
+                            and response.representation.encoding else ''))
+                    if not keep_alive:
+                        break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request: Request) -> Response:
+        if request.method not in ('GET', 'HEAD'):
+            return Response(405, {'Allow': 'GET, HEAD'}, body=b'Method not allowed\n')
+        target = urlsplit(request.target)
+        path = unquote(target.path)
+        if not path.startswith('/'):
+            return Response(400, {}, body=b'Bad request\n')
+
+        self.site.refresh()
+        url = self.site.resolve(path)
+        status = 200
+        if url is None:
+            if (self.site.build_path / NOT_FOUND_PAGE_URL.fs_path).is_file():
+                url = NOT_FOUND_PAGE_URL
+                status = 404
+            else:
+                return Response(404, {}, body=b'Not found\n')
+
+        # Ranges of compressed content are unusual and awkward for clients, hosts serve them uncompressed.
+        range_header = request.headers.get('range') if status == 200 and request.method == 'GET' else None
+        representation = await self.site.get_representation(
+            url, None if range_header else request.headers.get('accept-encoding'))
+        mtime = (self.site.build_path / url.fs_path).stat().st_mtime
+
+        headers = {
+            'Content-Type': get_content_type(url),
+            'ETag': representation.etag,
+            'Last-Modified': format_http_date(mtime),
+            'Accept-Ranges': 'bytes',
+        }
+        if representation.encoding is not None:
+            headers['Content-Encoding'] = representation.encoding
+        if self.site.is_negotiated(url):
+            headers['Vary'] = 'Accept-Encoding'
+        headers.update(self.site.get_headers(path))
+
+        if status != 200:
+            return Response(status, headers, representation)
+
+        if (if_match := request.headers.get('if-match')) is not None:
+            # Strong comparison.
+            if if_match.strip() != '*' and representation.etag not in [t.strip() for t in if_match.split(',')]:
+                return Response(412, {}, body=b'Precondition failed\n')
+        if (if_none_match := request.headers.get('if-none-match')) is not None:
+            if if_none_match.strip() == '*' or representation.etag in parse_etags(if_none_match):
+                return Response(304, get_not_modified_headers(headers))
+        elif (if_modified_since := request.headers.get('if-modified-since')) is not None:
+            since = parse_http_date(if_modified_since)
+            # HTTP dates have 1 second resolution.
+            if since is not None and int(mtime) <= since:
+                return Response(304, get_not_modified_headers(headers))
+
+        if range_header is not None and self.is_range_current(request.headers.get('if-range'), representation, mtime):
+            try:
+                byte_range = parse_range(range_header, representation.size)
+            except RangeNotSatisfiable:
+                return Response(416, {'Content-Range': f'bytes */{representation.size}'},
+                    body=b'Range not satisfiable\n')
+            if byte_range is not None:
+                first, last = byte_range
+                headers['Content-Range'] = f'bytes {first}-{last}/{representation.size}'
+                return Response(206, headers, representation, byte_range)
+
+        return Response(200, headers, representation)
+
+    @staticmethod
+    def is_range_current(if_range: str | None, representation: Representation, mtime: float) -> bool:
+        """If a range request should get a range rather than the whole representation."""
+
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith(('"', 'W/')):
+            return if_range == representation.etag
+        since = parse_http_date(if_range)
+        return since is not None and int(mtime) == since
+
+    async def send_response(self, writer: asyncio.StreamWriter, response: Response, method: str,
+            keep_alive: bool) -> None:
+        headers = {
+            'Date': format_http_date(time.time()),
+            'Server': 'buildtool-preview',
+            **response.headers,
+        }
+        if response.status != 304:
+            headers['Content-Length'] = str(response.content_length)
+            headers.setdefault('Content-Type', 'text/plain; charset=utf-8')
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        head = f'HTTP/1.1 {response.status} {STATUS_REASONS[response.status]}\r\n' \
+            + ''.join(f'{name}: {value}\r\n' for name, value in headers.items()) + '\r\n'
+
+        await self.link.round_trip()
+        await self.link.send(writer, head.encode('latin-1'))
+        if method == 'HEAD' or response.status == 304:
+            return
+        if response.representation is None:
+            await self.link.send(writer, response.body)
+        elif response.representation.data is not None:
+            first, last = response.range or (0, response.representation.size - 1)
+            await self.link.send(writer, response.representation.data[first:last + 1])
+        else:
+            assert response.representation.path is not None
+            await self.send_file(writer, response.representation.path, response.range)
+
+    async def send_file(self, writer: asyncio.StreamWriter, path: Path, byte_range: tuple[int, int] | None) -> None:
+        with open(path, 'rb') as f:
+            if byte_range is None:
+                remaining = os.fstat(f.fileno()).st_size
+            else:
+                f.seek(byte_range[0])
+                remaining = byte_range[1] - byte_range[0] + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(SEND_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await self.link.send(writer, chunk)
+
+
+def get_content_type(url: URLPath) -> str:
+    content_type, _ = mimetypes.guess_type(url.name)
+    if content_type is None:
+        return 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json',
+            'image/svg+xml'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def get_not_modified_headers(headers: Mapping[str, str]) -> dict[str, str]:
+    """A 304 response has the headers the 200 response would have, except the ones describing the content."""
+
+    excluded = {'Content-Type', 'Content-Encoding', 'Accept-Ranges'}
+    return {name: value for name, value in headers.items() if name not in excluded}
+
+
+async def serve(build_path: Path, host: str, port: int, link_profile: LinkProfile | None, max_connections: int,
+        keep_alive_timeout: float) -> None:
+    site = Site(build_path)
+    site.refresh()
+    server = PreviewServer(site, Link(link_profile), max_connections, keep_alive_timeout)
+    async with await asyncio.start_server(server.handle_connection, host, port) as tcp_server:
+        logger.info(f'Serving "{build_path}" at http://{host}:{port}/'
+            + (f' over a simulated {link_profile.kbit_per_second or "unlimited "}kbit/s,'
+                f' {link_profile.latency_ms:g}ms latency link' if link_profile else ''))
+        logger.info(f'Compression: {", ".join(e for e in ENCODING_PREFERENCE if e in site.encoders)}')
+        await tcp_server.serve_forever()
+
+
+def main(argv: Sequence[str] | None = None, prog: str | None = None) -> None:
+    """argv are the command line arguments (default: sys.argv), and prog the command name for help."""
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(prog=prog, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-o', '--output-path', type=Path, default=Path('./site'), help='Built site directory')
+    arg_parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    arg_parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on')
+    arg_parser.add_argument('--link', choices=list(LINK_PROFILES), default=None, help='Simulate a slow link')
+    arg_parser.add_argument('--bandwidth-kbit', type=float, default=None, help='Simulated bandwidth (overrides --link)')
+    arg_parser.add_argument('--latency-ms', type=float, default=None, help='Simulated round trip time (overrides --link)')
+    arg_parser.add_argument('--max-connections', type=int, default=32, help='Connections served at once, others wait')
+    arg_parser.add_argument('--keep-alive-timeout', type=float, default=5, help='Seconds before idle connections close')
+    args = arg_parser.parse_args(argv)
+
+    link_profile = LINK_PROFILES[args.link] if args.link else None
+    if args.bandwidth_kbit is not None or args.latency_ms is not None:
+        link_profile = LinkProfile(
+            args.bandwidth_kbit if args.bandwidth_kbit is not None else link_profile and link_profile.kbit_per_second,
+            args.latency_ms if args.latency_ms is not None else link_profile.latency_ms if link_profile else 0)
+
+    try:
+        asyncio.run(serve(args.output_path, args.host, args.port, link_profile, args.max_connections,
+            args.keep_alive_timeout))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
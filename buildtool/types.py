@@ -4,10 +4,11 @@ import datetime as dt
 from decimal import Decimal
 from enum import StrEnum
 from pathlib import Path, PurePosixPath
-from typing import Annotated, NewType, TypeVar
+from typing import Annotated, Any, NewType, TypeVar
 
 from annotated_types import Gt
 import pydantic
+from pydantic_core import core_schema
 
 
 N = TypeVar('N')
@@ -43,6 +44,16 @@ class URLPath(PurePosixPath):
     def fs_path(self) -> Path:
         return Path(*self.parts[1:])
 
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type: Any, handler: pydantic.GetCoreSchemaHandler) \
+            -> core_schema.CoreSchema:
+        # Represented as a string in JSON.
+        from_str_schema = core_schema.no_info_after_validator_function(cls, core_schema.str_schema())
+        return core_schema.json_or_python_schema(
+            json_schema=from_str_schema,
+            python_schema=core_schema.union_schema([core_schema.is_instance_schema(cls), from_str_schema]),
+            serialization=core_schema.plain_serializer_function_ser_schema(str))
+
 
 @dataclass(frozen=True)
 class PartialDate:
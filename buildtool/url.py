@@ -1,3 +1,4 @@
+import hashlib
 from pathlib import PurePosixPath
 
 from buildtool.types import ImageID, PhotoID, URLPath
@@ -34,15 +35,38 @@ def get_image_srcset_url(base_url: URLPath, srcset_tag: str | None) -> URLPath:
     if srcset_tag is None:
         return base_url
     else:
-        assert srcset_tag.isalnum()
-        # Add the srcset tag to the end of the name
-        parts = base_url.name.split('.')
-        parts[0] += f'-{srcset_tag}'
-        name = '.'.join(parts)
-        url = base_url.with_name(name)
-        return url
+        return add_url_name_tag(base_url, srcset_tag)
+
+
+def add_url_name_tag(url: URLPath, tag: str) -> URLPath:
+    """Adds a tag to the end of the name, before the extension. E.g. /x/name.jpg -> /x/name-tag.jpg"""
+
+    assert tag.isalnum()
+    parts = url.name.split('.')
+    parts[0] += f'-{tag}'
+    name = '.'.join(parts)
+    return url.with_name(name)
+
+
+def get_fingerprinted_url(url: URLPath, content: str) -> URLPath:
+    """Makes the URL unique to the content, so it can be cached forever."""
+
+    return add_url_name_tag(url, hashlib.sha256(content.encode('utf8')).hexdigest()[:10])
 
 
 ASSETS_CSS_URL = ASSETS_URL / 'css'
 
 ASSETS_JS_URL = ASSETS_URL / 'js'
+
+ASSETS_SEARCH_URL = ASSETS_URL / 'search'
+
+HEADERS_URL = URLPath('/_headers')
+HEADERS_JSON_URL = URLPath('/_headers.json')
+
+MANIFEST_URL = URLPath('/_manifest.json')
+
+# Only in shard builds, read by the merge build.
+SHARD_MANIFEST_URL = URLPath('/_shard.json')
+
+# Must be at the root so it can control every page.
+SERVICE_WORKER_URL = URLPath('/sw.js')
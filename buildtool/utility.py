@@ -1,24 +1,28 @@
 from collections.abc import Collection, Iterator
 import datetime as dt
 from functools import cache
+import hashlib
 from pathlib import Path
-import os
 import subprocess
 
 import dateutil.parser
 
+from buildtool.file_scan import scan_files
+
 
 def remove_dashes(s: str) -> str:
     return s.replace('-', '').replace('_', '')
 
 
 def find_files(root: Path, extensions: Collection[str]) -> Iterator[Path]:
-    for dir_path, _subdirs, files in os.walk(root):
-        dir_path = Path(dir_path)
-        file_paths = [dir_path / f for f in files]
-        if extensions:
-            file_paths = [f for f in file_paths if f.suffix in extensions]
-        yield from file_paths
+    yield from scan_files(root, extensions)
+
+
+def hash_file(path: Path) -> str:
+    """Computes the SHA-256 hex digest of a file's content."""
+
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
 
 
 def parse_datetime(s: str) -> dt.datetime:
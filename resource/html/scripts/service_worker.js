@@ -0,0 +1,120 @@
+// Generated by the build. Caches the site shell up front, and pages and images as they are used or prefetched.
+
+// Changes on every deploy that changes any content, which evicts everything cached by the previous version.
+const CACHE_NAME = {{ cache_name|tojson }};
+const PRECACHE_URLS = {{ precache_urls|tojson }};
+const IMMUTABLE_URL_PREFIXES = {{ immutable_url_prefixes|tojson }};
+const IMAGE_URL_PREFIX = {{ image_url_prefix|tojson }};
+
+// Pages and images are cached as they're used, so are limited, oldest out first. They're in separate caches so that
+// browsing a large gallery's images doesn't evict pages.
+const PAGE_CACHE = {name: `${CACHE_NAME}-pages`, maxEntries: 50};
+const IMAGE_CACHE = {name: `${CACHE_NAME}-images`, maxEntries: 300};
+// Fingerprinted assets, which are few, so aren't limited.
+const SHELL_CACHE = {name: CACHE_NAME, maxEntries: null};
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE.name)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    const current = [SHELL_CACHE.name, PAGE_CACHE.name, IMAGE_CACHE.name];
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => !current.includes(name)).map(name => caches.delete(name))))
+            .then(() => self.clients.claim()));
+});
+
+function isSameOrigin(url) {
+    return new URL(url).origin === self.location.origin;
+}
+
+// The runtime cache for a same origin URL, or null if it isn't cached.
+function getRuntimeCache(url) {
+    const path = new URL(url).pathname;
+    if (IMMUTABLE_URL_PREFIXES.some(prefix => path.startsWith(prefix))) {
+        return SHELL_CACHE;
+    }
+    if (path.startsWith(IMAGE_URL_PREFIX)) {
+        return IMAGE_CACHE;
+    }
+    return null;
+}
+
+async function putLimited(runtimeCache, request, response) {
+    const cache = await caches.open(runtimeCache.name);
+    await cache.put(request, response);
+    if (runtimeCache.maxEntries !== null) {
+        // Keys are in the order they were added, so the oldest are first.
+        const keys = await cache.keys();
+        const excess = keys.slice(0, Math.max(0, keys.length - runtimeCache.maxEntries));
+        await Promise.all(excess.map(key => cache.delete(key)));
+    }
+}
+
+// Updates the cache in the background, keeping the service worker alive until it's done.
+function updateCache(event, runtimeCache, fetched) {
+    event.waitUntil(fetched
+        .then(response => response.ok ? putLimited(runtimeCache, event.request, response) : undefined)
+        .catch(() => {}));
+}
+
+async function cacheFirst(event, runtimeCache) {
+    const cached = await caches.match(event.request, {cacheName: runtimeCache.name});
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(event.request);
+    updateCache(event, runtimeCache, Promise.resolve(response.clone()));
+    return response;
+}
+
+async function staleWhileRevalidate(event, runtimeCache) {
+    const cached = await caches.match(event.request, {cacheName: runtimeCache.name});
+    const fetched = fetch(event.request);
+    updateCache(event, runtimeCache, fetched.then(response => response.clone()));
+    return cached || fetched;
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET' || !isSameOrigin(request.url)) {
+        return;
+    }
+    const runtimeCache = getRuntimeCache(request.url);
+    if (runtimeCache) {
+        event.respondWith(cacheFirst(event, runtimeCache));
+    } else if (request.mode === 'navigate') {
+        event.respondWith(staleWhileRevalidate(event, PAGE_CACHE));
+    }
+});
+
+async function prefetch(urls) {
+    for (const url of urls) {
+        if (!isSameOrigin(url)) {
+            continue;
+        }
+        // Anything which isn't an asset is a page.
+        const runtimeCache = getRuntimeCache(url) || PAGE_CACHE;
+        if (await caches.match(url, {cacheName: runtimeCache.name})) {
+            continue;
+        }
+        try {
+            const response = await fetch(url, {priority: 'low'});
+            if (response.ok) {
+                await putLimited(runtimeCache, url, response);
+            }
+        } catch (e) {
+            // Only an optimisation, doesn't matter if it fails.
+        }
+    }
+}
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'prefetch') {
+        event.waitUntil(prefetch(event.data.urls));
+    }
+});
@@ -0,0 +1,26 @@
+// Prefetch the neighbouring photos when idle, so navigating between photos is instant.
+// The service worker does the fetching so the responses land in its cache.
+
+function prefetchNeighbours() {
+    const controller = navigator.serviceWorker && navigator.serviceWorker.controller;
+    if (!controller) {
+        // Not installed yet (e.g. first visit), next page load will do it.
+        return;
+    }
+    const urls = [];
+    document.querySelectorAll('[data-prefetch-image]').forEach(link => {
+        urls.push(link.href);
+        urls.push(new URL(link.dataset.prefetchImage, document.baseURI).href);
+    });
+    if (urls.length) {
+        controller.postMessage({type: 'prefetch', urls: urls});
+    }
+}
+
+window.addEventListener('load', () => {
+    if ('requestIdleCallback' in window) {
+        requestIdleCallback(prefetchNeighbours, {timeout: 5000});
+    } else {
+        setTimeout(prefetchNeighbours, 1000);
+    }
+});
@@ -0,0 +1,190 @@
+// Photo search using the index prebuilt by the site build (see buildtool/build/asset/search.py).
+// Only the manifest, the term shards of the query's words and the documents of the shown results are fetched.
+
+const SEARCH_INDEX_VERSION = 1;
+const MAX_RESULTS = 24;
+// Must match the build's tokeniser.
+const TOKEN_PATTERN = /[a-z0-9]+(?:\.[0-9]+)*/g;
+// Words the user is still typing match longer terms, but not as strongly as the whole word.
+const PREFIX_MATCH_WEIGHT = 0.5;
+
+function tokenise(text) {
+    const ascii = text.replace(/ƒ/g, 'f').normalize('NFKD').replace(/[^\x00-\x7f]/g, '').toLowerCase();
+    return ascii.match(TOKEN_PATTERN) || [];
+}
+
+// Postings are (document ID delta, score) pairs.
+function decodePostings(encoded) {
+    const postings = new Map();
+    let documentId = 0;
+    for (let i = 0; i < encoded.length; i += 2) {
+        documentId += encoded[i];
+        postings.set(documentId, encoded[i + 1]);
+    }
+    return postings;
+}
+
+class PhotoSearch {
+    // indexUrl must be absolute. fetchJSON is replaceable so the benchmark can run this outside a browser.
+    constructor(indexUrl, fetchJSON = url => fetch(url).then(response => {
+        if (!response.ok) {
+            throw new Error(`Failed to fetch ${url}: ${response.status}`);
+        }
+        return response.json();
+    })) {
+        this.indexUrl = indexUrl;
+        this.fetchJSON = fetchJSON;
+        // URL -> promise of the content. Files are fingerprinted so never go stale.
+        this.files = new Map();
+    }
+
+    load(name) {
+        const url = new URL(name, this.indexUrl).href;
+        if (!this.files.has(url)) {
+            const content = this.fetchJSON(url);
+            // Allow retrying after a network error.
+            content.catch(() => this.files.delete(url));
+            this.files.set(url, content);
+        }
+        return this.files.get(url);
+    }
+
+    async loadManifest() {
+        const manifest = await this.load(this.indexUrl);
+        if (manifest.version !== SEARCH_INDEX_VERSION) {
+            throw new Error(`Unsupported search index version: ${manifest.version}`);
+        }
+        return manifest;
+    }
+
+    // Document ID -> score, for the terms matching a word.
+    async match(manifest, word, isPrefix) {
+        const shardName = manifest.shards[word.slice(0, manifest.shard_prefix_length)];
+        if (!shardName) {
+            return new Map();
+        }
+        const shard = await this.load(shardName);
+        // Short prefixes would need many shards, so only match whole terms.
+        if (!isPrefix || word.length < manifest.shard_prefix_length) {
+            return Object.hasOwn(shard, word) ? decodePostings(shard[word]) : new Map();
+        }
+        const scores = new Map();
+        for (const [term, encoded] of Object.entries(shard)) {
+            if (term.startsWith(word)) {
+                const weight = term === word ? 1 : PREFIX_MATCH_WEIGHT;
+                for (const [documentId, score] of decodePostings(encoded)) {
+                    scores.set(documentId, Math.max(scores.get(documentId) || 0, score * weight));
+                }
+            }
+        }
+        return scores;
+    }
+
+    // Photos matching every word of the query, best first. The last word is treated as a prefix unless followed by
+    // a space, so results update while typing.
+    async search(query, limit = MAX_RESULTS) {
+        const words = tokenise(query);
+        if (!words.length) {
+            return { total: 0, results: [] };
+        }
+        const manifest = await this.loadManifest();
+        const lastIsPrefix = !/\s$/.test(query);
+        const matches = await Promise.all(
+            words.map((word, i) => this.match(manifest, word, lastIsPrefix && i === words.length - 1)));
+
+        // Start from the rarest word, which has the fewest candidates.
+        matches.sort((a, b) => a.size - b.size);
+        const scores = new Map();
+        for (const [documentId, score] of matches[0]) {
+            let total = score;
+            for (const other of matches.slice(1)) {
+                const otherScore = other.get(documentId);
+                if (otherScore === undefined) {
+                    total = null;
+                    break;
+                }
+                total += otherScore;
+            }
+            if (total !== null) {
+                scores.set(documentId, total);
+            }
+        }
+
+        // Documents are newest first, so ties are broken by recency.
+        const ranked = [...scores].sort((a, b) => b[1] - a[1] || a[0] - b[0]).slice(0, limit);
+        const perChunk = manifest.documents_per_chunk;
+        const results = await Promise.all(ranked.map(async ([documentId]) => {
+            const chunk = await this.load(manifest.documents[Math.floor(documentId / perChunk)]);
+            const [title, url, imageUrl, date, location] = chunk[documentId % perChunk];
+            return { title, url, imageUrl, date, location };
+        }));
+        return { total: scores.size, results };
+    }
+}
+
+function createResultItem(result) {
+    const item = document.createElement('li');
+    const link = document.createElement('a');
+    link.href = result.url;
+    const image = document.createElement('img');
+    image.src = result.imageUrl;
+    image.alt = '';
+    image.loading = 'lazy';
+    const title = document.createElement('span');
+    title.className = 'search-result-title';
+    title.textContent = result.title;
+    const details = document.createElement('span');
+    details.className = 'search-result-details';
+    details.textContent = result.location ? `${result.date} at ${result.location}` : result.date;
+    link.append(image, title, details);
+    item.append(link);
+    return item;
+}
+
+function initialiseSearchBox() {
+    const input = document.getElementById('photo-search');
+    const resultsList = document.getElementById('search-results');
+    const status = document.getElementById('search-status');
+    const search = new PhotoSearch(new URL(input.dataset.indexUrl, document.baseURI).href);
+
+    let latestQuery = 0;
+    async function update() {
+        const queryNumber = ++latestQuery;
+        const query = input.value;
+        let found;
+        try {
+            found = await search.search(query);
+        } catch (error) {
+            console.error(error);
+            status.textContent = 'Search is unavailable';
+            return;
+        }
+        // A later query may have finished first.
+        if (queryNumber !== latestQuery) {
+            return;
+        }
+        resultsList.replaceChildren(...found.results.map(createResultItem));
+        resultsList.hidden = !found.results.length;
+        if (!tokenise(query).length) {
+            status.textContent = '';
+        } else {
+            status.textContent = found.total === 1 ? '1 photo found' : `${found.total || 'No'} photos found`;
+        }
+    }
+
+    let timer;
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(update, 100);
+    });
+    // The user is probably about to search, so get the manifest ready.
+    input.addEventListener('focus', () => search.loadManifest().catch(() => {}), { once: true });
+}
+
+if (typeof document !== 'undefined') {
+    document.addEventListener('DOMContentLoaded', initialiseSearchBox);
+}
+
+if (typeof module !== 'undefined') {
+    module.exports = { PhotoSearch, tokenise };
+}